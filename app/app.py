@@ -14,6 +14,8 @@ if project_root not in sys.path:
 try:
     from src.loader import SystemLoader
     from src.pipeline import TNGTPipeline
+    from src.cache import ResultCache
+    from src.concurrency import InferenceExecutor, ExecutorBusyError
 except ImportError as e:
     st.error(f"Lỗi import module: {e}")
     st.stop()
@@ -24,47 +26,27 @@ st.set_page_config(page_title="TNGT IE", layout="wide", page_icon="⚡")
 NER_MODELS_LIST = ["PHOBERT", "CRF", "SVM", "LOGREG"]
 RE_MODELS_LIST = ["PHOBERT", "SVM", "RF", "LOGREG"]
 
-# HÀM LOAD TOÀN BỘ MODEL (CACHED) 
+# REGISTRY MODEL (CACHED): chỉ load model khi được chọn, warm trước model mặc định
 @st.cache_resource(show_spinner=False)
-def load_all_models_at_startup():
-    """Load TẤT CẢ model vào RAM khi khởi động."""
+def get_model_registry():
+    # Ngân sách RAM cho model theo config.MODEL_MEMORY_BUDGET_MB (biến môi trường TNGT_MODEL_MEMORY_MB)
     loader = SystemLoader()
-    model_store = {
-        "NER": {},
-        "RE": {}
-    }
-    
-    progress_bar = st.progress(0, text="Đang khởi tạo hệ thống...")
-    total_steps = len(NER_MODELS_LIST) + len(RE_MODELS_LIST)
-    step_count = 0
-
-    #Load All NER Models
-    for name in NER_MODELS_LIST:
-        step_count += 1
-        progress_bar.progress(step_count / total_steps, text=f"Đang tải NER Model: {name} ({step_count}/{total_steps})")
-        try:
-            model_store["NER"][name] = loader.load_ner_model(name)
-        except Exception as e:
-            print(f"Error loading NER {name}: {e}")
-            model_store["NER"][name] = None
-
-    #Load All RE Models
-    for name in RE_MODELS_LIST:
-        step_count += 1
-        progress_bar.progress(step_count / total_steps, text=f"Đang tải RE Model: {name} ({step_count}/{total_steps})")
-        try:
-            model_store["RE"][name] = loader.load_re_model(name)
-        except Exception as e:
-            print(f"Error loading RE {name}: {e}")
-            model_store["RE"][name] = None
-            
-    progress_bar.empty()
-    return model_store
-
-# GIAO DIỆN CHÍNH ---
-
-with st.spinner('Đang tải toàn bộ dữ liệu vào RAM (Lần đầu sẽ mất khoảng 1-2 phút)...'):
-    ALL_MODELS = load_all_models_at_startup()
+    loader.warm([("NER", NER_MODELS_LIST[0]), ("RE", RE_MODELS_LIST[0])])
+    return loader
+
+# Giới hạn số lượt inference chạy cùng lúc giữa mọi session (mỗi worker có số thread torch riêng)
+@st.cache_resource(show_spinner=False)
+def get_inference_executor():
+    return InferenceExecutor()
+
+# Cache kết quả dùng chung giữa các session: bài đã phân tích (hoặc chỉ sửa vài câu) trả về gần như ngay
+@st.cache_resource(show_spinner=False)
+def get_result_cache():
+    return ResultCache()
+
+LOADER = get_model_registry()
+EXECUTOR = get_inference_executor()
+RESULT_CACHE = get_result_cache()
 
 st.sidebar.title("⚙️ Control Panel")
 
@@ -74,19 +56,33 @@ selected_ner_name = st.sidebar.selectbox("Chọn model NER:", NER_MODELS_LIST, i
 st.sidebar.subheader("Mô hình RE")
 selected_re_name = st.sidebar.selectbox("Chọn model RE:", RE_MODELS_LIST, index=0)
 
-ner_model = ALL_MODELS["NER"].get(selected_ner_name)
-re_model = ALL_MODELS["RE"].get(selected_re_name)
+try:
+    with st.spinner(f"Đang tải model {selected_ner_name} + {selected_re_name} (chỉ lần đầu)..."):
+        ner_model = LOADER.load_ner_model(selected_ner_name)
+        re_model = LOADER.load_re_model(selected_re_name)
+except Exception as e:
+    st.error(f"Có lỗi khi load model: {e}")
+    st.stop()
+
+with st.sidebar.expander("Bộ nhớ model"):
+    report = LOADER.memory_report()
+    if report:
+        st.dataframe(pd.DataFrame(report), use_container_width=True, hide_index=True)
+        st.caption(f"Tổng: {sum(r['memory_mb'] for r in report):.0f} MB")
+
+with st.sidebar.expander("Cache kết quả"):
+    cache_stats = RESULT_CACHE.stats()
+    if cache_stats["namespaces"]:
+        st.dataframe(pd.DataFrame([{"Loại": ns, **s} for ns, s in cache_stats["namespaces"].items()]),
+                     use_container_width=True, hide_index=True)
+    st.caption(f"{cache_stats['memory_items']} mục, {cache_stats['memory_mb']} MB")
 
 # Khởi tạo Pipeline
-if ner_model and re_model:
-    pipeline = TNGTPipeline(ner_model, re_model)
-else:
-    st.error("Có lỗi khi load model. Vui lòng kiểm tra log.")
-    st.stop()
+pipeline = TNGTPipeline(ner_model, re_model, cache=RESULT_CACHE)
 
 # UI INPUT & OUTPUT ---
 st.title("Hệ thống Trích xuất Thông tin TNGT")
-st.caption("Demo load toàn bộ model tại thời điểm khởi động (Pre-load All)")
+st.caption("Model được load khi chọn lần đầu (Lazy Load)")
 
 default_text = """Vào khoảng 15h30 chiều ngày 20/11, một vụ tai nạn giao thông nghiêm trọng đã xảy ra tại ngã tư Hàng Xanh, TP.HCM do tài xế ngủ gục . Xe tải mang BKS 29C-123.45 do tài xế Nguyễn Văn A điều khiển đã va chạm mạnh với xe máy do tài xế ngủ gục . Ông B bị thương nặng được đưa đi cấp cứu."""
 
@@ -121,10 +117,15 @@ if run_btn and input_text:
     try:
         with st.spinner('Đang chạy mô hình AI...'):
             start_time = time.time()
-            result = pipeline.run(input_text)
+            result = EXECUTOR.run(pipeline.run, input_text, timeout=60)
             process_time = time.time() - start_time
             st.toast(f"Xử lý xong trong {process_time:.2f}s!", icon="🎉")
 
+        with st.expander("Thời gian từng bước"):
+            metrics = result['metrics']
+            st.dataframe(pd.DataFrame([{"Bước": k, "ms": v} for k, v in metrics['timings_ms'].items()]),
+                         use_container_width=True, hide_index=True)
+            st.caption(", ".join(f"{k}: {v}" for k, v in metrics['counters'].items()))
         
         # Cập nhật Entities
         with ent_placeholder.container():
@@ -186,6 +187,8 @@ if run_btn and input_text:
             else:
                 st.info("Chưa đủ dữ liệu để vẽ biểu đồ.")
 
+    except ExecutorBusyError:
+        st.warning("Hệ thống đang bận xử lý nhiều yêu cầu, vui lòng thử lại sau ít phút.")
     except Exception as e:
         st.error(f"Lỗi xử lý: {e}")
         st.exception(e)
\ No newline at end of file
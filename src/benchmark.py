@@ -0,0 +1,267 @@
+"""
+Benchmark cho mọi tổ hợp NER x RE trên dữ liệu của repo.
+
+    python -m src.benchmark --output outputs/benchmark.json
+    python -m src.benchmark --standin                          # model ngẫu nhiên nhỏ, không cần model thật/mạng
+    python -m src.benchmark --output benchmarks/baseline.json   # ghi baseline (lần đầu)
+    python -m src.benchmark --baseline benchmarks/baseline.json --threshold 0.15
+
+- Mỗi bài báo (data/raw, cột CONTENT) và mỗi cửa sổ (file split, cột text) được chạy qua pipeline.run
+  riêng lẻ để đo độ trễ p50/p95/p99; bài/giây tính trên tổng thời gian xử lý các bài.
+- Mỗi tổ hợp chạy trong một tiến trình mới (spawn) để thời gian load model và peak RSS không bị
+  ảnh hưởng bởi tổ hợp trước (--no-isolate để chạy chung tiến trình, peak RSS khi đó là của cả tiến trình).
+- Output JSON (metadata + kết quả theo tổ hợp), so được với baseline: chỉ số xấu đi quá threshold
+  -> exit code 1.
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import contextlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from .config import BASE_DIR
+
+NER_MODELS = ["PHOBERT", "CRF", "SVM", "LOGREG"]
+RE_MODELS = ["PHOBERT", "SVM", "RF", "LOGREG"]
+
+# Chỉ số dùng để so baseline: tên -> (hướng tốt, ngưỡng tuyệt đối)
+# hướng: +1 càng lớn càng tốt, -1 càng nhỏ càng tốt; thay đổi nhỏ hơn ngưỡng tuyệt đối coi là nhiễu
+COMPARED_METRICS = {
+    "article_latency_ms.p50": (-1, 1.0),
+    "article_latency_ms.p95": (-1, 1.0),
+    "article_latency_ms.p99": (-1, 1.0),
+    "window_latency_ms.p50": (-1, 1.0),
+    "window_latency_ms.p95": (-1, 1.0),
+    "window_latency_ms.p99": (-1, 1.0),
+    "articles_per_sec": (+1, 0.0),
+    "peak_rss_mb": (-1, 5.0),
+    "load_time_s": (-1, 0.05),
+}
+
+
+def load_texts(csv_path, column, limit=None):
+    """Đọc cột text (không phân biệt hoa thường) theo đúng thứ tự file, bỏ dòng rỗng"""
+    from .bulk import iter_articles
+
+    texts = []
+    for _, row, text_key in iter_articles(csv_path, text_column=column):
+        text = row.get(text_key)
+        if text and text.strip():
+            texts.append(text)
+            if limit and len(texts) >= limit:
+                break
+    return texts
+
+
+def percentiles(values_s):
+    """p50/p95/p99/mean (ms) của list thời gian (giây)"""
+    import numpy as np
+
+    if not values_s:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "n": 0}
+    values = np.asarray(values_s) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3),
+            "mean": round(float(values.mean()), 3), "n": len(values_s)}
+
+
+def peak_rss_mb():
+    """Peak RSS của tiến trình hiện tại (MB), None nếu không đo được (VD: Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về bytes
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def run_combo(ner_name, re_name, articles, windows, standin=False, warmup=1, torch_threads=1, seed=0):
+    """
+    Benchmark một tổ hợp NER x RE. Output: dict chỉ số (hoặc {"error": ...} nếu không load/chạy được).
+    """
+    import torch
+    from .pipeline import TNGTPipeline
+
+    random.seed(seed)
+    torch.manual_seed(seed)
+    torch.set_num_threads(torch_threads)
+
+    if standin:
+        from .standins import StandInLoader
+        loader = StandInLoader()
+    else:
+        from .loader import SystemLoader
+        loader = SystemLoader()
+
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ner_model = loader.load_ner_model(ner_name)
+            re_model = loader.load_re_model(re_name)
+        load_time = time.perf_counter() - start
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+    pipeline = TNGTPipeline(ner_model, re_model)
+    article_times, window_times = [], []
+    stage_times = {} # bước -> tổng ms trên các bài
+    n_entities = n_relations = 0
+
+    try:
+        # Warmup: lượt đầu có chi phí khởi tạo (cache, cấp phát bộ nhớ) không đại diện
+        for text in (articles + windows)[:warmup]:
+            pipeline.run(text)
+
+        for text in articles:
+            start = time.perf_counter()
+            result = pipeline.run(text)
+            article_times.append(time.perf_counter() - start)
+            n_entities += len(result['entities'])
+            n_relations += len(result['relations'])
+            for stage, ms in result['metrics']['timings_ms'].items():
+                stage_times[stage] = stage_times.get(stage, 0.0) + ms
+
+        for text in windows:
+            start = time.perf_counter()
+            pipeline.run(text)
+            window_times.append(time.perf_counter() - start)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}", "load_time_s": round(load_time, 3)}
+
+    return {
+        "article_latency_ms": percentiles(article_times),
+        "window_latency_ms": percentiles(window_times),
+        "stage_ms_per_article": {stage: round(ms / len(articles), 3) for stage, ms in stage_times.items()},
+        "articles_per_sec": round(len(article_times) / sum(article_times), 3) if article_times else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "load_time_s": round(load_time, 3),
+        "entities": n_entities,
+        "relations": n_relations,
+    }
+
+
+def run_benchmark(articles, windows, ner_models=NER_MODELS, re_models=RE_MODELS, isolate=True, **options):
+    """Chạy mọi tổ hợp. Output: {"NER+RE": chỉ số}"""
+    results = {}
+    for ner_name in ner_models:
+        for re_name in re_models:
+            combo = f"{ner_name}+{re_name}"
+            print(f"--- [BENCH] {combo} ({len(articles)} bài, {len(windows)} cửa sổ)")
+            if isolate:
+                with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as executor:
+                    result = executor.submit(run_combo, ner_name, re_name, articles, windows, **options).result()
+            else:
+                result = run_combo(ner_name, re_name, articles, windows, **options)
+
+            if "error" in result:
+                print(f"-> Bỏ qua: {result['error']}")
+            else:
+                print(f"-> p50 bài {result['article_latency_ms']['p50']} ms, "
+                      f"p50 cửa sổ {result['window_latency_ms']['p50']} ms, "
+                      f"{result['articles_per_sec']} bài/s, load {result['load_time_s']}s, "
+                      f"peak RSS {result['peak_rss_mb']} MB")
+            results[combo] = result
+    return results
+
+
+def _metric(result, name):
+    value = result
+    for part in name.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(current, baseline, threshold=0.1):
+    """
+    So kết quả với baseline. Output: list regression (combo, chỉ số, baseline, hiện tại, % thay đổi).
+    Một chỉ số bị coi là regression khi xấu đi quá threshold (tỉ lệ, VD 0.1 = 10%) và quá ngưỡng nhiễu.
+    """
+    regressions = []
+    for combo, result in current["results"].items():
+        base = baseline.get("results", {}).get(combo)
+        if not base or "error" in base or "error" in result:
+            continue
+        for name, (direction, noise) in COMPARED_METRICS.items():
+            old, new = _metric(base, name), _metric(result, name)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if -direction * change > threshold and abs(new - old) > noise:
+                regressions.append((combo, name, old, new, change))
+    return regressions
+
+
+def _environment(torch_threads):
+    import numpy
+    import torch
+
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "torch_threads": torch_threads,
+            "torch": torch.__version__, "numpy": numpy.__version__}
+
+
+def main():
+    from .snapshot import sha256_file
+
+    parser = argparse.ArgumentParser(description="Benchmark độ trễ/throughput/bộ nhớ cho mọi tổ hợp NER x RE")
+    parser.add_argument("--articles", default=os.path.join(BASE_DIR, "data/raw/data_raw_400news.csv"))
+    parser.add_argument("--windows", default=os.path.join(BASE_DIR, "data/preprocessed/data_raw_400news_cleaned_split.csv"))
+    parser.add_argument("--limit", type=int, default=50, help="Số bài báo (lấy theo thứ tự file)")
+    parser.add_argument("--window-limit", type=int, default=200, help="Số cửa sổ (lấy theo thứ tự file)")
+    parser.add_argument("--ner", nargs="*", default=NER_MODELS)
+    parser.add_argument("--re", nargs="*", default=RE_MODELS)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--torch-threads", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--standin", action="store_true", help="Dùng model ngẫu nhiên nhỏ (standins.py)")
+    parser.add_argument("--no-isolate", action="store_true", help="Chạy mọi tổ hợp trong cùng tiến trình")
+    parser.add_argument("--output", default=os.path.join(BASE_DIR, "outputs", "benchmark.json"))
+    parser.add_argument("--baseline", help="File JSON benchmark cũ để so sánh")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Ngưỡng regression (0.1 = xấu đi 10%%)")
+    args = parser.parse_args()
+    if args.baseline and not os.path.isfile(args.baseline):
+        # Báo lỗi trước khi chạy cả benchmark
+        parser.error(f"Không có file baseline {args.baseline}: chạy trước với --output {args.baseline} để tạo")
+
+    articles = load_texts(args.articles, "CONTENT", args.limit)
+    windows = load_texts(args.windows, "text", args.window_limit)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {"articles": os.path.relpath(args.articles, BASE_DIR), "n_articles": len(articles),
+                   "windows": os.path.relpath(args.windows, BASE_DIR), "n_windows": len(windows),
+                   "articles_sha256": sha256_file(args.articles), "windows_sha256": sha256_file(args.windows),
+                   "warmup": args.warmup, "seed": args.seed, "standin": args.standin,
+                   "isolate": not args.no_isolate},
+        "environment": _environment(args.torch_threads),
+    }
+    report["results"] = run_benchmark(articles, windows, args.ner, args.re, isolate=not args.no_isolate,
+                                      standin=args.standin, warmup=args.warmup,
+                                      torch_threads=args.torch_threads, seed=args.seed)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"-> Đã ghi kết quả vào {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get("config", {}).get("articles_sha256") != report["config"]["articles_sha256"]:
+            print("--- [WARN] Baseline được đo trên dữ liệu khác.")
+        regressions = compare(report, baseline, args.threshold)
+        for combo, name, old, new, change in regressions:
+            print(f"--- [REGRESSION] {combo} {name}: {old} -> {new} ({change:+.1%})")
+        print(f"=== {len(regressions)} regression (ngưỡng {args.threshold:.0%}) so với {args.baseline}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Trích xuất hàng loạt (backfill kho bài báo) -> JSONL, mỗi dòng một bài.
+
+    python -m src.bulk --input data/raw/data_raw_400news.csv --output outputs/extract.jsonl --workers 4
+
+- Đọc CSV dạng stream (cột ID/CONTENT như data_raw_400news.csv), không nạp cả file vào RAM.
+- Model được load MỘT lần ở tiến trình cha rồi fork ra các worker (copy-on-write, không load lại).
+- Checkpoint chính là file output: chạy lại cùng lệnh sẽ bỏ qua các ID đã có trong output.
+"""
+import os
+import gc
+import csv
+import sys
+import json
+import time
+import argparse
+import multiprocessing as mp
+from .config import BASE_DIR, RESULT_CACHE_DIR
+
+# Pipeline dùng chung cho các worker, gán ở tiến trình cha trước khi fork
+_PIPELINE = None
+
+
+def iter_articles(csv_path, text_column="CONTENT", id_column="ID"):
+    """Đọc từng bài từ CSV. Output: (article_id, row) với article_id là str (mặc định: số thứ tự dòng)."""
+    csv.field_size_limit(sys.maxsize)
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.DictReader(f)
+        columns = {name.upper(): name for name in (reader.fieldnames or [])}
+        text_key = columns.get(text_column.upper())
+        id_key = columns.get(id_column.upper())
+        if text_key is None:
+            raise ValueError(f"Không tìm thấy cột '{text_column}' trong {csv_path}")
+
+        for line_no, row in enumerate(reader):
+            article_id = row.get(id_key) if id_key else None
+            yield str(article_id if article_id not in (None, "") else line_no), row, text_key
+
+
+def load_checkpoint(output_path):
+    """
+    Đọc các ID đã xử lý từ file output.
+    Dòng cuối bị ghi dở (do crash) sẽ bị cắt bỏ để lần ghi tiếp theo không làm hỏng file.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    valid_bytes = 0
+    with open(output_path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                break
+            valid_bytes += len(line)
+
+    if valid_bytes < os.path.getsize(output_path):
+        print(f"-> Cắt bỏ phần ghi dở cuối file output ({os.path.getsize(output_path) - valid_bytes} bytes).")
+        with open(output_path, 'r+b') as f:
+            f.truncate(valid_bytes)
+    return done
+
+
+def iter_batches(articles, batch_size):
+    batch = []
+    for item in articles:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _init_worker(torch_threads):
+    import torch
+    torch.set_num_threads(torch_threads)
+
+
+def process_batch(batch):
+    """
+    Chạy pipeline cho một batch bài báo (trong worker).
+    Output: (pid, thời gian xử lý, records, errors)
+    """
+    start = time.perf_counter()
+    texts = [text for _, _, text in batch]
+    records, errors = [], []
+
+    try:
+        results = _PIPELINE.run_many(texts)
+    except Exception:
+        # Một bài lỗi không kéo theo cả batch: chạy lại từng bài
+        results = []
+        for text in texts:
+            try:
+                results.append(_PIPELINE.run_many([text])[0])
+            except Exception as e:
+                results.append(e)
+
+    for (article_id, title, _), result in zip(batch, results):
+        if isinstance(result, Exception):
+            errors.append({"id": article_id, "error": f"{type(result).__name__}: {result}"})
+        else:
+            records.append({"id": article_id, "title": title, **result})
+
+    return os.getpid(), time.perf_counter() - start, records, errors
+
+
+class ThroughputReport:
+    """Thống kê số bài/giây tổng và theo từng worker (tính trên thời gian xử lý thực của worker)"""
+
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_print = self.started
+        self.workers = {} # pid -> [số bài, số giây xử lý]
+        self.total = 0
+        self.failed = 0
+
+    def update(self, pid, elapsed, n_done, n_failed):
+        stats = self.workers.setdefault(pid, [0, 0.0])
+        stats[0] += n_done + n_failed
+        stats[1] += elapsed
+        self.total += n_done
+        self.failed += n_failed
+        if time.perf_counter() - self.last_print >= self.interval:
+            self.print()
+
+    def print(self, final=False):
+        self.last_print = time.perf_counter()
+        wall = max(self.last_print - self.started, 1e-9)
+        prefix = "=== TỔNG KẾT" if final else "-> Tiến độ"
+        print(f"{prefix}: {self.total} bài ({self.failed} lỗi), {self.total / wall:.2f} bài/s trong {wall:.0f}s")
+        for pid, (n_articles, busy) in sorted(self.workers.items()):
+            print(f"   worker {pid}: {n_articles} bài, {n_articles / max(busy, 1e-9):.2f} bài/s")
+
+
+def build_pipeline(ner_name, re_name, batch_size, cache_dir=None):
+    from .loader import SystemLoader
+    from .pipeline import TNGTPipeline
+    from .cache import ResultCache
+
+    loader = SystemLoader()
+    ner_model = loader.load_ner_model(ner_name)
+    re_model = loader.load_re_model(re_name)
+    # Cache trên đĩa dùng chung giữa các worker và các lần chạy (bài trùng/đăng lại không phải chạy model lại)
+    cache = ResultCache(disk_dir=cache_dir) if cache_dir else None
+    return TNGTPipeline(ner_model, re_model, ner_batch_size=batch_size, re_batch_size=batch_size, cache=cache)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trích xuất NER + RE hàng loạt cho kho bài báo (JSONL, có resume)")
+    parser.add_argument("--input", default=os.path.join(BASE_DIR, "data", "raw", "data_raw_400news.csv"))
+    parser.add_argument("--output", default=os.path.join(BASE_DIR, "outputs", "extract.jsonl"))
+    parser.add_argument("--text-column", default="CONTENT")
+    parser.add_argument("--id-column", default="ID")
+    parser.add_argument("--ner", default="PHOBERT", help="PHOBERT | CRF | LOGREG | SVM")
+    parser.add_argument("--re", default="PHOBERT", help="PHOBERT | SPAN | LOGREG | SVM")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--torch-threads", type=int, default=1, help="Số luồng torch mỗi worker")
+    parser.add_argument("--articles-per-task", type=int, default=8, help="Số bài gom vào một lần run_many")
+    parser.add_argument("--batch-size", type=int, default=16, help="Batch size NER/RE trong pipeline")
+    parser.add_argument("--log-every", type=float, default=10.0, help="In tiến độ mỗi N giây")
+    parser.add_argument("--overwrite", action="store_true", help="Bỏ checkpoint, ghi lại từ đầu")
+    parser.add_argument("--cache-dir", default=RESULT_CACHE_DIR, help="Thư mục ResultCache trên đĩa (mặc định: không cache)")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    error_path = os.path.splitext(args.output)[0] + ".errors.jsonl"
+    if args.overwrite:
+        for path in (args.output, error_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    done = load_checkpoint(args.output)
+    if done:
+        print(f"-> Resume: bỏ qua {len(done)} bài đã có trong {args.output}")
+
+    def pending():
+        for article_id, row, text_key in iter_articles(args.input, args.text_column, args.id_column):
+            text = row.get(text_key)
+            if article_id in done or not text or not text.strip():
+                continue
+            yield article_id, row.get('TITLE') or row.get('title'), text
+
+    global _PIPELINE
+    print("=== BOOTSTRAP: ĐANG KHỞI TẠO HỆ THỐNG ===")
+    _PIPELINE = build_pipeline(args.ner, args.re, args.batch_size, args.cache_dir)
+
+    report = ThroughputReport(interval=args.log_every)
+    batches = iter_batches(pending(), args.articles_per_task)
+
+    with open(args.output, 'a', encoding='utf-8') as out, open(error_path, 'a', encoding='utf-8') as err:
+        def write(result):
+            pid, elapsed, records, errors = result
+            for record in records:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            for error in errors:
+                err.write(json.dumps(error, ensure_ascii=False) + "\n")
+            # Flush sau mỗi batch: file output luôn là checkpoint hợp lệ
+            out.flush()
+            err.flush()
+            report.update(pid, elapsed, len(records), len(errors))
+
+        if args.workers <= 1:
+            _init_worker(args.torch_threads)
+            for batch in batches:
+                write(process_batch(batch))
+        else:
+            # Đưa các object đã load ra khỏi GC để worker không chạm (và copy) các trang nhớ đó
+            gc.freeze()
+            ctx = mp.get_context("fork")
+            with ctx.Pool(args.workers, initializer=_init_worker, initargs=(args.torch_threads,)) as pool:
+                for result in pool.imap_unordered(process_batch, batches):
+                    write(result)
+
+    report.print(final=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Cache kết quả cho TNGTPipeline theo nội dung (content-addressed).
+
+    cache = ResultCache(disk_dir="outputs/result_cache")
+    pipeline = TNGTPipeline(ner_model, re_model, cache=cache)
+
+- Khóa = sha256(phạm vi + nội dung), phạm vi gồm định danh model (cache_id do SystemLoader gán: tên,
+  đường dẫn, kích thước + mtime file model) và cấu hình pipeline -> đổi/train lại model là dùng khóa mới.
+- Ba namespace: "article" (kết quả cả bài theo text đã clean), "ner" (thực thể của từng đoạn/cửa sổ),
+  "re" (nhãn các cặp của từng cửa sổ) -> bài bị sửa nhẹ chỉ chạy lại các cửa sổ bị đổi.
+- Tầng bộ nhớ: LRU giới hạn số mục và dung lượng (giá trị lưu dạng pickle nên caller sửa kết quả
+  không làm hỏng cache). Tầng đĩa (tùy chọn): mỗi mục một file, vượt dung lượng thì xóa mục lâu không dùng nhất.
+  Nhiều tiến trình (VD: worker của bulk.py) dùng chung thư mục: dung lượng được đo lại từ thư mục (mtime = lần
+  dùng cuối) mỗi khi vượt giới hạn hoặc sau mỗi max_disk_mb / DISK_RESCAN_FRACTION MB tự ghi, nên giới hạn là của
+  cả thư mục (có thể vượt tạm thời tối đa số tiến trình x phần đó).
+"""
+import os
+import uuid
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from .config import RESULT_CACHE_ITEMS, RESULT_CACHE_MEMORY_MB, RESULT_CACHE_DIR, RESULT_CACHE_DISK_MB
+
+# Đo lại dung lượng thư mục sau mỗi max_disk / DISK_RESCAN_FRACTION byte tự ghi
+DISK_RESCAN_FRACTION = 16
+
+# Predictor không có cache_id (VD: standins) chỉ dùng được cache trong tiến trình hiện tại
+_PROCESS_TOKEN = uuid.uuid4().hex
+
+
+def model_identity(path):
+    """Định danh file/thư mục model: đường dẫn + tổng kích thước + mtime mới nhất (tên model HF hub: giữ nguyên tên)"""
+    path = str(path)
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    if os.path.isdir(path):
+        size, mtime = 0, 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                stat = os.stat(os.path.join(root, name))
+                size += stat.st_size
+                mtime = max(mtime, stat.st_mtime_ns)
+        return f"{os.path.abspath(path)}:{size}:{mtime}"
+    return path
+
+
+def predictor_identity(predictor):
+    return getattr(predictor, 'cache_id', None) or f"{type(predictor).__name__}:{id(predictor)}:{_PROCESS_TOKEN}"
+
+
+def make_key(scope, content):
+    return hashlib.sha256(f"{scope}\0{content}".encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_items=None, max_memory_mb=None, disk_dir=None, max_disk_mb=None):
+        """
+        max_items / max_memory_mb: giới hạn tầng bộ nhớ (mặc định theo config RESULT_CACHE_*)
+        disk_dir: thư mục tầng đĩa (None = theo config RESULT_CACHE_DIR, không có thì chỉ dùng bộ nhớ)
+        """
+        self.max_items = max_items or RESULT_CACHE_ITEMS
+        self.max_memory = (max_memory_mb or RESULT_CACHE_MEMORY_MB) * 2**20
+        self.disk_dir = disk_dir or RESULT_CACHE_DIR
+        self.max_disk = (max_disk_mb or RESULT_CACHE_DISK_MB) * 2**20
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict() # (namespace, key) -> bytes, cuối = dùng gần nhất
+        self._memory_bytes = 0
+        self._stats = {}             # namespace -> {"hits", "disk_hits", "misses"}
+        self._disk = OrderedDict()   # path -> size, cuối = dùng gần nhất
+        self._disk_bytes = 0
+        self._written_since_scan = 0
+        if self.disk_dir:
+            self._scan_disk()
+
+    def _scan_disk(self):
+        """Nạp lại danh sách file đang có trên đĩa (kể cả do tiến trình khác ghi), thứ tự theo lần dùng cuối (mtime)"""
+        self._disk.clear()
+        self._disk_bytes = 0
+        self._written_since_scan = 0
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith(".pkl"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._disk[path] = size
+            self._disk_bytes += size
+
+    def _disk_path(self, namespace, key):
+        return os.path.join(self.disk_dir, namespace, key[:2], f"{key}.pkl")
+
+    def _count(self, namespace, field):
+        stats = self._stats.setdefault(namespace, {"hits": 0, "disk_hits": 0, "misses": 0})
+        stats[field] += 1
+
+    def get(self, namespace, key):
+        """Output: giá trị (bản sao mới) hoặc None nếu không có"""
+        with self._lock:
+            blob = self._memory.get((namespace, key))
+            if blob is not None:
+                self._memory.move_to_end((namespace, key))
+                self._count(namespace, "hits")
+                return pickle.loads(blob)
+
+        blob = self._disk_get(namespace, key) if self.disk_dir else None
+        with self._lock:
+            if blob is None:
+                self._count(namespace, "misses")
+                return None
+            self._count(namespace, "disk_hits")
+            self._memory_put(namespace, key, blob)
+        return pickle.loads(blob)
+
+    def put(self, namespace, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._memory_put(namespace, key, blob)
+        if self.disk_dir:
+            self._disk_put(namespace, key, blob)
+
+    def _memory_put(self, namespace, key, blob):
+        old = self._memory.pop((namespace, key), None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[(namespace, key)] = blob
+        self._memory_bytes += len(blob)
+        while self._memory and (len(self._memory) > self.max_items or self._memory_bytes > self.max_memory):
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _disk_get(self, namespace, key):
+        path = self._disk_path(namespace, key)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+            os.utime(path) # mtime = lần dùng cuối, để tiến trình khác quét lại vẫn đúng thứ tự LRU
+        except OSError:
+            return None
+        with self._lock:
+            if path in self._disk:
+                self._disk.move_to_end(path)
+        return blob
+
+    def _disk_put(self, namespace, key, blob):
+        path = self._disk_path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Ghi file tạm rồi đổi tên: tiến trình khác không bao giờ đọc phải file ghi dở
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._disk_bytes += len(blob) - self._disk.pop(path, 0)
+            self._disk[path] = len(blob)
+            self._written_since_scan += len(blob)
+            if (self._disk_bytes > self.max_disk
+                    or self._written_since_scan > self.max_disk // DISK_RESCAN_FRACTION):
+                # Tiến trình khác cũng ghi vào thư mục: đo lại trước khi quyết định xóa
+                self._scan_disk()
+            evict = []
+            while self._disk and self._disk_bytes > self.max_disk:
+                old_path, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                evict.append(old_path)
+        for old_path in evict:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Số hit (bộ nhớ / đĩa), miss và tỉ lệ hit theo namespace"""
+        with self._lock:
+            result = {}
+            for namespace, stats in self._stats.items():
+                lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+                result[namespace] = {**stats, "hit_rate": round((stats["hits"] + stats["disk_hits"]) / lookups, 4)}
+            return {"namespaces": result, "memory_items": len(self._memory),
+                    "memory_mb": round(self._memory_bytes / 2**20, 2),
+                    "disk_items": len(self._disk), "disk_mb": round(self._disk_bytes / 2**20, 2)}
+
+    def clear(self):
+        """Xóa mọi mục ở cả hai tầng (tầng đĩa: mọi file trong thư mục, kể cả do tiến trình khác ghi)"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if not self.disk_dir:
+                return
+            self._scan_disk()
+            paths = list(self._disk)
+            self._disk.clear()
+            self._disk_bytes = 0
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
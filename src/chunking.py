@@ -0,0 +1,77 @@
+"""
+Encode input dài hơn giới hạn của PhoBERT (MAX_SEQ_LENGTH subword) bằng các chunk chồng lấn thay vì cắt bỏ.
+
+- Input ([CLS] + body + [SEP], chưa cắt) được chia thành các chunk [CLS] + một đoạn body + [SEP]; hai chunk
+  liền nhau chồng lấn LONG_INPUT_STRIDE subword, chunk cuối canh về cuối input.
+- Chunk của mọi input được chạy chung trong các mini-batch (sắp theo độ dài), không lặp từng input.
+- Ghép lại theo subword (stitch): mỗi vị trí lấy output của chunk mà nó nằm giữa nhất (cắt tại giữa phần
+  chồng lấn), [CLS] lấy từ chunk đầu, [SEP] từ chunk cuối.
+- Input không vượt giới hạn chỉ có một chunk -> kết quả giữ nguyên như khi chưa chia chunk.
+"""
+import numpy as np
+from .config import MAX_SEQ_LENGTH, LONG_INPUT_STRIDE
+
+
+def chunk_starts(n_body, max_body, stride):
+    """Vị trí bắt đầu (trong body) của từng chunk, mỗi chunk tối đa max_body subword"""
+    if n_body <= max_body:
+        return [0]
+    step = max(max_body - stride, 1)
+    return list(range(0, n_body - max_body, step)) + [n_body - max_body]
+
+
+def split_chunks(input_ids, max_length=MAX_SEQ_LENGTH, stride=LONG_INPUT_STRIDE):
+    """Output: list (vị trí bắt đầu trong body, ids của chunk có [CLS]/[SEP])"""
+    if len(input_ids) <= max_length:
+        return [(0, list(input_ids))]
+    cls_id, body, sep_id = input_ids[0], input_ids[1:-1], input_ids[-1]
+    max_body = max_length - 2
+    return [(start, [cls_id, *body[start:start + max_body], sep_id])
+            for start in chunk_starts(len(body), max_body, stride)]
+
+
+def stitch(chunks):
+    """
+    Ghép output theo subword của các chunk của một input.
+    Input: list (start, mảng [len chunk, ...]) theo thứ tự start. Output: mảng [len input, ...]
+    """
+    if len(chunks) == 1:
+        return chunks[0][1]
+    first, (last_start, last) = chunks[0][1], chunks[-1]
+    n_body = last_start + len(last) - 2
+    out = np.empty((n_body + 2,) + first.shape[1:], dtype=first.dtype)
+    out[0], out[-1] = first[0], last[-1]
+
+    cut = 0
+    for k, (start, values) in enumerate(chunks):
+        end = start + len(values) - 2
+        # Chunk k giữ tới giữa phần chồng lấn với chunk k + 1
+        next_cut = (chunks[k + 1][0] + end) // 2 if k + 1 < len(chunks) else n_body
+        out[1 + cut:1 + next_cut] = values[1 + cut - start:1 + next_cut - start]
+        cut = next_cut
+    return out
+
+
+def run_chunked(sequences, forward, batch_size=16, max_length=MAX_SEQ_LENGTH, stride=LONG_INPUT_STRIDE):
+    """
+    Chạy forward trên chunk của mọi input theo mini-batch có padding.
+    sequences: list input_ids ([CLS] ... [SEP], chưa cắt)
+    forward: hàm nhận list ids (chưa pad) của một batch, trả về output theo từng dòng
+    Output: list (đúng thứ tự sequences) các list (start, output) của từng chunk, theo thứ tự start
+    """
+    rows = [(i, start, ids) for i, seq in enumerate(sequences) for start, ids in split_chunks(seq, max_length, stride)]
+    n_long = sum(len(seq) > max_length for seq in sequences)
+    if n_long:
+        print(f"--- [WARN] {n_long}/{len(sequences)} input dài hơn {max_length} subword: "
+              f"encode bằng {len(rows) - len(sequences) + n_long} chunk chồng lấn {stride} subword")
+
+    # Sắp theo độ dài để mỗi batch pad ít nhất (sort ổn định: input ngắn giữ thứ tự batch như trước)
+    rows.sort(key=lambda row: len(row[2]))
+    outputs = [[] for _ in sequences]
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        for (i, chunk_start, _), value in zip(batch, forward([ids for _, _, ids in batch])):
+            outputs[i].append((chunk_start, value))
+    for chunks in outputs:
+        chunks.sort(key=lambda chunk: chunk[0])
+    return outputs
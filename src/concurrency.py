@@ -0,0 +1,101 @@
+"""
+Chạy inference đồng thời trên các predictor dùng chung (VD: Streamlit cache_resource cho mọi session).
+
+- Số request inference chạy cùng lúc bị giới hạn (max_workers), request vượt quá phải chờ trong
+  hàng đợi có giới hạn (max_pending) thay vì tất cả cùng tranh CPU.
+- Mỗi worker thread đặt số thread intra-op của torch riêng (torch.set_num_threads gọi trong thread,
+  backend OpenMP lưu theo thread) để tổng số thread ~ số core, không bị oversubscribe.
+
+    executor = InferenceExecutor(max_workers=2)
+    result = executor.run(pipeline.run, text)
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .config import INFERENCE_WORKERS, TORCH_THREADS_PER_WORKER, INFERENCE_MAX_PENDING
+
+
+class ExecutorBusyError(Exception):
+    """Hàng đợi inference đã đầy (hoặc chờ quá timeout)"""
+
+
+def threads_per_worker(max_workers, cpu_count=None):
+    """Chia đều số core cho các worker, ít nhất 1 thread mỗi worker"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, cpu_count // max(1, max_workers))
+
+
+class InferenceExecutor:
+    def __init__(self, max_workers=None, torch_threads=None, max_pending=None):
+        """
+        max_workers: số request inference chạy cùng lúc (mặc định config INFERENCE_WORKERS)
+        torch_threads: số thread torch của mỗi worker (mặc định chia đều số core)
+        max_pending: số request được chờ thêm khi mọi worker đang bận
+        """
+        self.max_workers = max_workers or INFERENCE_WORKERS
+        self.torch_threads = torch_threads or TORCH_THREADS_PER_WORKER or threads_per_worker(self.max_workers)
+        self.max_pending = INFERENCE_MAX_PENDING if max_pending is None else max_pending
+
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+        self._lock = threading.Lock()
+        self._running = 0
+        self._completed = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference",
+                                            initializer=self._init_worker)
+        print(f"--- [INFO] Inference executor: {self.max_workers} worker x {self.torch_threads} thread torch")
+
+    def _init_worker(self):
+        import torch
+        torch.set_num_threads(self.torch_threads)
+
+    def submit(self, fn, *args, timeout=None, **kwargs):
+        """
+        Đưa một lượt inference vào hàng đợi. Output: Future.
+        timeout: số giây tối đa chờ có chỗ trong hàng đợi (None = chờ tới khi có), hết giờ -> ExecutorBusyError.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise ExecutorBusyError(f"Đang có {self.max_workers + self.max_pending} request inference, thử lại sau.")
+
+        def task():
+            with self._lock:
+                self._running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+
+        try:
+            future = self._executor.submit(task)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        """Như submit nhưng chờ lấy kết quả"""
+        return self.submit(fn, *args, timeout=timeout, **kwargs).result()
+
+    def info(self):
+        with self._lock:
+            return {"workers": self.max_workers, "torch_threads": self.torch_threads,
+                    "running": self._running, "completed": self._completed}
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_default_executor = None
+_default_lock = threading.Lock()
+
+
+def get_executor():
+    """Executor dùng chung của tiến trình (tạo ở lần gọi đầu tiên)"""
+    global _default_executor
+    if _default_executor is None:
+        with _default_lock:
+            if _default_executor is None:
+                _default_executor = InferenceExecutor()
+    return _default_executor
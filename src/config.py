@@ -1,10 +1,10 @@
 import os
-import torch
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 MODEL_DIR = os.path.join(BASE_DIR, 'models')
 
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# Snapshot model cục bộ (python -m src.snapshot), có manifest thì được ưu tiên hơn MODEL_PATHS
+SNAPSHOT_DIR = os.environ.get("TNGT_SNAPSHOT_DIR", os.path.join(MODEL_DIR, "snapshot"))
 
 RE_ID2LABEL = {
     0: "NO_RELATION",
@@ -49,5 +49,52 @@ MODEL_PATHS = {
         "LOGREG":    os.path.join(MODEL_DIR, "re/lr_model.joblib"),
         "SVM":       os.path.join(MODEL_DIR, "re/svm_model.joblib"),
         "RF":        os.path.join(MODEL_DIR, "re/rf_model.joblib"),
+        "SPAN":      os.path.join(MODEL_DIR, "re/span_re"),   # Train bằng: python -m src.train_span_re
     }
-}
\ No newline at end of file
+}
+
+# Số từ tối đa giữ trong cache word -> subword của PhoBERTFeatureExtractor
+WORD_CACHE_SIZE = 100000
+
+# Giới hạn subword mỗi lượt encode của PhoBERT (kể cả [CLS]/[SEP]). Input dài hơn được chia thành các chunk
+# chồng lấn LONG_INPUT_STRIDE subword rồi ghép lại (xem chunking.py) thay vì bị cắt bỏ phần đuôi
+MAX_SEQ_LENGTH = 256
+LONG_INPUT_STRIDE = 64
+
+# Kho embedding PhoBERT cho model ML (xem embedding_store.py), None = tắt
+EMBEDDING_STORE_DIR = os.environ.get("TNGT_EMBEDDING_STORE")
+EMBEDDING_STORE_DTYPE = "float32"   # "float16" giảm một nửa dung lượng (vector lệch ~1e-3)
+
+# Cache kết quả pipeline (xem cache.py): giới hạn tầng bộ nhớ, thư mục tầng đĩa (None = chỉ bộ nhớ)
+RESULT_CACHE_ITEMS = 4096
+RESULT_CACHE_MEMORY_MB = 64
+RESULT_CACHE_DIR = os.environ.get("TNGT_RESULT_CACHE_DIR")
+RESULT_CACHE_DISK_MB = 512
+
+# Engine giải mã cho NER CRF: "viterbi" (NumPy, xem crf_decoder.py) hoặc "crfsuite"
+CRF_ENGINE = "viterbi"
+
+
+# Ngân sách bộ nhớ (MB) cho các model đã load trong SystemLoader, vượt quá sẽ bỏ model lâu không dùng nhất.
+# None (không đặt TNGT_MODEL_MEMORY_MB) = không giới hạn
+MODEL_MEMORY_BUDGET_MB = float(os.environ["TNGT_MODEL_MEMORY_MB"]) if os.environ.get("TNGT_MODEL_MEMORY_MB") else None
+
+# Backend cho các model PhoBERT (NER/RE DL và feature extractor): "torch" hoặc "onnx" (xem onnx_backend.py)
+DL_BACKEND = "torch"
+ONNX_DIR = os.path.join(MODEL_DIR, "onnx")
+ONNX_QUANTIZED = True   # Ưu tiên bản int8 (quantize_dynamic) nếu đã xuất
+
+# Inference đồng thời (xem concurrency.py): số request chạy cùng lúc, thread torch mỗi worker
+# (None = chia đều số core) và số request được chờ thêm
+INFERENCE_WORKERS = int(os.environ.get("TNGT_INFERENCE_WORKERS", 2))
+TORCH_THREADS_PER_WORKER = int(os.environ["TNGT_TORCH_THREADS"]) if os.environ.get("TNGT_TORCH_THREADS") else None
+INFERENCE_MAX_PENDING = 32
+
+
+def __getattr__(name):
+    # DEVICE được tính khi dùng lần đầu để `import src.config` không kéo theo torch
+    if name == "DEVICE":
+        import torch
+        globals()["DEVICE"] = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        return globals()["DEVICE"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,126 @@
+import numpy as np
+
+
+class ViterbiCRFDecoder:
+    """
+    Giải mã CRF (sklearn-crfsuite) bằng NumPy.
+    Đặc trưng của model là các chiều embedding dạng số (d0..d767) nên điểm trạng thái
+    chỉ là một phép nhân ma trận X @ W, sau đó chạy Viterbi với ma trận chuyển nhãn.
+    """
+
+    def __init__(self, crf_model, n_features=768):
+        self.labels = list(crf_model.classes_)
+        label_idx = {label: i for i, label in enumerate(self.labels)}
+        n_labels = len(self.labels)
+
+        # Trọng số trạng thái: (thuộc tính 'd{i}', nhãn) -> W[i, nhãn]
+        self.state_weights = np.zeros((n_features, n_labels), dtype=np.float64)
+        for (attr, label), weight in crf_model.state_features_.items():
+            if attr.startswith('d') and attr[1:].isdigit() and int(attr[1:]) < n_features:
+                self.state_weights[int(attr[1:]), label_idx[label]] = weight
+
+        # Trọng số chuyển: (nhãn trước, nhãn sau) -> T[trước, sau]
+        self.transitions = np.zeros((n_labels, n_labels), dtype=np.float64)
+        for (label_from, label_to), weight in crf_model.transition_features_.items():
+            self.transitions[label_idx[label_from], label_idx[label_to]] = weight
+
+    def decode(self, vectors):
+        """Input: mảng [n_tokens, n_features]. Output: list nhãn."""
+        return self.decode_batch([vectors])[0]
+
+    def decode_batch(self, vectors_list):
+        """
+        Giải mã nhiều câu cùng lúc: pad về cùng độ dài, tính điểm bằng một phép matmul
+        rồi chạy Viterbi vector hóa theo chiều batch.
+        Output: List các list nhãn, đúng thứ tự input.
+        """
+        results = [[] for _ in vectors_list]
+        active = [i for i, vectors in enumerate(vectors_list) if len(vectors) > 0]
+        if not active:
+            return results
+
+        lengths = np.array([len(vectors_list[i]) for i in active])
+        batch_size, max_len = len(active), int(lengths.max())
+        n_features, n_labels = self.state_weights.shape
+
+        X = np.zeros((batch_size, max_len, n_features), dtype=np.float64)
+        for row, i in enumerate(active):
+            X[row, :lengths[row]] = vectors_list[i]
+
+        scores = X @ self.state_weights # [batch, max_len, n_labels]
+
+        delta = scores[:, 0]
+        backpointers = np.empty((max_len, batch_size, n_labels), dtype=np.int64)
+        identity = np.broadcast_to(np.arange(n_labels), (batch_size, n_labels))
+
+        for t in range(1, max_len):
+            # candidates[b, i, j]: điểm tốt nhất kết thúc ở nhãn i tại t-1 rồi chuyển sang j
+            candidates = delta[:, :, None] + self.transitions[None]
+            best_prev = candidates.argmax(axis=1)
+            best_score = np.take_along_axis(candidates, best_prev[:, None, :], axis=1)[:, 0] + scores[:, t]
+
+            # Câu đã hết độ dài: giữ nguyên delta, backpointer đồng nhất để truy vết xuyên qua phần pad
+            alive = (t < lengths)[:, None]
+            delta = np.where(alive, best_score, delta)
+            backpointers[t] = np.where(alive, best_prev, identity)
+
+        path = np.empty((batch_size, max_len), dtype=np.int64)
+        path[:, -1] = delta.argmax(axis=1)
+        rows = np.arange(batch_size)
+        for t in range(max_len - 1, 0, -1):
+            path[:, t - 1] = backpointers[t][rows, path[:, t]]
+
+        for row, i in enumerate(active):
+            results[i] = [self.labels[j] for j in path[row, :lengths[row]]]
+        return results
+
+
+def verify(csv_path, limit=None, batch_size=16):
+    """
+    So khớp từng nhãn giữa ViterbiCRFDecoder và crfsuite (model.predict)
+    trên các cửa sổ của file split CSV.
+    """
+    import joblib
+    import pandas as pd
+    from .config import MODEL_PATHS
+    from .features import PhoBERTFeatureExtractor
+    from .wrappers import crf_items
+
+    crf = joblib.load(MODEL_PATHS["NER"]["CRF"])
+    decoder = ViterbiCRFDecoder(crf)
+    extractor = PhoBERTFeatureExtractor()
+
+    texts = pd.read_csv(csv_path)['text'].dropna().astype(str).tolist()
+    if limit:
+        texts = texts[:limit]
+
+    n_tokens, n_mismatch, n_windows_diff = 0, 0, 0
+    for start in range(0, len(texts), batch_size):
+        features = extractor.extract_crf_features_many(texts[start:start + batch_size], batch_size=batch_size)
+        features = [vectors for vectors in features if len(vectors) > 0]
+        expected = crf.predict([crf_items(vectors) for vectors in features])
+        actual = decoder.decode_batch(features)
+        for exp, act in zip(expected, actual):
+            diff = sum(1 for a, b in zip(exp, act) if a != b)
+            n_tokens += len(exp)
+            n_mismatch += diff
+            n_windows_diff += diff > 0
+
+    print(f"-> Đã so khớp {len(texts)} cửa sổ, {n_tokens} token.")
+    print(f"-> Số token lệch nhãn: {n_mismatch} ({n_windows_diff} cửa sổ).")
+    return n_mismatch == 0
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+    from .config import BASE_DIR
+
+    parser = argparse.ArgumentParser(description="Kiểm tra ViterbiCRFDecoder khớp nhãn với crfsuite")
+    parser.add_argument("--csv", default=os.path.join(BASE_DIR, "data/preprocessed/data_raw_400news_cleaned_split.csv"))
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    sys.exit(0 if verify(args.csv, limit=args.limit, batch_size=args.batch_size) else 1)
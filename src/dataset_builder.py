@@ -0,0 +1,391 @@
+"""
+Biên dịch export Label Studio MỘT lần thành dataset nhị phân dạng cột (các file .npy, load bằng mmap)
+để train/đánh giá không phải chạy lại tokenizer PhoBERT (use_fast=False) và pyvi ở mỗi lần chạy.
+
+    python -m src.dataset_builder --data data/label_studio/ouput/*.json --out data/compiled
+    python -m src.train_span_re --dataset data/compiled
+
+- Mỗi cửa sổ (task có text): subword ids của từng từ (text.split(), không [CLS]/[SEP], không cắt 256),
+  vị trí subword đầu của từng từ, nhãn BIO theo từ (giống notebook ner_models: annotation đầu tiên,
+  gộp Cause/CAUSES -> CAUSE), thực thể (vị trí ký tự, vị trí từ, loại) và mọi cặp đúng VALID_RE_PAIRS
+  với nhãn quan hệ (không gán nhãn -> NO_RELATION) kèm input RE đã chèn Typed Markers + tách từ pyvi
+  + tokenize (có special tokens, không cắt).
+- Dataset nằm ở <out>/<key>/, key = sha256 của định dạng + tokenizer (vocab, bpe, special tokens)
+  + phiên bản pyvi + sha256 các file export. Build lại với cùng key thì dùng luôn bản đã có.
+- Các mảng ragged lưu phẳng kèm mảng offsets (n + 1 phần tử) theo kiểu CSR.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import numpy as np
+from datetime import datetime, timezone
+from .config import BASE_DIR, ENTITY_TYPES, RE_LABEL2ID, VALID_RE_PAIRS, SPECIAL_TOKENS
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+
+# Nhãn BIO của notebook ner_models (trùng models/ner/label_map.json)
+NER_LABELS = [
+    "O",
+    "B-LOC", "I-LOC",
+    "B-VEH", "I-VEH",
+    "B-EVENT", "I-EVENT",
+    "B-PER_DRIVER", "I-PER_DRIVER",
+    "B-PER_VICTIM", "I-PER_VICTIM",
+    "B-ORG", "I-ORG",
+    "B-CONSEQUENCE", "I-CONSEQUENCE",
+    "B-TIME", "I-TIME",
+    "B-CAUSE", "I-CAUSE",
+]
+NER_LABEL2ID = {label: i for i, label in enumerate(NER_LABELS)}
+_NER_LABEL_ALIASES = {"Cause": "CAUSE", "CAUSES": "CAUSE"}
+
+# Cột của mảng entities / relations
+ENTITY_COLUMNS = ("window", "start", "end", "word_start", "word_end", "type")
+RELATION_COLUMNS = ("window", "source", "target", "label")
+
+
+def _load_tokenizer(tokenizer_path=None):
+    """Tokenizer PhoBERT giống PhoBERTFeatureExtractor/REPredictor: use_fast=False + Typed Marker tokens"""
+    from transformers import AutoTokenizer
+    from .snapshot import resolve_model_path
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_path or resolve_model_path("VECTORIZER_BASE"), use_fast=False)
+    if SPECIAL_TOKENS:
+        tokenizer.add_special_tokens({'additional_special_tokens': SPECIAL_TOKENS})
+    return tokenizer
+
+
+def tokenizer_fingerprint(tokenizer):
+    """sha256 của những gì quyết định output tokenize: lớp tokenizer, vocab (kèm token thêm), BPE merges"""
+    digest = hashlib.sha256(type(tokenizer).__name__.encode('utf-8'))
+    digest.update(json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False).encode('utf-8'))
+    bpe_ranks = getattr(tokenizer, 'bpe_ranks', None)
+    if bpe_ranks:
+        digest.update(json.dumps(sorted((list(k), v) for k, v in bpe_ranks.items()), ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _pyvi_version():
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        return version("pyvi")
+    except PackageNotFoundError:
+        return None
+
+
+def dataset_key(tokenizer_fp, sources, pyvi_version):
+    """Khóa của dataset: đổi tokenizer, pyvi, dữ liệu hoặc định dạng -> key mới"""
+    payload = json.dumps({"format": FORMAT_VERSION, "tokenizer": tokenizer_fp, "pyvi": pyvi_version,
+                          "sources": [s["sha256"] for s in sources]})
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _word_spans(text, words):
+    """Vị trí ký tự của từng từ (text.split()), dò tuần tự như notebook"""
+    spans, pos = [], 0
+    for word in words:
+        start = text.find(word, pos)
+        spans.append((start, start + len(word)))
+        pos = start + len(word)
+    return spans
+
+
+def _word_range(word_spans, start, end):
+    """Từ đầu/cuối (cuối không tính) chồng lấn với [start, end) ký tự, (-1, -1) nếu không có"""
+    hits = [i for i, (w_start, w_end) in enumerate(word_spans) if max(w_start, start) < min(w_end, end)]
+    return (hits[0], hits[-1] + 1) if hits else (-1, -1)
+
+
+def _bio_labels(word_spans, results):
+    """Nhãn BIO theo từ, cùng luật với convert_data_label_studio_to_bio của notebook"""
+    labels = [0] * len(word_spans)
+    for item in results:
+        if item.get('type') != 'labels':
+            continue
+        value = item['value']
+        label_type = (value.get('labels') or ["O"])[0]
+        label_type = _NER_LABEL_ALIASES.get(label_type, label_type)
+        if f"B-{label_type}" not in NER_LABEL2ID:
+            continue
+        first, last = _word_range(word_spans, value['start'], value['end'])
+        if first == -1:
+            continue
+        labels[first] = NER_LABEL2ID[f"B-{label_type}"]
+        for k in range(first + 1, last):
+            labels[k] = NER_LABEL2ID[f"I-{label_type}"]
+    return labels
+
+
+class _Column:
+    """Gom các đoạn ragged rồi ghép thành mảng phẳng + offsets"""
+
+    def __init__(self, dtype):
+        self.dtype = dtype
+        self.parts = []
+        self.offsets = [0]
+
+    def append(self, values):
+        self.parts.append(np.asarray(values, dtype=self.dtype))
+        self.offsets.append(self.offsets[-1] + len(values))
+
+    def arrays(self, name):
+        flat = np.concatenate(self.parts) if self.parts else np.zeros(0, dtype=self.dtype)
+        return {name: flat, f"{name}_offsets": np.asarray(self.offsets, dtype=np.int64)}
+
+
+def _pack_strings(name, strings):
+    column = _Column(np.uint8)
+    for s in strings:
+        column.append(np.frombuffer(s.encode('utf-8'), dtype=np.uint8))
+    return column.arrays(name)
+
+
+def compile_tasks(tasks, tokenizer):
+    """
+    Biên dịch list task Label Studio -> (dict tên -> mảng numpy, thống kê).
+    """
+    from .merge_json import task_key
+    from .pipeline import TNGTPipeline
+    from .segmentation import SegmentedWindow
+
+    subword_cache = {}
+    def subwords(word):
+        if word not in subword_cache:
+            subword_cache[word] = tokenizer.encode(word, add_special_tokens=False)
+        return subword_cache[word]
+
+    texts, ref_ids = [], []
+    ner_ids, word_starts, ner_labels = _Column(np.int32), _Column(np.int32), _Column(np.int16)
+    entity_rows, relation_rows = [], []
+    entity_offsets, relation_offsets = [0], [0]
+    re_ids = _Column(np.int32)
+    stats = {"windows": 0, "entities": 0, "relations": 0, "positive_relations": 0, "marker_failures": 0}
+
+    for task in tasks:
+        text = (task.get('data') or {}).get('text')
+        if not text or not text.split():
+            continue
+        window = len(texts)
+        texts.append(text)
+        key = task_key(task)
+        ref_ids.append(key[1] if key else str(task.get('id', window)))
+        annotations = task.get('annotations') or []
+        results = annotations[0].get('result', []) if annotations else []
+
+        # NER: subword ids theo từ + nhãn BIO
+        words = text.split()
+        spans = _word_spans(text, words)
+        ids, starts = [], []
+        for word in words:
+            starts.append(len(ids))
+            ids.extend(subwords(word))
+        ner_ids.append(ids)
+        word_starts.append(starts)
+        ner_labels.append(_bio_labels(spans, results))
+
+        # Thực thể + quan hệ (giống load_span_samples / notebook RE)
+        entities, local_ids, relations = {}, {}, {}
+        for item in results:
+            if item.get('type') == 'labels' and 'id' in item:
+                value = item['value']
+                labels = value.get('labels') or []
+                if labels and labels[0] in ENTITY_TYPES:
+                    local_ids[item['id']] = len(entity_rows)
+                    entities[item['id']] = {'word': text[value['start']:value['end']], 'start': value['start'],
+                                            'end': value['end'], 'entity_group': labels[0]}
+                    entity_rows.append((window, value['start'], value['end'],
+                                        *_word_range(spans, value['start'], value['end']),
+                                        ENTITY_TYPES.index(labels[0])))
+            elif item.get('type') == 'relation' and item.get('labels'):
+                relations[(item['from_id'], item['to_id'])] = item['labels'][0]
+
+        segmented = None
+        for s_id, source in entities.items():
+            for o_id, target in entities.items():
+                if s_id == o_id or (source['entity_group'], target['entity_group']) not in VALID_RE_PAIRS:
+                    continue
+                label = relations.get((s_id, o_id), "NO_RELATION")
+                if label not in RE_LABEL2ID:
+                    continue
+                if segmented is None:
+                    segmented = SegmentedWindow(text) # pyvi một lần cho cả cửa sổ
+                marked = TNGTPipeline._prepare_input_typed(text, source, target, segmented)
+                if marked is None:
+                    stats["marker_failures"] += 1
+                re_ids.append(tokenizer.encode(marked) if marked else [])
+                relation_rows.append((window, local_ids[s_id], local_ids[o_id], RE_LABEL2ID[label]))
+                stats["positive_relations"] += label != "NO_RELATION"
+
+        entity_offsets.append(len(entity_rows))
+        relation_offsets.append(len(relation_rows))
+
+    stats.update(windows=len(texts), entities=len(entity_rows), relations=len(relation_rows))
+    arrays = {}
+    arrays.update(_pack_strings("text", texts))
+    arrays.update(_pack_strings("ref_id", ref_ids))
+    arrays.update(ner_ids.arrays("ner_input_ids"))
+    arrays.update(word_starts.arrays("ner_word_starts"))
+    arrays["ner_labels"] = ner_labels.arrays("ner_labels")["ner_labels"] # cùng offsets với ner_word_starts
+    arrays["entities"] = np.asarray(entity_rows, dtype=np.int32).reshape(-1, len(ENTITY_COLUMNS))
+    arrays["entities_offsets"] = np.asarray(entity_offsets, dtype=np.int64)
+    arrays["relations"] = np.asarray(relation_rows, dtype=np.int32).reshape(-1, len(RELATION_COLUMNS))
+    arrays["relations_offsets"] = np.asarray(relation_offsets, dtype=np.int64)
+    arrays.update(re_ids.arrays("re_input_ids"))
+    return arrays, stats
+
+
+def build_dataset(json_paths, out_dir=None, tokenizer_path=None, force=False):
+    """
+    Biên dịch các file export vào <out_dir>/<key>/ (bỏ qua nếu đã có bản cùng key). Output: đường dẫn dataset.
+    """
+    from .merge_json import iter_tasks
+    from .snapshot import sha256_file
+
+    out_dir = out_dir or os.path.join(BASE_DIR, "data", "compiled")
+    tokenizer = _load_tokenizer(tokenizer_path)
+    sources = [{"path": os.path.relpath(os.path.abspath(p), BASE_DIR), "sha256": sha256_file(p)} for p in json_paths]
+    tokenizer_fp = tokenizer_fingerprint(tokenizer)
+    pyvi_version = _pyvi_version()
+    key = dataset_key(tokenizer_fp, sources, pyvi_version)
+    target = os.path.join(out_dir, key[:16])
+
+    if os.path.exists(os.path.join(target, MANIFEST_FILE)) and not force:
+        print(f"--- [DATASET] Đã có dataset cùng key: {target}")
+        return target
+
+    print(f"--- [DATASET] Biên dịch {len(json_paths)} file export -> {target}")
+    start = time.perf_counter()
+    tasks = (task for path in json_paths for task in iter_tasks(path))
+    arrays, stats = compile_tasks(tasks, tokenizer)
+
+    # Ghi vào thư mục tạm rồi đổi tên: dataset chỉ xuất hiện khi đã ghi đủ (manifest ghi sau cùng)
+    tmp_dir = target + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "key": key,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "tokenizer": {"name_or_path": tokenizer.name_or_path, "class": type(tokenizer).__name__,
+                      "fingerprint": tokenizer_fp, "vocab_size": len(tokenizer)},
+        "pyvi": pyvi_version,
+        "sources": sources,
+        "ner_labels": NER_LABELS,
+        "entity_types": ENTITY_TYPES,
+        "re_labels": {label: i for label, i in RE_LABEL2ID.items()},
+        "entity_columns": ENTITY_COLUMNS,
+        "relation_columns": RELATION_COLUMNS,
+        "stats": stats,
+        "arrays": {name: {"dtype": str(a.dtype), "shape": list(a.shape)} for name, a in arrays.items()},
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_dir, target)
+    print(f"-> {stats['windows']} cửa sổ, {stats['entities']} thực thể, {stats['relations']} cặp RE "
+          f"({stats['positive_relations']} có quan hệ) trong {time.perf_counter() - start:.1f}s")
+    return target
+
+
+class CompiledDataset:
+    """
+    Dataset đã biên dịch, mọi mảng được np.load(mmap_mode='r'): mở gần như tức thì, chỉ đọc phần được dùng.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Dataset {path} dùng định dạng {self.manifest['format_version']}, cần build lại.")
+        self.path = path
+        self.arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+                       for name in self.manifest["arrays"]}
+
+    def __len__(self):
+        return len(self.arrays["text_offsets"]) - 1
+
+    def _slice(self, name, i):
+        offsets = self.arrays[f"{name}_offsets"]
+        return self.arrays[name][offsets[i]:offsets[i + 1]]
+
+    def text(self, i):
+        return bytes(self._slice("text", i)).decode('utf-8')
+
+    def ref_id(self, i):
+        return bytes(self._slice("ref_id", i)).decode('utf-8')
+
+    def ner_example(self, i):
+        """Cửa sổ i cho NER: input_ids (subword, chưa có [CLS]/[SEP]), word_starts, labels (id BIO theo từ)"""
+        offsets = self.arrays["ner_word_starts_offsets"]
+        return {
+            "input_ids": self._slice("ner_input_ids", i),
+            "word_starts": self._slice("ner_word_starts", i),
+            "labels": self.arrays["ner_labels"][offsets[i]:offsets[i + 1]],
+        }
+
+    def entities(self, i):
+        """Thực thể của cửa sổ i: {index toàn cục: {'word', 'start', 'end', 'entity_group'}}"""
+        text = self.text(i)
+        offsets = self.arrays["entities_offsets"]
+        result = {}
+        for idx in range(offsets[i], offsets[i + 1]):
+            _, start, end, _, _, type_id = self.arrays["entities"][idx]
+            result[idx] = {'word': text[start:end], 'start': int(start), 'end': int(end),
+                           'entity_group': ENTITY_TYPES[type_id]}
+        return result
+
+    def re_example(self, j):
+        """Cặp RE thứ j: (input_ids đã chèn Typed Markers, có [CLS]/[SEP], chưa cắt; label id)"""
+        return self._slice("re_input_ids", j), int(self.arrays["relations"][j, 3])
+
+    def span_samples(self):
+        """Cùng định dạng với span_re.load_span_samples (id thực thể là index toàn cục)"""
+        samples = []
+        offsets = self.arrays["relations_offsets"]
+        relations = np.asarray(self.arrays["relations"])
+        for i in range(len(self)):
+            rows = relations[offsets[i]:offsets[i + 1]]
+            if len(rows):
+                samples.append({'text': self.text(i), 'entities': self.entities(i),
+                                'pairs': [(int(s), int(o), int(label)) for _, s, o, label in rows]})
+        return samples
+
+
+def load_dataset(path):
+    """path: thư mục dataset (<out>/<key>) hoặc thư mục out (lấy bản build gần nhất)"""
+    if not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        builds = [os.path.join(path, d) for d in os.listdir(path)
+                  if os.path.exists(os.path.join(path, d, MANIFEST_FILE))]
+        if not builds:
+            raise FileNotFoundError(f"Không có dataset nào trong {path} (chạy python -m src.dataset_builder).")
+        path = max(builds, key=lambda d: os.path.getmtime(os.path.join(d, MANIFEST_FILE)))
+    return CompiledDataset(path)
+
+
+def main():
+    import glob
+
+    default_data = sorted(glob.glob(os.path.join(BASE_DIR, "data", "label_studio", "ouput", "*.json")))
+    parser = argparse.ArgumentParser(description="Biên dịch export Label Studio thành dataset nhị phân (mmap)")
+    parser.add_argument("--data", nargs="+", default=default_data, help="Các file export Label Studio (.json/.jsonl)")
+    parser.add_argument("--out", default=os.path.join(BASE_DIR, "data", "compiled"))
+    parser.add_argument("--tokenizer", help="Tokenizer PhoBERT (mặc định VECTORIZER_BASE)")
+    parser.add_argument("--force", action="store_true", help="Build lại kể cả khi đã có bản cùng key")
+    args = parser.parse_args()
+
+    path = build_dataset(args.data, args.out, args.tokenizer, force=args.force)
+    start = time.perf_counter()
+    dataset = load_dataset(path)
+    print(f"-> Load {len(dataset)} cửa sổ trong {(time.perf_counter() - start) * 1000:.1f} ms: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Kho embedding PhoBERT (frozen) cho các model ML: NER CRF/SVM/LOGREG (vector theo từ) và RE SVM/RF/LOGREG
+(mean pooling câu đã chèn Typed Markers). Vector đã tính được lưu lại, lần train/đánh giá/inference sau
+đọc từ đĩa (mmap) thay vì chạy lại PhoBERT.
+
+    python -m src.embedding_store precompute --texts data/preprocessed/data_raw_400news_cleaned_split.csv
+    python -m src.embedding_store precompute --re-exports data/label_studio/ouput/*.json
+    python -m src.embedding_store info
+
+- Bật cho PhoBERTFeatureExtractor qua config EMBEDDING_STORE_DIR (env TNGT_EMBEDDING_STORE):
+  vectorize_token_level_many / vectorize_sentence_level_many tự đọc qua kho, chỉ tính các text chưa có.
+- Khóa: sha256(loại vector + text chuẩn hóa), kho nằm ở <dir>/<phiên bản extractor>/ (tokenizer, model,
+  backend, cách encode) nên đổi model/tokenizer sẽ dùng kho mới, không đọc nhầm vector cũ.
+- Dữ liệu: các shard .npy (float32 hoặc float16) chỉ ghi thêm, index.tsv (key, shard, dòng bắt đầu, số dòng).
+  Mỗi shard được ghi trọn rồi mới thêm dòng index -> nhiều tiến trình ghi cùng kho không làm hỏng nhau.
+"""
+import os
+import json
+import time
+import atexit
+import hashlib
+import argparse
+import threading
+import numpy as np
+from .config import BASE_DIR, EMBEDDING_STORE_DIR, EMBEDDING_STORE_DTYPE
+
+INDEX_FILE = "index.tsv"
+META_FILE = "meta.json"
+
+# Số dòng vector gom trong bộ nhớ trước khi ghi thành một shard
+SHARD_ROWS = 8192
+
+
+def normalize_text(kind, text):
+    """
+    "token": vector theo từ của text.split() -> gộp khoảng trắng không đổi kết quả.
+    "sentence": tokenizer PhoBERT giữ '\\n' sau mỗi từ -> giữ nguyên text.
+    """
+    return " ".join(text.split()) if kind == "token" else text
+
+
+def text_key(kind, text):
+    return hashlib.sha256(f"{kind}\0{normalize_text(kind, text)}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingStore:
+    _opened = {}
+    _opened_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, root, version, dtype=None):
+        """Mỗi thư mục kho chỉ mở một lần trong tiến trình (các extractor dùng chung index/bộ đệm ghi)"""
+        path = os.path.join(root, version[:16])
+        with cls._opened_lock:
+            if path not in cls._opened:
+                cls._opened[path] = cls(path, version, dtype or EMBEDDING_STORE_DTYPE)
+            return cls._opened[path]
+
+    def __init__(self, path, version, dtype="float32"):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            dtype = meta["dtype"] # Kho đã có: giữ dtype lúc tạo
+        else:
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": version, "dtype": dtype}, f, indent=2)
+        self.version = version
+        self.dtype = np.dtype(dtype)
+
+        self._lock = threading.Lock()
+        self._index = {}    # key -> (shard, start, rows)
+        self._shards = {}   # shard -> mảng mmap
+        self._pending = {}  # key -> mảng chưa ghi
+        self._pending_rows = 0
+        self._shard_no = 0
+        self.hits = 0
+        self.misses = 0
+        self.reload()
+        atexit.register(self.flush)
+
+    def reload(self):
+        """Đọc lại index (thấy các shard do tiến trình khác vừa ghi)"""
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, 'r', encoding='utf-8') as f:
+            entries = [line.split('\t') for line in f if line.endswith('\n')]
+        with self._lock:
+            for key, shard, start, rows in entries:
+                self._index[key] = (shard, int(start), int(rows))
+
+    def _shard(self, name):
+        if name not in self._shards:
+            self._shards[name] = np.load(os.path.join(self.path, name), mmap_mode='r')
+        return self._shards[name]
+
+    def _lookup(self, key):
+        if key in self._pending:
+            return self._pending[key]
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        shard, start, rows = entry
+        return self._shard(shard)[start:start + rows]
+
+    def get_many(self, kind, texts):
+        """Output: list mảng float32 [rows, hidden] (None nếu chưa có), đúng thứ tự texts"""
+        keys = [text_key(kind, text) for text in texts]
+        with self._lock:
+            found = [self._lookup(key) for key in keys]
+            n_hits = sum(v is not None for v in found)
+            self.hits += n_hits
+            self.misses += len(found) - n_hits
+        return [None if v is None else np.asarray(v, dtype=np.float32) for v in found]
+
+    def put_many(self, kind, texts, arrays):
+        """Thêm vector (bỏ qua mảng rỗng). Output: các mảng đã quy về dtype của kho (để kết quả không phụ thuộc cache)"""
+        stored = []
+        with self._lock:
+            for text, array in zip(texts, arrays):
+                array = np.asarray(array, dtype=self.dtype)
+                if array.ndim == 1:
+                    array = array[None, :]
+                if len(array):
+                    key = text_key(kind, text)
+                    if key not in self._index and key not in self._pending:
+                        self._pending[key] = array
+                        self._pending_rows += len(array)
+                stored.append(array.astype(np.float32))
+            flush = self._pending_rows >= SHARD_ROWS
+        if flush:
+            self.flush()
+        return stored
+
+    def read_through(self, kind, texts, compute):
+        """
+        Lấy vector từ kho, chỉ gọi compute(list text chưa có) MỘT lần cho các text còn thiếu
+        (text trùng trong cùng lượt chỉ tính một lần). Output: list mảng float32, đúng thứ tự texts.
+        """
+        results = self.get_many(kind, texts)
+        missing = {}
+        for i, value in enumerate(results):
+            if value is None:
+                missing.setdefault(normalize_text(kind, texts[i]), []).append(i)
+        if missing:
+            todo = list(missing)
+            for text, array in zip(todo, self.put_many(kind, todo, compute(todo))):
+                for i in missing[text]:
+                    results[i] = array
+        return results
+
+    def flush(self):
+        """Ghi các vector đang chờ thành một shard mới rồi thêm vào index"""
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending, self._pending_rows = self._pending, {}, 0
+            self._shard_no += 1
+            name = f"shard-{int(time.time() * 1000):x}-{os.getpid()}-{self._shard_no}.npy"
+
+            lines, start = [], 0
+            for key, array in pending.items():
+                lines.append(f"{key}\t{name}\t{start}\t{len(array)}\n")
+                self._index[key] = (name, start, len(array))
+                start += len(array)
+
+            tmp_path = os.path.join(self.path, name + ".tmp")
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.concatenate(list(pending.values())))
+            os.replace(tmp_path, os.path.join(self.path, name))
+            with open(os.path.join(self.path, INDEX_FILE), 'a', encoding='utf-8') as f:
+                f.write("".join(lines))
+
+    def info(self):
+        with self._lock:
+            shards = {entry[0] for entry in self._index.values()}
+            lookups = self.hits + self.misses
+            return {"path": self.path, "dtype": str(self.dtype), "entries": len(self._index) + len(self._pending),
+                    "shards": len(shards), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else None}
+
+
+def _read_texts(path, column):
+    """Text từ CSV (cột column) hoặc export Label Studio (.json/.jsonl, data.text)"""
+    if path.endswith((".json", ".jsonl")):
+        from .merge_json import iter_tasks
+        return [t['data']['text'] for t in iter_tasks(path) if (t.get('data') or {}).get('text')]
+    from .benchmark import load_texts
+    return load_texts(path, column)
+
+
+def _re_inputs(export_paths):
+    """Input RE (đã chèn Typed Markers + tách từ) cho mọi cặp ứng viên trong export, như lúc train/đánh giá"""
+    from .span_re import load_span_samples
+    from .pipeline import TNGTPipeline
+    from .segmentation import SegmentedWindow
+
+    inputs = []
+    for sample in load_span_samples(export_paths):
+        segmented = SegmentedWindow(sample['text'])
+        entities = sample['entities']
+        for s_id, o_id, _ in sample['pairs']:
+            marked = TNGTPipeline._prepare_input_typed(sample['text'], entities[s_id], entities[o_id], segmented)
+            if marked:
+                inputs.append(marked)
+    return inputs
+
+
+def precompute(extractor, texts, kind, batch_size=32, chunk=512):
+    """Tính và lưu vector cho toàn bộ texts theo từng chunk (mỗi chunk encode theo batch)"""
+    vectorize = (extractor.vectorize_token_level_many if kind == "token"
+                 else extractor.vectorize_sentence_level_many)
+    start = time.perf_counter()
+    for i in range(0, len(texts), chunk):
+        vectorize(texts[i:i + chunk], batch_size=batch_size)
+        print(f"-> {kind}: {min(i + chunk, len(texts))}/{len(texts)} ({time.perf_counter() - start:.0f}s)")
+    extractor.store.flush()
+
+
+def main():
+    from .features import PhoBERTFeatureExtractor
+
+    parser = argparse.ArgumentParser(description="Kho embedding PhoBERT cho các model ML")
+    parser.add_argument("command", choices=["precompute", "info"])
+    parser.add_argument("--store", default=EMBEDDING_STORE_DIR or os.path.join(BASE_DIR, "data", "embeddings"))
+    parser.add_argument("--dtype", choices=["float32", "float16"], default=None, help="Chỉ có tác dụng khi tạo kho mới")
+    parser.add_argument("--texts", nargs="*", default=[], help="CSV cửa sổ/bài báo hoặc export Label Studio -> vector theo từ (NER)")
+    parser.add_argument("--column", default="text", help="Cột text của CSV")
+    parser.add_argument("--re-exports", nargs="*", default=[], help="Export Label Studio -> vector câu của input RE")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    extractor = PhoBERTFeatureExtractor()
+    store = EmbeddingStore.open(args.store, extractor.extractor_version(), args.dtype)
+    extractor.use_store(store)
+
+    if args.command == "precompute":
+        for path in args.texts:
+            print(f"--- [EMBED] Vector theo từ: {path}")
+            precompute(extractor, _read_texts(path, args.column), "token", args.batch_size)
+        if args.re_exports:
+            print(f"--- [EMBED] Vector câu cho input RE: {len(args.re_exports)} file export")
+            precompute(extractor, _re_inputs(args.re_exports), "sentence", args.batch_size)
+    print(json.dumps(store.info(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,108 +1,226 @@
-import torch
+import os
+import threading
 import numpy as np
-from transformers import AutoTokenizer, AutoModel
-from .config import MODEL_PATHS, DEVICE, SPECIAL_TOKENS
+from functools import lru_cache
+from .config import (DL_BACKEND, SPECIAL_TOKENS, WORD_CACHE_SIZE, TORCH_THREADS_PER_WORKER, EMBEDDING_STORE_DIR,
+                     MAX_SEQ_LENGTH, LONG_INPUT_STRIDE)
+from .snapshot import resolve_model_path
+from .chunking import run_chunked, stitch
 
 class PhoBERTFeatureExtractor:
+    # Tăng khi đổi cách tính vector (kho embedding dùng trong khóa phiên bản)
+    FEATURE_VERSION = 2 # 2: input dài encode theo chunk chồng lấn (chunking.py) thay vì cắt ở MAX_LENGTH
+    MAX_LENGTH = MAX_SEQ_LENGTH
+    STRIDE = LONG_INPUT_STRIDE
+
     _instance = None
 
-    def __new__(cls):
-        if cls._instance is None:
-            print(f"--- [INFO] Loading Vectorizer Base ({MODEL_PATHS['VECTORIZER_BASE']})...")
-            cls._instance = super(PhoBERTFeatureExtractor, cls).__new__(cls)
-            
-            # Giữ use_fast=False để tương thích tốt với PhoBERT
-            cls._instance.tokenizer = AutoTokenizer.from_pretrained(
-                MODEL_PATHS["VECTORIZER_BASE"], 
-                use_fast=False 
-            )
-            
+    _init_lock = threading.Lock()
+
+    def __new__(cls, backend=None, onnx_dir=None, onnx_quantized=None):
+        """backend: "torch" | "onnx" (mặc định theo config DL_BACKEND), chỉ có tác dụng ở lần khởi tạo đầu tiên"""
+        instance = cls._instance
+        if instance is not None:
+            return instance
+
+        # Nhiều session/thread cùng gọi lần đầu: chỉ một thread load, các thread khác chờ rồi dùng chung
+        with cls._init_lock:
+            if cls._instance is None:
+                cls._instance = cls._build(backend or DL_BACKEND, onnx_dir, onnx_quantized)
+        return cls._instance
+
+    @classmethod
+    def _build(cls, backend, onnx_dir, onnx_quantized):
+        """Dựng đầy đủ instance trước khi gán vào _instance, thread khác không thấy instance dở dang"""
+        from transformers import AutoTokenizer, AutoModel # import nặng, chỉ khi load extractor
+        from .config import DEVICE
+        base_path = resolve_model_path("VECTORIZER_BASE")
+        if backend == "onnx":
+            from .onnx_backend import onnx_model_dir
+            base_path = onnx_model_dir("VECTORIZER_BASE", onnx_dir)
+        print(f"--- [INFO] Loading Vectorizer Base ({base_path})...")
+        instance = super(PhoBERTFeatureExtractor, cls).__new__(cls)
+        instance.base_path = base_path
+        instance.backend = backend
+        instance.store = None
+        
+        # Giữ use_fast=False để tương thích tốt với PhoBERT
+        instance.tokenizer = AutoTokenizer.from_pretrained(
+            base_path, 
+            use_fast=False 
+        )
+        
+        if backend == "onnx":
+            # Graph ONNX đã có embedding resize, tokenizer lưu kèm special tokens khi export
+            from .onnx_backend import OnnxEncoder
+            instance.model = OnnxEncoder(base_path, quantized=onnx_quantized, num_threads=TORCH_THREADS_PER_WORKER)
+        else:
             if SPECIAL_TOKENS:
-                cls._instance.tokenizer.add_special_tokens({'additional_special_tokens': SPECIAL_TOKENS})
+                instance.tokenizer.add_special_tokens({'additional_special_tokens': SPECIAL_TOKENS})
             
-            cls._instance.model = AutoModel.from_pretrained(MODEL_PATHS["VECTORIZER_BASE"])
-            cls._instance.model.resize_token_embeddings(len(cls._instance.tokenizer))
-            cls._instance.model.to(DEVICE)
-            cls._instance.model.eval()
-            
-        return cls._instance
+            instance.model = AutoModel.from_pretrained(base_path)
+            instance.model.resize_token_embeddings(len(instance.tokenizer))
+            instance.model.to(DEVICE)
+            instance.model.eval()
+            instance.model.requires_grad_(False)
+
+        # Cache word -> subword ids (LRU, sống suốt vòng đời extractor; lru_cache an toàn khi nhiều thread)
+        instance._word_subwords = lru_cache(maxsize=WORD_CACHE_SIZE)(instance._encode_word)
+
+        if EMBEDDING_STORE_DIR:
+            from .embedding_store import EmbeddingStore
+            instance.use_store(EmbeddingStore.open(EMBEDDING_STORE_DIR, instance.extractor_version()))
+        return instance
+
+    def extractor_version(self):
+        """Định danh những gì quyết định giá trị vector: model, backend, tokenizer, cách encode"""
+        import json
+        import hashlib
+        from .dataset_builder import tokenizer_fingerprint
+
+        payload = json.dumps({
+            "feature_version": self.FEATURE_VERSION,
+            "max_length": self.MAX_LENGTH,
+            "stride": self.STRIDE,
+            "model": str(self.base_path),
+            "backend": self.backend,
+            "onnx_file": os.path.basename(getattr(self.model, "path", "")) or None, # int8 hoặc fp32
+            "hidden_size": self.model.config.hidden_size,
+            "tokenizer": tokenizer_fingerprint(self.tokenizer),
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def use_store(self, store):
+        """Gắn kho embedding (None = tắt): các hàm vectorize_*_many đọc qua kho"""
+        self.store = store
+        if store is not None:
+            print(f"--- [INFO] Embedding store: {store.path}")
+
+    def _encode_word(self, word):
+        return tuple(self.tokenizer.encode(word, add_special_tokens=False))
+
+    def alignment_cache_info(self):
+        """Thống kê cache word -> subword: hits, misses, maxsize, currsize"""
+        return self._word_subwords.cache_info()
+
+    def _encode_words(self, tokens):
+        """
+        Encode một lượt cho list từ: dựng đồng thời input_ids và word_ids từ subword
+        của từng từ (lấy qua cache), thay vì tokenize cả câu rồi encode lại từng từ.
+        Kết quả trùng với tokenizer(tokens, is_split_into_words=True), không cắt (input dài được chia chunk khi encode).
+        """
+        input_ids = [self.tokenizer.cls_token_id]
+        wids = [None] # [CLS], [SEP] luôn là None
+
+        for i, token in enumerate(tokens):
+            subwords = self._word_subwords(token)
+            input_ids.extend(subwords)
+            wids.extend([i] * len(subwords))
+
+        input_ids.append(self.tokenizer.sep_token_id)
+        wids.append(None)
+        return input_ids, wids
+
+    def _hidden_states(self, sequences, batch_size=16):
+        """
+        last_hidden_state theo từng subword cho list input_ids (chưa cắt), input dài được encode
+        theo chunk chồng lấn rồi ghép lại. Output: list mảng float32 [len(ids), hidden].
+        """
+        import torch
+        from .config import DEVICE
+
+        def forward(batch):
+            inputs = self.tokenizer.pad({'input_ids': batch}, padding=True, return_tensors="pt").to(DEVICE)
+            with torch.no_grad():
+                hidden = self.model(**inputs).last_hidden_state.cpu().numpy() # [batch, seq_len, 768]
+            return [hidden[row, :len(ids)] for row, ids in enumerate(batch)]
+
+        return [stitch(chunks) for chunks in run_chunked(sequences, forward, batch_size, self.MAX_LENGTH, self.STRIDE)]
 
     def vectorize_token_level(self, text):
         """
         Dùng cho ML Models (CRF, LogReg, SVM).
         Logic: Manual Alignment (Tương thích use_fast=False)
         """
-        tokens = text.split()
-        if not tokens: return np.array([])
-        
-        inputs = self.tokenizer(
-            tokens, 
-            is_split_into_words=True, 
-            return_tensors="pt", 
-            padding=True, 
-            truncation=True, 
-            max_length=256
-        ).to(DEVICE)
-        
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-        
-        embeddings = outputs.last_hidden_state[0].cpu().numpy() # [seq_len, 768]
-        
-        # Encode từng từ lẻ để biết nó tách thành bao nhiêu subwords
-        wids = [None] # [CLS] luôn là None
-        for i, token in enumerate(tokens):
-            subwords = self.tokenizer.encode(token, add_special_tokens=False)
-            wids.extend([i] * len(subwords))
-            
-        seq_len = inputs['input_ids'].shape[1]
-        if len(wids) < seq_len:
-            wids.extend([None] * (seq_len - len(wids))) 
-        else:
-            wids = wids[:seq_len]
-            
-        # Lấy embedding của subword đầu tiên cho mỗi word
-        final_vectors = []
-        seen_word_idx = set()
-        
+        return self.vectorize_token_level_many([text])[0]
+
+    def vectorize_token_level_many(self, texts, batch_size=16):
+        """
+        Bản batch của vectorize_token_level: encode nhiều câu trong các mini-batch có padding.
+        Output: List các mảng [n_tokens, 768], đúng thứ tự input.
+        """
+        if self.store is not None:
+            return self.store.read_through("token", list(texts),
+                                           lambda missing: self._vectorize_token_level_many(missing, batch_size))
+        return self._vectorize_token_level_many(texts, batch_size)
+
+    def _vectorize_token_level_many(self, texts, batch_size=16):
+        results = [np.zeros((0, self.model.config.hidden_size), dtype=np.float32) for _ in texts]
+        encoded = []  # (vị trí, số từ, input_ids, word_ids)
+
+        for pos, text in enumerate(texts):
+            tokens = text.split()
+            if not tokens: continue
+
+            input_ids, wids = self._encode_words(tokens)
+            encoded.append((pos, len(tokens), input_ids, wids))
+
+        hidden = self._hidden_states([item[2] for item in encoded], batch_size)
+        for (pos, n_tokens, _, wids), embeddings in zip(encoded, hidden):
+            results[pos] = self._first_subword_vectors(embeddings, wids, n_tokens)
+
+        return results
+
+    @staticmethod
+    def _first_subword_vectors(embeddings, wids, n_tokens):
+        """
+        Lấy embedding của subword đầu tiên cho mỗi word.
+        Output: mảng float32 [n_tokens, hidden]. Từ không có subword nào (tokenizer trả về rỗng)
+        giữ vector 0 để tránh lỗi shape.
+        """
+        first_idx = {}
         for idx, word_id in enumerate(wids):
             # idx: vị trí trong chuỗi subwords (tương ứng với embeddings)
             # word_id: index của từ gốc (0, 1, 2...)
-            if word_id is not None and word_id not in seen_word_idx:
-                final_vectors.append(embeddings[idx])
-                seen_word_idx.add(word_id)
-        
-        # Nếu câu quá dài, PhoBERT cắt bớt -> thiếu vector cho các từ cuối
-        # Ta fill bằng vector 0 để tránh lỗi shape
-        if len(final_vectors) < len(tokens):
-            diff = len(tokens) - len(final_vectors)
-            for _ in range(diff):
-                final_vectors.append(np.zeros(768))
-                
-        return np.array(final_vectors)
+            if word_id is not None and word_id not in first_idx:
+                first_idx[word_id] = idx
+
+        vectors = np.zeros((n_tokens, embeddings.shape[-1]), dtype=np.float32)
+        if first_idx:
+            vectors[list(first_idx)] = embeddings[list(first_idx.values())]
+        return vectors
 
     def vectorize_sentence_level(self, text):
         """Dùng cho RE (Mean Pooling)"""
-        inputs = self.tokenizer(text, return_tensors="pt", padding=True, truncation=True, max_length=256).to(DEVICE)
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-        
-        # Mean Pooling logic
-        mask = inputs['attention_mask'].unsqueeze(-1).expand(outputs.last_hidden_state.size()).float()
-        sum_emb = torch.sum(outputs.last_hidden_state * mask, 1)
-        sum_mask = torch.clamp(mask.sum(1), min=1e-9)
-        return (sum_emb / sum_mask).cpu().numpy().flatten()
+        return self.vectorize_sentence_level_many([text])[0]
+
+    def vectorize_sentence_level_many(self, texts, batch_size=16):
+        """
+        Bản batch của vectorize_sentence_level: mean pooling trên các mini-batch có padding.
+        Output: ma trận float32 [len(texts), 768], đúng thứ tự input.
+        """
+        texts = list(texts)
+        if self.store is not None and texts:
+            return np.vstack(self.store.read_through(
+                "sentence", texts, lambda missing: self._vectorize_sentence_level_many(missing, batch_size)))
+        return self._vectorize_sentence_level_many(texts, batch_size)
+
+    def _vectorize_sentence_level_many(self, texts, batch_size=16):
+        vectors = np.zeros((len(texts), self.model.config.hidden_size), dtype=np.float32)
+        if not texts:
+            return vectors
+
+        encodings = self.tokenizer(texts)['input_ids']
+        # Mean Pooling trên toàn bộ subword (input dài: trên các chunk đã ghép lại)
+        for i, hidden in enumerate(self._hidden_states(encodings, batch_size)):
+            vectors[i] = hidden.mean(axis=0)
+
+        return vectors
     
     def extract_crf_features(self, text):
-        """Tạo đặc trưng cho CRF (List of Dicts)"""
-        vectors = self.vectorize_token_level(text)
-        
-        if len(vectors) == 0:
-            return []
+        """Tạo đặc trưng cho CRF: mảng float32 [n_tokens, 768]"""
+        return self.extract_crf_features_many([text])[0]
 
-        sent_feats = []
-        for vec in vectors:
-            feat_dict = {f'd{i}': v for i, v in enumerate(vec)}
-            sent_feats.append(feat_dict)
-            
-        return sent_feats
\ No newline at end of file
+    def extract_crf_features_many(self, texts, batch_size=16):
+        """Bản batch của extract_crf_features"""
+        return self.vectorize_token_level_many(texts, batch_size=batch_size)
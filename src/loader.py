@@ -1,77 +1,297 @@
 import os
-import joblib
+import gc
+import time
 import json  
-from transformers import AutoModelForTokenClassification, AutoModelForSequenceClassification, AutoTokenizer
-from .config import MODEL_PATHS, DEVICE
-from .features import PhoBERTFeatureExtractor
-from .wrappers import NERPredictor, REPredictor
+import threading
+from collections import OrderedDict
+from .config import CRF_ENGINE, DL_BACKEND, MODEL_MEMORY_BUDGET_MB, TORCH_THREADS_PER_WORKER
+from .snapshot import resolve_model_path
+from .cache import model_identity
+
+# torch / transformers / joblib và các predictor chỉ được import khi thật sự load model,
+# để `import src.loader` (và khởi động worker) không tốn vài giây import.
+
+EXTRACTOR_KEY = "VECTORIZER_BASE"
+
+
+def current_rss():
+    """RSS (bytes) của tiến trình hiện tại, None nếu không đọc được /proc (VD: Windows)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def estimate_model_bytes(obj):
+    """Ước lượng bộ nhớ theo số tham số torch (dùng khi không đo được RSS)"""
+    for candidate in (obj, getattr(obj, 'model', None), getattr(getattr(obj, 'model', None), 'module', None)):
+        if hasattr(candidate, 'parameters'):
+            return sum(p.numel() * p.element_size() for p in candidate.parameters())
+    return 0
+
 
 class SystemLoader:
-    def __init__(self):
+    """
+    Registry model: chỉ load khi được dùng lần đầu, giữ theo thứ tự LRU.
+    memory_budget_mb: tổng bộ nhớ tối đa cho các model đã load, vượt quá -> bỏ model lâu không dùng nhất.
+    """
+
+    def __init__(self, memory_budget_mb=None, backend=None, onnx_dir=None, onnx_quantized=None):
+        """backend: "torch" | "onnx" cho các model PhoBERT (mặc định theo config DL_BACKEND)"""
+        self.backend = backend or DL_BACKEND
+        self.onnx_dir = onnx_dir
+        self.onnx_quantized = onnx_quantized
         self.feature_extractor = None
-        self.cached_models = {} 
+        self.cached_models = OrderedDict() # key -> predictor, cuối = dùng gần nhất
+        self.model_memory = {}              # key -> bytes (RSS tăng thêm khi load)
+        self.last_used = {}
+        self.memory_budget_mb = memory_budget_mb if memory_budget_mb is not None else MODEL_MEMORY_BUDGET_MB
+        self._lock = threading.RLock()      # bảo vệ các dict của registry
+        self._load_lock = threading.RLock() # mỗi lúc chỉ load một model (đo RSS cho đúng)
+        self._warm_thread = None
+
+    def _lookup(self, key):
+        with self._lock:
+            model = self.cached_models.get(key)
+            if model is not None:
+                self.cached_models.move_to_end(key)
+                self.last_used[key] = time.time()
+            return model
+
+    def _import_backend(self, model_name):
+        """Import thư viện của model trước khi đo RSS, để bộ nhớ của thư viện không bị tính cho model"""
+        import torch # noqa: F401
+        from . import wrappers # noqa: F401
+        if model_name in ('PHOBERT', 'SPAN'):
+            from transformers import pipeline, AutoModel # noqa: F401
+            if self.backend == "onnx":
+                import onnxruntime # noqa: F401
+        else:
+            import joblib # noqa: F401
+
+    def _get_or_load(self, key, factory, model_name=None, kind=None):
+        model = self._lookup(key)
+        if model is not None:
+            return model
+
+        with self._load_lock:
+            # Thread khác có thể vừa load xong trong lúc chờ
+            model = self._lookup(key)
+            if model is not None:
+                return model
+
+            if model_name:
+                self._import_backend(model_name)
+            rss_before = current_rss()
+            model = factory()
+            if kind and hasattr(model, 'cache_id'):
+                # Định danh cho ResultCache (cache.py): đổi/train lại model -> khóa cache mới
+                model.cache_id = "|".join([key] + [model_identity(p) for p in self._model_sources(kind, model_name)])
+            if hasattr(model, 'freeze'):
+                # Predictor dùng chung giữa các session/thread: không được thay đổi sau khi load
+                model.freeze()
+            rss_after = current_rss()
+            if rss_before is not None and rss_after is not None:
+                memory = max(rss_after - rss_before, 0)
+            else:
+                memory = estimate_model_bytes(model)
+
+            with self._lock:
+                self.cached_models[key] = model
+                self.model_memory[key] = memory
+                self.last_used[key] = time.time()
+                print(f"-> {key}: {memory / 2**20:.0f} MB")
+                self._enforce_budget(keep=key)
+        return model
+
+    def _enforce_budget(self, keep):
+        """Bỏ các model lâu không dùng nhất cho tới khi tổng bộ nhớ nằm trong ngân sách"""
+        if not self.memory_budget_mb:
+            return
+        budget = self.memory_budget_mb * 2**20
+        evicted = False
+        while sum(self.model_memory.values()) > budget:
+            # Extractor dùng chung cho các model ML, chỉ bỏ khi không còn model nào cần nó
+            uses_extractor = any(getattr(m, 'feature_extractor', None) is not None
+                                 for m in self.cached_models.values())
+            candidates = [k for k in self.cached_models
+                          if k != keep and not (k == EXTRACTOR_KEY and uses_extractor)]
+            if not candidates:
+                print(f"--- [WARN] Vượt ngân sách bộ nhớ ({self.memory_budget_mb} MB) nhưng không còn model nào để bỏ.")
+                break
+            self.evict(candidates[0])
+            evicted = True
+
+        if evicted:
+            gc.collect()
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def evict(self, key):
+        """Bỏ model khỏi registry (bộ nhớ chỉ được giải phóng khi không còn nơi nào giữ tham chiếu)"""
+        with self._lock:
+            if key not in self.cached_models:
+                return
+            print(f"--- [EVICT] Bỏ {key} ({self.model_memory.get(key, 0) / 2**20:.0f} MB)")
+            del self.cached_models[key]
+            self.model_memory.pop(key, None)
+            self.last_used.pop(key, None)
+            if key == EXTRACTOR_KEY:
+                from .features import PhoBERTFeatureExtractor
+                self.feature_extractor = None
+                PhoBERTFeatureExtractor._instance = None
+
+    def warm(self, specs):
+        """
+        Load trước các model mặc định trên background thread.
+        specs: list (kind, model_name), kind là "NER" hoặc "RE".
+        """
+        def run():
+            for kind, name in specs:
+                try:
+                    if kind == "NER":
+                        self.load_ner_model(name)
+                    else:
+                        self.load_re_model(name)
+                except Exception as e:
+                    print(f"--- [WARN] Không warm được {kind} {name}: {e}")
+
+        self._warm_thread = threading.Thread(target=run, name="model-warmup", daemon=True)
+        self._warm_thread.start()
+        return self._warm_thread
+
+    def memory_report(self):
+        """Bộ nhớ của từng model đã load (theo thứ tự LRU -> MRU)"""
+        with self._lock:
+            now = time.time()
+            return [{"model": key,
+                     "memory_mb": round(self.model_memory.get(key, 0) / 2**20, 1),
+                     "idle_s": round(now - self.last_used.get(key, now), 1)}
+                    for key in self.cached_models]
+
+    def _model_sources(self, kind, model_name):
+        """Các file/thư mục quyết định output của predictor (kind: "NER" | "RE")"""
+        if model_name == 'PHOBERT' and self.backend == "onnx":
+            from .onnx_backend import onnx_model_dir
+            return [onnx_model_dir(kind, self.onnx_dir)]
+        sources = [resolve_model_path(kind, model_name)]
+        if model_name not in ('PHOBERT', 'SPAN'):
+            sources.append(resolve_model_path(kind, "LABEL_MAP" if kind == "NER" else "METADATA"))
+            sources.append(self.feature_extractor.extractor_version())
+        return sources
 
     def _get_extractor(self):
-        if not self.feature_extractor:
-            self.feature_extractor = PhoBERTFeatureExtractor()
+        from .features import PhoBERTFeatureExtractor
+        self.feature_extractor = self._get_or_load(
+            EXTRACTOR_KEY,
+            lambda: PhoBERTFeatureExtractor(self.backend, self.onnx_dir, self.onnx_quantized),
+            'PHOBERT')
         return self.feature_extractor
 
-    def load_ner_model(self, model_name):
-        cache_key = f"NER_{model_name}"
-        if cache_key in self.cached_models:
-            return self.cached_models[cache_key]
+    def load_ner_model(self, model_name, crf_engine=None):
+        """crf_engine: "viterbi" | "crfsuite", chỉ dùng cho CRF (mặc định theo config CRF_ENGINE)"""
+        crf_engine = crf_engine or CRF_ENGINE
+        cache_key = f"NER_{model_name}_{crf_engine}" if model_name == 'CRF' else f"NER_{model_name}"
+        if model_name == 'PHOBERT' and self.backend == "onnx":
+            cache_key += "_onnx"
+        predictor = self._lookup(cache_key)
+        if predictor is not None:
+            return predictor
+
+        # Extractor được load (và tính bộ nhớ) riêng, trước model ML dùng nó
+        extractor = self._get_extractor() if model_name != 'PHOBERT' else None
+        return self._get_or_load(cache_key, lambda: self._build_ner_model(model_name, crf_engine, extractor),
+                                 model_name, kind="NER")
+
+    def _build_ner_model(self, model_name, crf_engine, extractor):
+        from .config import DEVICE
+        from .wrappers import NERPredictor
 
         print(f"--- [LOAD] Đang tải NER: {model_name}...")
-        path = MODEL_PATHS["NER"].get(model_name)
+        path = resolve_model_path("NER", model_name)
         
+        if model_name == 'PHOBERT' and self.backend == "onnx":
+            from transformers import AutoTokenizer
+            from .onnx_backend import OnnxEncoder, onnx_model_dir
+            path = onnx_model_dir("NER", self.onnx_dir)
+            model = OnnxEncoder(path, quantized=self.onnx_quantized, num_threads=TORCH_THREADS_PER_WORKER)
+            return NERPredictor('DL', model, tokenizer=AutoTokenizer.from_pretrained(path))
+
         if model_name == 'PHOBERT':
+            from transformers import AutoModelForTokenClassification, AutoTokenizer
             tokenizer = AutoTokenizer.from_pretrained(path)
             model = AutoModelForTokenClassification.from_pretrained(path).to(DEVICE)
-            predictor = NERPredictor('DL', model, tokenizer=tokenizer)
+            return NERPredictor('DL', model, tokenizer=tokenizer)
+        
+        import joblib
+        # mmap_mode='r': mảng numpy của model được map thẳng từ file (không nén) thay vì copy vào RAM
+        model = joblib.load(path, mmap_mode='r')
+        
+        map_path = resolve_model_path("NER", "LABEL_MAP")
         
+        with open(map_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        
+        if "id2label" in data:
+            raw_map = data["id2label"] # Dạng {"0": "O", "1": "B-LOC"...}
+            label_map = {int(k): v for k, v in raw_map.items()}
         else:
-            model = joblib.load(path)
-            
-            map_path = MODEL_PATHS["NER"]["LABEL_MAP"]
-            
-            with open(map_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            if "id2label" in data:
-                raw_map = data["id2label"] # Dạng {"0": "O", "1": "B-LOC"...}
-                label_map = {int(k): v for k, v in raw_map.items()}
-            else:
-                # Fallback nếu file cấu trúc khác
-                label_map = data
+            # Fallback nếu file cấu trúc khác
+            label_map = data
 
-            predictor = NERPredictor('ML', model, 
-                                     feature_extractor=self._get_extractor(), 
-                                     label_map=label_map)
-        
-        self.cached_models[cache_key] = predictor
-        return predictor
+        crf_decoder = None
+        if model_name == 'CRF' and crf_engine == 'viterbi':
+            from .crf_decoder import ViterbiCRFDecoder
+            crf_decoder = ViterbiCRFDecoder(model)
+
+        return NERPredictor('ML', model, 
+                            feature_extractor=extractor, 
+                            label_map=label_map,
+                            crf_decoder=crf_decoder)
 
     def load_re_model(self, model_name):
         cache_key = f"RE_{model_name}"
-        if cache_key in self.cached_models:
-            return self.cached_models[cache_key]
+        if model_name == 'PHOBERT' and self.backend == "onnx":
+            cache_key += "_onnx"
+        predictor = self._lookup(cache_key)
+        if predictor is not None:
+            return predictor
+
+        extractor = self._get_extractor() if model_name not in ('PHOBERT', 'SPAN') else None
+        return self._get_or_load(cache_key, lambda: self._build_re_model(model_name, extractor), model_name, kind="RE")
+
+    def _build_re_model(self, model_name, extractor):
+        from .config import DEVICE
+        from .wrappers import REPredictor, add_marker_tokens
 
         print(f"--- [LOAD] Đang tải RE: {model_name}...")
-        path = MODEL_PATHS["RE"].get(model_name)
+        path = resolve_model_path("RE", model_name)
+
+        if model_name == 'PHOBERT' and self.backend == "onnx":
+            from transformers import AutoTokenizer
+            from .onnx_backend import OnnxEncoder, onnx_model_dir
+            path = onnx_model_dir("RE", self.onnx_dir)
+            model = OnnxEncoder(path, quantized=self.onnx_quantized, num_threads=TORCH_THREADS_PER_WORKER)
+            return REPredictor('DL', model, tokenizer=AutoTokenizer.from_pretrained(path))
 
         if model_name == 'PHOBERT':
-            tokenizer = AutoTokenizer.from_pretrained(path)
-            model = AutoModelForSequenceClassification.from_pretrained(path).to(DEVICE)
-            predictor = REPredictor('DL', model, tokenizer=tokenizer)
-        else:
-            model = joblib.load(path)
-            meta_path = MODEL_PATHS["RE"]["METADATA"]
-            metadata = joblib.load(meta_path)
-            encoder = metadata.get('label_encoder') if isinstance(metadata, dict) else metadata
-            
-            predictor = REPredictor('ML', model, 
-                                    feature_extractor=self._get_extractor(), 
-                                    label_encoder=encoder)
-
-        self.cached_models[cache_key] = predictor
-        return predictor
\ No newline at end of file
+            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+            tokenizer, model = add_marker_tokens(AutoTokenizer.from_pretrained(path),
+                                                 AutoModelForSequenceClassification.from_pretrained(path))
+            return REPredictor('DL', model.to(DEVICE), tokenizer=tokenizer)
+        if model_name == 'SPAN':
+            # Encode mỗi cửa sổ một lần, phân loại cặp từ span đã pool
+            from .span_re import SpanREModel
+            return REPredictor('SPAN', SpanREModel.from_pretrained(path))
+
+        import joblib
+        model = joblib.load(path, mmap_mode='r')
+        meta_path = resolve_model_path("RE", "METADATA")
+        metadata = joblib.load(meta_path)
+        encoder = metadata.get('label_encoder') if isinstance(metadata, dict) else metadata
+        
+        return REPredictor('ML', model, 
+                           feature_extractor=extractor, 
+                           label_encoder=encoder)
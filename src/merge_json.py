@@ -1,21 +1,140 @@
+"""
+Gộp các file export Label Studio (JSON array hoặc JSONL) -> một file JSONL, mỗi dòng một task.
+
+    python -m src.merge_json data/label_studio/ouput/*.json --output data/label_studio/merged.jsonl
+
+- Đọc từng task một (json.JSONDecoder.raw_decode trên buffer đọc dần), không nạp cả file vào RAM.
+- Task trùng (cùng article_id + ref_id) chỉ giữ bản có annotation mới nhất (updated_at); bằng nhau thì
+  giữ bản xuất hiện sau (file sau trong danh sách).
+- Hai lượt đọc: lượt 1 chỉ giữ (key -> vị trí bản thắng, dấu vân tay annotation), lượt 2 ghi các bản thắng
+  theo thứ tự xuất hiện. Thống kê: số task trùng và số task trùng nhưng annotation khác nhau (conflict).
+"""
+import re
 import json
+import hashlib
+import argparse
+from datetime import datetime
+
+_WHITESPACE_RE = re.compile(r'[\s,]*')
+_DECODER = json.JSONDecoder()
+
+
+def iter_tasks(path, block_size=1 << 16):
+    """
+    Đọc từng phần tử của file JSON array hoặc từng dòng JSONL mà không json.load cả file.
+    Output: dict task theo đúng thứ tự trong file.
+    """
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        buf = f.read(block_size)
+        pos = _WHITESPACE_RE.match(buf).end()
+        in_array = buf[pos:pos + 1] == '['
+        if in_array:
+            pos += 1
+        eof = False
+        while True:
+            pos = _WHITESPACE_RE.match(buf, pos).end()
+            if pos == len(buf) or (in_array and buf[pos] == ']'):
+                if eof or (in_array and pos < len(buf)):
+                    return
+                buf, pos = buf[pos:] + f.read(block_size), 0
+                eof = pos == len(buf)
+                continue
+            try:
+                task, pos = _DECODER.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Task bị cắt ngang ở cuối buffer: đọc thêm (tăng dần kích thước để task lớn không phải parse lại nhiều lần)
+                more = f.read(max(block_size, len(buf) - pos))
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield task
+
+
+def task_key(task):
+    """Khóa dedup: (article_id, ref_id) của data; None nếu task không có ref_id"""
+    data = task.get('data') or {}
+    ref_id = data.get('ref_id')
+    if ref_id is None:
+        return None
+    return (str(data.get('article_id', '')), str(ref_id))
+
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, ValueError):
+        return float('-inf')
+
+
+def task_updated_at(task):
+    """Thời điểm annotation mới nhất của task (không có annotation -> updated_at của task)"""
+    annotations = task.get('annotations') or []
+    times = [_parse_time(a.get('updated_at') or a.get('created_at')) for a in annotations]
+    if times:
+        return max(times)
+    return _parse_time(task.get('updated_at') or task.get('created_at'))
+
+
+def annotation_fingerprint(task):
+    """Hash kết quả gán nhãn (bỏ các trường id/thời gian) để phát hiện bản trùng có nhãn khác nhau"""
+    results = [a.get('result', []) for a in task.get('annotations') or [] if not a.get('was_cancelled')]
+    payload = json.dumps(results, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def merge_exports(paths, output_path):
+    """
+    Gộp + dedup các file export vào output_path (JSONL). Output: dict thống kê.
+    """
+    stats = {"files": len(paths), "tasks": 0, "unique": 0, "duplicates": 0, "conflicts": 0, "no_ref_id": 0}
+
+    # Lượt 1: vị trí (file, thứ tự) của bản thắng cho mỗi key
+    best = {}         # key -> (updated_at, file_idx, position)
+    fingerprints = {} # key -> fingerprint của bản đầu tiên, False nếu đã có conflict
+    for file_idx, path in enumerate(paths):
+        for position, task in enumerate(iter_tasks(path)):
+            stats["tasks"] += 1
+            key = task_key(task)
+            if key is None:
+                stats["no_ref_id"] += 1
+                continue
+            candidate = (task_updated_at(task), file_idx, position)
+            if key not in best:
+                best[key] = candidate
+                fingerprints[key] = annotation_fingerprint(task)
+                continue
+
+            stats["duplicates"] += 1
+            if fingerprints[key] is not False and fingerprints[key] != annotation_fingerprint(task):
+                fingerprints[key] = False
+                stats["conflicts"] += 1
+            if candidate >= best[key]:
+                best[key] = candidate
+    winners = {(file_idx, position) for _, file_idx, position in best.values()}
+    del best, fingerprints
+
+    # Lượt 2: ghi các bản thắng (task không có ref_id được giữ nguyên)
+    with open(output_path, 'w', encoding='utf-8') as out:
+        for file_idx, path in enumerate(paths):
+            for position, task in enumerate(iter_tasks(path)):
+                if (file_idx, position) in winners or task_key(task) is None:
+                    out.write(json.dumps(task, ensure_ascii=False) + "\n")
+                    stats["unique"] += 1
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gộp + dedup các file export Label Studio thành JSONL")
+    parser.add_argument("inputs", nargs="+", help="Các file export (.json hoặc .jsonl), file sau được ưu tiên khi bằng thời gian")
+    parser.add_argument("--output", default="output.jsonl")
+    args = parser.parse_args()
+
+    stats = merge_exports(args.inputs, args.output)
+    print(f"--- [MERGE] {stats['files']} file, {stats['tasks']} task -> {stats['unique']} task ({args.output})")
+    print(f"-> Trùng: {stats['duplicates']} (khác nhãn: {stats['conflicts']}), không có ref_id: {stats['no_ref_id']}")
+
 
-files = [
-    "data\\label_studio\\ouput\\part1.json",
-    "data\\label_studio\\ouput\\part2.json",
-    "data\\label_studio\\ouput\\part3.json",
-    "data\\label_studio\\ouput\\part4.json"
-]
-
-merged = []
-
-for f in files:
-    with open(f, "r", encoding="utf-8") as file:
-        data = json.load(file)
-        if isinstance(data, list):
-            merged.extend(data)
-        else:
-            raise ValueError(f"{f} không phải list")
-
-with open("output.json", "w", encoding="utf-8") as out:
-    json.dump(merged, out, ensure_ascii=False, indent=2)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Đo thời gian theo từng bước và đếm số lượng cho TNGTPipeline.
+
+    metrics = RunMetrics()
+    with metrics.stage("ner"):
+        ...
+    metrics.count("entities", 12)
+    metrics.as_dict()  # {"timings_ms": {...}, "counters": {...}, "total_ms": ...}
+
+Các bước của pipeline: cleaning, windowing, ner, pairs, segmentation (pyvi), markers, re, post_processing.
+Hook (MetricsHook) được gọi khi xong mỗi bước và khi xong một lượt chạy, VD PrometheusExporter
+gom số liệu cho endpoint /metrics của service.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+# Bucket (giây) cho histogram thời gian mỗi bước
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class MetricsHook:
+    """Hook rỗng: kế thừa và override các hàm cần dùng"""
+
+    def on_stage(self, stage, seconds):
+        pass
+
+    def on_run(self, metrics):
+        pass
+
+
+class RunMetrics:
+    """Thời gian (cộng dồn theo bước) và bộ đếm của một lượt run/run_many"""
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self.timings = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        self.total = None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        for hook in self.hooks:
+            hook.on_stage(name, seconds)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self):
+        """Kết thúc lượt chạy và gọi hook on_run (chỉ một lần)"""
+        if self.total is None:
+            self.total = time.perf_counter() - self.started
+            for hook in self.hooks:
+                hook.on_run(self)
+        return self
+
+    def as_dict(self):
+        total = self.total if self.total is not None else time.perf_counter() - self.started
+        return {
+            "timings_ms": {name: round(seconds * 1000, 3) for name, seconds in self.timings.items()},
+            "counters": dict(self.counters),
+            "total_ms": round(total * 1000, 3),
+        }
+
+
+class PrometheusExporter(MetricsHook):
+    """
+    Gom số liệu của mọi lượt chạy (an toàn khi nhiều thread) và xuất ở định dạng text của Prometheus:
+      tngt_stage_seconds{stage="..."}  histogram thời gian từng bước (tổng trong mỗi lượt chạy)
+      tngt_run_seconds                 histogram thời gian cả lượt
+      tngt_<counter>_total             tổng các bộ đếm (windows, entities, candidate_pairs, re_inputs...)
+    """
+
+    def __init__(self, prefix="tngt", buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._stages = {} # stage -> [bucket counts, sum, count]
+        self._runs = [[0] * len(self.buckets), 0.0, 0]
+        self._counters = {}
+
+    def _observe(self, hist, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                hist[0][i] += 1
+        hist[1] += seconds
+        hist[2] += 1
+
+    def on_run(self, metrics):
+        # Histogram theo tổng thời gian của mỗi bước trong lượt chạy (một bước có thể được đo nhiều lần, VD theo cửa sổ)
+        with self._lock:
+            for stage, seconds in metrics.timings.items():
+                self._observe(self._stages.setdefault(stage, [[0] * len(self.buckets), 0.0, 0]), seconds)
+            self._observe(self._runs, metrics.total)
+            for name, value in metrics.counters.items():
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def _render_histogram(self, lines, name, hist, labels=""):
+        sep = "," if labels else ""
+        for bound, count in zip(self.buckets, hist[0]):
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {hist[2]}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {hist[1]:.6f}")
+        lines.append(f"{name}_count{suffix} {hist[2]}")
+
+    def render(self):
+        """Text exposition format (Content-Type: text/plain; version=0.0.4)"""
+        lines = []
+        with self._lock:
+            name = f"{self.prefix}_stage_seconds"
+            lines += [f"# HELP {name} Thời gian từng bước của pipeline", f"# TYPE {name} histogram"]
+            for stage, hist in self._stages.items():
+                self._render_histogram(lines, name, hist, f'stage="{stage}"')
+
+            name = f"{self.prefix}_run_seconds"
+            lines += [f"# HELP {name} Thời gian mỗi lượt chạy pipeline", f"# TYPE {name} histogram"]
+            self._render_histogram(lines, name, self._runs)
+
+            for counter, value in sorted(self._counters.items()):
+                name = f"{self.prefix}_{counter}_total"
+                lines += [f"# TYPE {name} counter", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
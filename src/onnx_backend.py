@@ -0,0 +1,235 @@
+"""
+Backend ONNX Runtime (CPU) cho các model PhoBERT: NER, RE và feature extractor.
+
+    python -m src.onnx_backend export              # xuất ONNX + bản int8 (quantize_dynamic) vào config.ONNX_DIR
+    python -m src.onnx_backend export --no-quantize
+    python -m src.onnx_backend verify --limit 200  # so nhãn với backend PyTorch trên file split CSV
+
+Dùng: SystemLoader(backend="onnx") hoặc đặt config.DL_BACKEND = "onnx".
+"""
+import os
+import numpy as np
+from types import SimpleNamespace
+from .config import ONNX_DIR, ONNX_QUANTIZED, SPECIAL_TOKENS
+
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model.int8.onnx"
+
+# Model PhoBERT -> (thư mục con trong ONNX_DIR, tên output của graph)
+ONNX_MODELS = {
+    "VECTORIZER_BASE": ("vectorizer_base", "last_hidden_state"),
+    "NER": ("ner_phobert", "logits"),
+    "RE": ("re_phobert", "logits"),
+}
+
+
+def onnx_model_dir(kind, onnx_dir=None):
+    return os.path.join(onnx_dir or ONNX_DIR, ONNX_MODELS[kind][0])
+
+
+class OnnxEncoder:
+    """
+    Bọc onnxruntime.InferenceSession với interface giống model HF mà các predictor đang dùng:
+    model(input_ids=..., attention_mask=...) -> output có .logits / .last_hidden_state (torch tensor).
+    """
+    is_onnx = True
+
+    def __init__(self, model_dir, quantized=None, num_threads=None):
+        import onnxruntime as ort
+        from transformers import AutoConfig
+
+        quantized = ONNX_QUANTIZED if quantized is None else quantized
+        path = os.path.join(model_dir, ONNX_INT8_FILE)
+        if not quantized or not os.path.exists(path):
+            path = os.path.join(model_dir, ONNX_FILE)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.output_name = self.session.get_outputs()[0].name
+        self.config = AutoConfig.from_pretrained(model_dir)
+
+    def __call__(self, input_ids, attention_mask=None, **kwargs):
+        import torch
+
+        input_ids = np.asarray(input_ids.cpu() if hasattr(input_ids, 'cpu') else input_ids, dtype=np.int64)
+        if attention_mask is None:
+            attention_mask = np.ones_like(input_ids)
+        attention_mask = np.asarray(attention_mask.cpu() if hasattr(attention_mask, 'cpu') else attention_mask,
+                                    dtype=np.int64)
+        output = self.session.run([self.output_name], {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+        return SimpleNamespace(**{self.output_name: torch.from_numpy(output)})
+
+    # Các predictor gọi .to()/.eval() như với model torch
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+
+def _load_for_export(kind, source):
+    """Load model torch + tokenizer giống hệt cách loader/extractor dùng (kể cả special tokens)"""
+    from transformers import AutoTokenizer, AutoModel, AutoModelForTokenClassification, AutoModelForSequenceClassification
+
+    if kind == "NER":
+        return AutoTokenizer.from_pretrained(source), AutoModelForTokenClassification.from_pretrained(source)
+
+    if kind == "RE":
+        tokenizer = AutoTokenizer.from_pretrained(source)
+        model = AutoModelForSequenceClassification.from_pretrained(source)
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(source, use_fast=False)
+        model = AutoModel.from_pretrained(source)
+
+    # Embedding đã resize được xuất luôn vào graph, tokenizer lưu kèm special tokens
+    if tokenizer.add_special_tokens({'additional_special_tokens': SPECIAL_TOKENS}) > 0 or kind == "VECTORIZER_BASE":
+        model.resize_token_embeddings(len(tokenizer))
+    return tokenizer, model
+
+
+def export_model(kind, source, out_dir, quantize=True, opset=17):
+    import torch
+
+    tokenizer, model = _load_for_export(kind, source)
+    model.eval()
+    output_name = ONNX_MODELS[kind][1]
+
+    class ExportWrapper(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, input_ids, attention_mask):
+            return getattr(self.inner(input_ids=input_ids, attention_mask=attention_mask), output_name)
+
+    os.makedirs(out_dir, exist_ok=True)
+    sample = tokenizer(["Tai nạn giao thông tại Hà Nội"], return_tensors="pt")
+    onnx_path = os.path.join(out_dir, ONNX_FILE)
+    dynamic_axes = {"input_ids": {0: "batch", 1: "seq"}, "attention_mask": {0: "batch", 1: "seq"},
+                    output_name: {0: "batch"} if kind == "RE" else {0: "batch", 1: "seq"}}
+    with torch.no_grad():
+        torch.onnx.export(ExportWrapper(model), (sample["input_ids"], sample["attention_mask"]), onnx_path,
+                          input_names=["input_ids", "attention_mask"], output_names=[output_name],
+                          dynamic_axes=dynamic_axes, opset_version=opset, dynamo=False)
+
+    tokenizer.save_pretrained(out_dir)
+    model.config.save_pretrained(out_dir)
+    print(f"-> {kind}: {onnx_path} ({os.path.getsize(onnx_path) / 2**20:.0f} MB)")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.join(out_dir, ONNX_INT8_FILE)
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"-> {kind}: {int8_path} ({os.path.getsize(int8_path) / 2**20:.0f} MB)")
+
+
+def verify(csv_path, limit=None, batch_size=16, min_agreement=0.99, onnx_dir=None, quantized=None):
+    """
+    Accuracy gate: so nhãn backend ONNX với PyTorch trên các cửa sổ của file split CSV.
+      - NER: nhãn theo từng subword
+      - RE: nhãn quan hệ trên input Typed Markers dựng từ thực thể NER (PyTorch)
+      - Extractor: nhãn của NER CRF trên đặc trưng từ hai backend
+    Output: True nếu mọi tỉ lệ khớp >= min_agreement.
+    """
+    import torch
+    import pandas as pd
+    from .loader import SystemLoader
+    from .pipeline import TNGTPipeline
+    from .features import PhoBERTFeatureExtractor
+
+    texts = pd.read_csv(csv_path)['text'].dropna().astype(str).tolist()
+    if limit:
+        texts = texts[:limit]
+
+    def ner_token_labels(predictor):
+        tokenizer, labels = predictor.tokenizer, []
+        for start in range(0, len(texts), batch_size):
+            inputs = tokenizer(texts[start:start + batch_size], truncation=True, padding=True, return_tensors="pt")
+            with torch.no_grad():
+                pred = predictor.model(**inputs).logits.argmax(dim=-1)
+            labels.extend(pred[inputs['attention_mask'].bool()].tolist())
+        return labels
+
+    def agreement(a, b):
+        return sum(x == y for x, y in zip(a, b)) / max(len(a), 1)
+
+    results = {}
+    torch_loader = SystemLoader(backend="torch")
+    onnx_loader = SystemLoader(backend="onnx", onnx_dir=onnx_dir, onnx_quantized=quantized)
+
+    # NER
+    ner_torch = torch_loader.load_ner_model("PHOBERT")
+    ner_onnx = onnx_loader.load_ner_model("PHOBERT")
+    results["NER (subword)"] = agreement(ner_token_labels(ner_torch), ner_token_labels(ner_onnx))
+
+    # RE: input Typed Markers từ thực thể NER
+    pipeline = TNGTPipeline(ner_torch, torch_loader.load_re_model("PHOBERT"))
+    articles = [([text], [(text, [(0, 0)], [(0, 0)])]) for text in texts]
+    _, window_jobs = pipeline._collect_windows(articles, ner_torch.predict_many(texts, batch_size=batch_size))
+    re_inputs = [job[3] for job in pipeline._build_re_jobs(window_jobs)][:2000]
+    re_torch = pipeline.re_predictor.predict_batch(re_inputs, batch_size=batch_size)
+    re_onnx = onnx_loader.load_re_model("PHOBERT").predict_batch(re_inputs, batch_size=batch_size)
+    results["RE"] = agreement(re_torch, re_onnx)
+
+    # Extractor (qua NER CRF). Extractor là singleton nên đổi backend bằng cách bỏ instance cũ.
+    crf_labels = {}
+    for name, loader in (("torch", torch_loader), ("onnx", onnx_loader)):
+        PhoBERTFeatureExtractor._instance = None
+        predictor = loader.load_ner_model("CRF", crf_engine="viterbi")
+        features = predictor.feature_extractor.extract_crf_features_many(texts, batch_size=batch_size)
+        crf_labels[name] = [label for labels in predictor.crf_decoder.decode_batch(features) for label in labels]
+    PhoBERTFeatureExtractor._instance = None
+    results["Extractor (CRF)"] = agreement(crf_labels["torch"], crf_labels["onnx"])
+
+    passed = True
+    for name, value in results.items():
+        ok = value >= min_agreement
+        passed = passed and ok
+        print(f"-> {name}: khớp {value:.4%} {'OK' if ok else 'FAIL'}")
+    return passed
+
+
+def main():
+    import sys
+    import argparse
+    from .config import BASE_DIR
+    from .snapshot import resolve_model_path
+
+    parser = argparse.ArgumentParser(description="Xuất / kiểm tra backend ONNX cho các model PhoBERT")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = sub.add_parser("export")
+    export_parser.add_argument("--out", default=ONNX_DIR)
+    export_parser.add_argument("--only", nargs="*", choices=list(ONNX_MODELS))
+    export_parser.add_argument("--no-quantize", action="store_true", help="Không tạo bản int8")
+    export_parser.add_argument("--opset", type=int, default=17)
+
+    verify_parser = sub.add_parser("verify")
+    verify_parser.add_argument("--csv", default=os.path.join(BASE_DIR, "data/preprocessed/data_raw_400news_cleaned_split.csv"))
+    verify_parser.add_argument("--onnx-dir", default=ONNX_DIR)
+    verify_parser.add_argument("--limit", type=int, default=200)
+    verify_parser.add_argument("--batch-size", type=int, default=16)
+    verify_parser.add_argument("--min-agreement", type=float, default=0.99)
+    verify_parser.add_argument("--fp32", action="store_true", help="Kiểm tra bản fp32 thay vì int8")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        sources = {"VECTORIZER_BASE": resolve_model_path("VECTORIZER_BASE"),
+                   "NER": resolve_model_path("NER", "PHOBERT"),
+                   "RE": resolve_model_path("RE", "PHOBERT")}
+        for kind in args.only or ONNX_MODELS:
+            print(f"--- [EXPORT] {kind} <- {sources[kind]}")
+            export_model(kind, sources[kind], onnx_model_dir(kind, args.out),
+                         quantize=not args.no_quantize, opset=args.opset)
+    else:
+        passed = verify(args.csv, limit=args.limit, batch_size=args.batch_size, min_agreement=args.min_agreement,
+                        onnx_dir=args.onnx_dir, quantized=not args.fp32)
+        sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,71 @@
 import re
-from pyvi import ViTokenizer
-from .preprocessing import sliding_window_extract, clean_text_basic
+import copy
+import json
+from bisect import bisect_right
+from .segmentation import SegmentedWindow, word_segment
+from .preprocessing import (sliding_window_extract, sliding_window_spans, split_sentences,
+                            clean_text_basic, restore_abbreviations)
 from .config import VALID_RE_PAIRS
+from .metrics import RunMetrics
+from .cache import make_key, predictor_identity
 
 class TNGTPipeline:
-    def __init__(self, ner_model, re_model):
+    def __init__(self, ner_model, re_model, ner_batch_size=16, re_batch_size=16,
+                 window_size=3, step_size=2, reuse_overlap=False,
+                 dedup_pairs=False, max_pair_sentence_distance=None, max_pair_token_distance=None, hooks=None,
+                 cache=None):
+        """
+        reuse_overlap: chạy NER một lần cho mỗi câu thay vì cho mỗi cửa sổ,
+        rồi ghép lại thực thể theo cửa sổ để làm ngữ cảnh cho RE.
+        dedup_pairs: cặp (chủ thể, đối tượng) cùng câu đã xuất hiện ở cửa sổ trước (vùng chồng lấp)
+        thì không phân loại lại. Tùy chọn (mặc định tắt): chỉ giữ nhãn theo ngữ cảnh của cửa sổ đầu tiên
+        nên output RE khác với khi phân loại cặp ở mọi cửa sổ.
+        max_pair_sentence_distance / max_pair_token_distance: bỏ cặp có hai thực thể cách nhau
+        quá số câu / số từ này (None = không giới hạn).
+        hooks: list MetricsHook (metrics.py) nhận thời gian từng bước và số liệu của mỗi lượt chạy.
+        cache: ResultCache (cache.py) dùng chung được giữa các pipeline: kết quả theo bài (text đã clean),
+        NER theo đoạn và RE theo cửa sổ -> bài lặp lại gần như không tốn gì, bài sửa nhẹ chỉ chạy lại cửa sổ bị đổi.
+        """
         self.ner_predictor = ner_model
         self.re_predictor = re_model
         self.valid_pairs = VALID_RE_PAIRS
+        self.window_size = window_size
+        self.step_size = step_size
+        self.reuse_overlap = reuse_overlap
+        self.ner_batch_size = ner_batch_size
+        self.re_batch_size = re_batch_size
+        self.dedup_pairs = dedup_pairs
+        self.max_pair_sentence_distance = max_pair_sentence_distance
+        self.max_pair_token_distance = max_pair_token_distance
+        # Thống kê cặp ứng viên của lần chạy gần nhất (xem _filter_pairs)
+        self.last_pair_stats = {}
+        self.hooks = list(hooks or [])
+        self.last_metrics = None
 
-    def _prepare_input_typed(self, text, source_entity, target_entity):
-        """Chèn thẻ <S:TYPE>... vào văn bản"""
+        self.cache = cache
+        ner_id, re_id = predictor_identity(ner_model), predictor_identity(re_model)
+        self._cache_scopes = {
+            "ner": ner_id,
+            "re": re_id,
+            "article": json.dumps([ner_id, re_id, window_size, step_size, reuse_overlap, dedup_pairs,
+                                   max_pair_sentence_distance, max_pair_token_distance]),
+        }
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def new_metrics(self):
+        """RunMetrics cho một lượt chạy, gắn sẵn các hook của pipeline"""
+        return RunMetrics(self.hooks)
+
+    @staticmethod
+    def _pair_offsets(text, source_entity, target_entity):
+        """Vị trí ký tự (s_start, s_end, o_start, o_end) của cặp trong text, None nếu không định vị được"""
         s_text = source_entity['word']
-        s_label = source_entity['entity_group']
         s_start = source_entity.get('start')
         s_end = source_entity.get('end')
 
         o_text = target_entity['word']
-        o_label = target_entity['entity_group']
         o_start = target_entity.get('start')
         o_end = target_entity.get('end')
 
@@ -28,68 +76,454 @@ class TNGTPipeline:
         if o_end is None: o_end = o_start + len(o_text)
 
         if s_start == -1 or o_start == -1: return None
+        return s_start, s_end, o_start, o_end
+
+    @staticmethod
+    def _marker_tags(source_entity, target_entity):
+        s_label = source_entity['entity_group']
+        o_label = target_entity['entity_group']
+        return f"<S:{s_label}>", f"</S:{s_label}>", f"<O:{o_label}>", f"</O:{o_label}>"
+
+    @classmethod
+    def _prepare_input_typed(cls, text, source_entity, target_entity, segmented=None):
+        """
+        Chèn thẻ <S:TYPE>... vào văn bản (dùng chung với dataset_builder khi dựng input RE cho train).
+        segmented: SegmentedWindow của text (nếu có) -> chèn thẻ ở ranh giới âm tiết, không tách từ lại.
+        """
+        offsets = cls._pair_offsets(text, source_entity, target_entity)
+        if offsets is None: return None
 
-        tag_s_open, tag_s_close = f" <S:{s_label}> ", f" </S:{s_label}> "
-        tag_o_open, tag_o_close = f" <O:{o_label}> ", f" </O:{o_label}> "
+        tags = cls._marker_tags(source_entity, target_entity)
+        if segmented is not None:
+            marked = segmented.insert_markers(list(zip(offsets, tags)))
+            if marked is not None:
+                return marked
 
-        spans = [(s_start, tag_s_open), (s_end, tag_s_close),
-                 (o_start, tag_o_open), (o_end, tag_o_close)]
+        spans = [(idx, f" {tag} ") for idx, tag in zip(offsets, tags)]
         spans.sort(key=lambda x: x[0], reverse=True)
 
         processed_text = text
         for idx, tag_str in spans:
             processed_text = processed_text[:idx] + tag_str + processed_text[idx:]
             
-        return ViTokenizer.tokenize(processed_text)
+        return word_segment(processed_text)
 
     def _generate_pairs(self, entities):
-        candidates = []
-        for i, e1 in enumerate(entities):
-            for j, e2 in enumerate(entities):
-                if i == j: continue
-                l1 = e1.get('entity_group', '').replace("B-", "").replace("I-", "")
-                l2 = e2.get('entity_group', '').replace("B-", "").replace("I-", "")
-                
-                if (l1, l2) in self.valid_pairs:
-                    candidates.append({"source": e1, "target": e2})
-        return candidates
+        """Cặp ứng viên theo VALID_RE_PAIRS, chỉ duyệt các thực thể có loại phù hợp (index theo loại)"""
+        labels = [e.get('entity_group', '').replace("B-", "").replace("I-", "") for e in entities]
+        by_type = {}
+        for j, label in enumerate(labels):
+            by_type.setdefault(label, []).append(j)
+
+        index_pairs = []
+        for l1, l2 in self.valid_pairs:
+            for i in by_type.get(l1, []):
+                index_pairs.extend((i, j) for j in by_type.get(l2, []) if j != i)
+        # Giữ đúng thứ tự của vòng lặp đôi (i, j) cũ
+        index_pairs.sort()
+        return [{"source": entities[i], "target": entities[j]} for i, j in index_pairs]
+
+    def _filter_pairs(self, chunk, layout, pairs, seen, stats):
+        """
+        Cắt tỉa cặp theo khoảng cách câu/từ và bỏ cặp trùng với cửa sổ trước của cùng bài.
+        layout: [(sentence_id, char_start trong chunk)] của các câu trong cửa sổ.
+        seen: key các cặp đã giữ của bài, key = (chữ, loại, câu) của chủ thể và đối tượng.
+        """
+        stats["candidates"] += len(pairs)
+        if not pairs:
+            return pairs
+
+        sentence_starts = [start for _, start in layout]
+        token_starts = [m.start() for m in re.finditer(r'\S+', chunk)]
+        positions = {}
+
+        def position(e):
+            """(câu, từ đầu, từ cuối) của thực thể, None nếu không có vị trí"""
+            if id(e) not in positions:
+                start, end = e.get('start'), e.get('end')
+                if start is None:
+                    positions[id(e)] = None
+                else:
+                    end = max(end if end is not None else start, start + 1)
+                    positions[id(e)] = (
+                        layout[max(bisect_right(sentence_starts, start) - 1, 0)][0],
+                        max(bisect_right(token_starts, start) - 1, 0),
+                        max(bisect_right(token_starts, end - 1) - 1, 0),
+                    )
+            return positions[id(e)]
+
+        kept = []
+        for p in pairs:
+            s_pos, t_pos = position(p['source']), position(p['target'])
+            if s_pos is not None and t_pos is not None:
+                if (self.max_pair_sentence_distance is not None
+                        and abs(s_pos[0] - t_pos[0]) > self.max_pair_sentence_distance):
+                    stats["pruned"] += 1
+                    continue
+                token_gap = max(t_pos[1] - s_pos[2] - 1, s_pos[1] - t_pos[2] - 1, 0)
+                if self.max_pair_token_distance is not None and token_gap > self.max_pair_token_distance:
+                    stats["pruned"] += 1
+                    continue
+                if self.dedup_pairs:
+                    key = (p['source'].get('word'), p['source']['entity_group'], s_pos[0],
+                           p['target'].get('word'), p['target']['entity_group'], t_pos[0])
+                    if key in seen:
+                        stats["duplicates"] += 1
+                        continue
+                    seen.add(key)
+            kept.append(p)
+        return kept
+
+    def _segment_article(self, raw_text, metrics=None, cleaned=False):
+        """
+        Output: (segments, windows)
+          segments: các đoạn cần chạy NER.
+          windows: list (chunk, members, layout)
+            members = [(segment_id, char_offset trong chunk), ...]
+            layout  = [(sentence_id, char_offset trong chunk), ...] các câu của bài nằm trong chunk
+        Chế độ thường: mỗi cửa sổ là một segment.
+        Chế độ reuse_overlap: mỗi câu là một segment, câu nằm trong vùng chồng lấp chỉ chạy NER một lần.
+        """
+        metrics = metrics or RunMetrics()
+        if cleaned:
+            cleaned_text = raw_text
+        else:
+            with metrics.stage("cleaning"):
+                cleaned_text = clean_text_basic(raw_text)
+        with metrics.stage("windowing"):
+            return self._split_windows(cleaned_text)
+
+    def _split_windows(self, cleaned_text):
+        sentences = split_sentences(cleaned_text)
+
+        if not self.reuse_overlap:
+            chunks = sliding_window_extract(cleaned_text, window_size=self.window_size, step_size=self.step_size)
+            if len(sentences) <= self.window_size:
+                spans = [(0, len(sentences))]
+            else:
+                spans = sliding_window_spans(len(sentences), self.window_size, self.step_size)
+            return chunks, [(chunk, [(i, 0)], self._sentence_layout(chunk, sentences, range(start, end)))
+                            for i, (chunk, (start, end)) in enumerate(zip(chunks, spans))]
+
+        if len(sentences) <= self.window_size:
+            chunk = restore_abbreviations(cleaned_text)
+            return [chunk], [(chunk, [(0, 0)], self._sentence_layout(chunk, sentences, range(len(sentences))))]
+
+        segments = [restore_abbreviations(sent) for sent in sentences]
+        windows = []
+        for start, end in sliding_window_spans(len(segments), self.window_size, self.step_size):
+            members = []
+            char_offset = 0
+            for sid in range(start, end):
+                members.append((sid, char_offset))
+                char_offset += len(segments[sid]) + 1 # +1 cho dấu cách khi ghép câu
+            # Mỗi segment là một câu nên layout trùng với members
+            windows.append((" ".join(segments[start:end]), members, members))
+        return segments, windows
+
+    @staticmethod
+    def _sentence_layout(chunk, sentences, sentence_ids):
+        """Vị trí bắt đầu (trong chunk) của từng câu, dò tuần tự"""
+        layout = []
+        cursor = 0
+        for sid in sentence_ids:
+            sentence = restore_abbreviations(sentences[sid])
+            pos = chunk.find(sentence, cursor)
+            if pos == -1:
+                pos = cursor
+            layout.append((sid, pos))
+            cursor = pos + len(sentence)
+        return layout or [(0, 0)]
+
+    @staticmethod
+    def _normalize_entity(e):
+        """Chuẩn hóa output NER (bỏ @@, bỏ tiền tố B-/I-)"""
+        if 'word' in e:
+            e['word'] = e['word'].replace("@@", "")
+
+        lbl = (e.get('entity_group') or e.get('labels') or e.get('entity', '')).replace("B-", "").replace("I-", "")
+        e['entity_group'] = lbl # Cập nhật lại để dùng cho RE
+        return e
+
+    @staticmethod
+    def _locate_entities(text, entities):
+        """
+        Gán 'start'/'end' cho thực thể thiếu vị trí (VD: pipeline HF với slow tokenizer).
+        Thực thể trả về theo thứ tự xuất hiện nên dò tuần tự từ sau thực thể trước,
+        tránh việc text.find luôn trả về lần xuất hiện đầu tiên của thực thể lặp lại.
+        """
+        cursor = 0
+        for e in entities:
+            if e.get('start') is not None:
+                cursor = e.get('end') or e['start']
+                continue
+            word = e.get('word')
+            if not word:
+                continue
+            start = text.find(word, cursor)
+            if start == -1:
+                start = text.find(word)
+            if start == -1:
+                continue
+            e['start'], e['end'] = start, start + len(word)
+            cursor = e['end']
+        return entities
+
+    @staticmethod
+    def _shift_entity(e, char_offset):
+        """Dời vị trí thực thể của một câu sang tọa độ của cửa sổ chứa nó"""
+        if char_offset == 0:
+            return e
+        shifted = dict(e)
+        for key in ('start', 'end'):
+            if shifted.get(key) is not None:
+                shifted[key] += char_offset
+        return shifted
 
     def run(self, raw_text):
-        cleaned_text = clean_text_basic(raw_text)
-        windows = sliding_window_extract(cleaned_text, window_size=3, step_size=2)
-        print(f"-> Đã chia văn bản thành {len(windows)} cửa sổ xử lý.")
+        """Kết quả kèm "metrics": thời gian từng bước (ms) và các bộ đếm của lượt chạy"""
+        result = self.run_many([raw_text])[0]
+        result["metrics"] = self.last_metrics.as_dict()
+        return result
 
-        all_entities = []
-        all_relations = []
+    def run_many(self, raw_texts):
+        """
+        Xử lý nhiều bài báo một lượt: NER cho mọi segment của mọi bài được gom
+        vào predict_many, RE cho mọi cặp được gom vào predict_batch.
+        Số liệu của cả lượt nằm ở self.last_metrics.
+        """
+        metrics = self.new_metrics()
+        if self.cache is None:
+            results = self._run_articles(raw_texts, metrics)
+        else:
+            # Cache theo bài: khóa là text đã clean, chỉ chạy các bài chưa có
+            with metrics.stage("cleaning"):
+                cleaned_texts = [clean_text_basic(text) for text in raw_texts]
+            keys = [make_key(self._cache_scopes["article"], text) for text in cleaned_texts]
+            results = [self._cache_get("article", key, metrics) for key in keys]
+            todo = [i for i, result in enumerate(results) if result is None]
+            if todo:
+                computed = self._run_articles([cleaned_texts[i] for i in todo], metrics, cleaned=True)
+                for i, result in zip(todo, computed):
+                    self.cache.put("article", keys[i], result)
+                    results[i] = result
 
-        for idx, chunk in enumerate(windows):
-            # NER
-            entities = self.ner_predictor.predict(chunk)
-            
-            # Chuẩn hóa output NER và thêm vào list tổng
-            for e in entities:
-                if 'word' in e:
-                    e['word'] = e['word'].replace("@@", "")
-
-                lbl = (e.get('entity_group') or e.get('labels') or e.get('entity', '')).replace("B-", "").replace("I-", "")
-                e['entity_group'] = lbl # Cập nhật lại để dùng cho RE
-                all_entities.append({"text": e.get('word'), "label": lbl, "window_id": idx})
-
-            # RE (Typed Markers)
-            pairs = self._generate_pairs(entities)
-            for p in pairs:
-                re_input = self._prepare_input_typed(chunk, p['source'], p['target'])
-                if re_input:
-                    label = self.re_predictor.predict(re_input)
-                    if label != 'NO_RELATION':
-                        all_relations.append({
-                            "source": p['source'].get('word'),
-                            "target": p['target'].get('word'),
-                            "relation": label,
-                            "window_id": idx
-                        })
-
-        return self._post_processing(all_entities, all_relations)
+        self.last_metrics = metrics.finish()
+        return results
+
+    def _run_articles(self, texts, metrics, cleaned=False):
+        articles = self._segment_articles(texts, metrics, cleaned=cleaned)
+
+        # NER theo batch trên toàn bộ segment
+        flat_segments = [seg for segments, _ in articles for seg in segments]
+        with metrics.stage("ner"):
+            flat_entities = self._predict_ner(flat_segments, metrics)
+        all_entities, window_jobs = self._collect_windows(articles, flat_entities, metrics)
+
+        # Phân loại toàn bộ cặp theo batch
+        classified = self._classify_windows(window_jobs, metrics)
+        return self._assemble(all_entities, classified, metrics)
+
+    def _cache_get(self, namespace, key, metrics):
+        value = self.cache.get(namespace, key)
+        metrics.count(f"cache_{namespace}_{'misses' if value is None else 'hits'}")
+        return value
+
+    def _predict_ner(self, segments, metrics):
+        """NER cho các segment, có cache thì chỉ chạy các segment chưa có (segment trùng chỉ chạy một lần)"""
+        if self.cache is None:
+            return self.ner_predictor.predict_many(segments, batch_size=self.ner_batch_size)
+
+        keys = [make_key(self._cache_scopes["ner"], segment) for segment in segments]
+        results = [self._cache_get("ner", key, metrics) for key in keys]
+        missing = {}
+        for i, result in enumerate(results):
+            if result is None:
+                missing.setdefault(keys[i], []).append(i)
+        if missing:
+            todo = list(missing)
+            predicted = self.ner_predictor.predict_many([segments[missing[key][0]] for key in todo],
+                                                        batch_size=self.ner_batch_size)
+            for key, entities in zip(todo, predicted):
+                self.cache.put("ner", key, entities)
+                for n, i in enumerate(missing[key]):
+                    # Thực thể được sửa tại chỗ ở các bước sau -> mỗi vị trí một bản riêng
+                    results[i] = entities if n == 0 else copy.deepcopy(entities)
+        return results
+
+    @staticmethod
+    def _window_content(chunk, pairs):
+        """Nội dung quyết định nhãn RE của một cửa sổ: text + vị trí/loại các cặp"""
+        def entity(e):
+            return [e.get('word'), e.get('start'), e.get('end'), e['entity_group']]
+        return json.dumps([chunk, [[entity(p['source']), entity(p['target'])] for p in pairs]], ensure_ascii=False)
+
+    def _classify_windows(self, window_jobs, metrics):
+        """
+        RE cho mọi cặp của mọi cửa sổ. Output: list (article_id, window_id, pair, label) như _match_labels.
+        Có cache: cửa sổ đã gặp (cùng text, cùng các cặp) lấy nhãn từ cache, không tách từ/chèn thẻ/chạy model lại.
+        """
+        if self.cache is None:
+            re_jobs = self._build_re_jobs(window_jobs, metrics)
+            with metrics.stage("re"):
+                labels = self._predict_re([job[3] for job in re_jobs])
+            return self._match_labels(re_jobs, labels)
+
+        keys, cached, todo = [], {}, []
+        for job in window_jobs:
+            art_idx, idx, chunk, pairs = job
+            key = make_key(self._cache_scopes["re"], self._window_content(chunk, pairs)) if pairs else None
+            keys.append(key)
+            if key is None:
+                continue
+            labels = self._cache_get("re", key, metrics)
+            if labels is None:
+                todo.append(job)
+            else:
+                cached[(art_idx, idx)] = labels
+
+        re_jobs = self._build_re_jobs(todo, metrics)
+        with metrics.stage("re"):
+            labels = self._predict_re([job[3] for job in re_jobs])
+        found = {(art_idx, idx, id(p)): label for art_idx, idx, p, label in self._match_labels(re_jobs, labels)}
+
+        classified = []
+        for (art_idx, idx, _, pairs), key in zip(window_jobs, keys):
+            if key is None:
+                continue
+            window_labels = cached.get((art_idx, idx))
+            if window_labels is None:
+                window_labels = [found.get((art_idx, idx, id(p))) for p in pairs]
+                self.cache.put("re", key, window_labels)
+            classified.extend((art_idx, idx, p, label) for p, label in zip(pairs, window_labels) if label is not None)
+        return classified
+
+    # Các bước của run_many được tách riêng để service (service.py) gom batch NER/RE
+    # từ nhiều request đồng thời.
+
+    def _segment_articles(self, raw_texts, metrics=None, cleaned=False):
+        """Output: list (segments, windows) cho từng bài, xem _segment_article"""
+        metrics = metrics or RunMetrics()
+        articles = []
+        for raw_text in raw_texts:
+            segments, windows = self._segment_article(raw_text, metrics, cleaned=cleaned)
+            articles.append((segments, windows))
+            metrics.count("articles")
+            metrics.count("windows", len(windows))
+            metrics.count("segments", len(segments))
+        return articles
+
+    def _collect_windows(self, articles, flat_entities, metrics=None):
+        """
+        Ghép kết quả NER (theo thứ tự segment của mọi bài) về từng cửa sổ.
+        Output: (all_entities theo bài, window_jobs = list (article_id, window_id, chunk, pairs))
+        """
+        metrics = metrics or RunMetrics()
+        with metrics.stage("pairs"):
+            all_entities, window_jobs, stats = self._pair_windows(articles, flat_entities)
+
+        self.last_pair_stats = stats
+        metrics.count("entities", sum(len(entities) for entities in all_entities))
+        metrics.count("candidate_pairs", stats["candidates"])
+        metrics.count("pairs_pruned", stats["pruned"])
+        metrics.count("pairs_duplicate", stats["duplicates"])
+        metrics.count("pairs_kept", stats["kept"])
+        return all_entities, window_jobs
+
+    def _pair_windows(self, articles, flat_entities):
+        all_entities = [[] for _ in articles]
+        window_jobs = []
+        stats = {"candidates": 0, "pruned": 0, "duplicates": 0}
+
+        offset = 0
+        for art_idx, (segments, windows) in enumerate(articles):
+            seg_entities = flat_entities[offset:offset + len(segments)]
+            offset += len(segments)
+            for segment, entities in zip(segments, seg_entities):
+                for e in entities:
+                    self._normalize_entity(e)
+                self._locate_entities(segment, entities)
+
+            recorded = set()
+            seen_pairs = set()
+            for idx, (chunk, members, layout) in enumerate(windows):
+                entities = []
+                for sid, char_offset in members:
+                    # Thực thể của vùng chồng lấp chỉ được ghi nhận một lần (ở cửa sổ đầu tiên chứa nó)
+                    if sid not in recorded:
+                        recorded.add(sid)
+                        for e in seg_entities[sid]:
+                            all_entities[art_idx].append({"text": e.get('word'), "label": e['entity_group'], "window_id": idx})
+                    entities.extend(self._shift_entity(e, char_offset) for e in seg_entities[sid])
+
+                # RE: gom cặp ứng viên, chưa phân loại ngay
+                pairs = self._filter_pairs(chunk, layout, self._generate_pairs(entities), seen_pairs, stats)
+                window_jobs.append((art_idx, idx, chunk, pairs))
+
+        stats["kept"] = sum(len(job[3]) for job in window_jobs)
+        return all_entities, window_jobs, stats
+
+    def _build_re_jobs(self, window_jobs, metrics=None):
+        """
+        Input: list (article_id, window_id, chunk, pairs).
+        Output: list (article_id, window_id, pairs, re_input), re_input là một đơn vị đưa vào model RE:
+          - SPAN: (chunk, [(source, target), ...]) cho cả cửa sổ
+          - Typed Markers: text đã chèn thẻ cho một cặp (pairs chỉ có cặp đó)
+        """
+        metrics = metrics or RunMetrics()
+        if self.re_predictor.model_type == 'SPAN':
+            # Span-pooling: mỗi cửa sổ encode một lần cho mọi cặp của nó
+            re_jobs = [(art_idx, idx, pairs, (chunk, [(p['source'], p['target']) for p in pairs]))
+                       for art_idx, idx, chunk, pairs in window_jobs]
+            metrics.count("re_inputs", sum(1 for job in re_jobs if job[2]))
+            return re_jobs
+
+        # Typed Markers: mỗi cặp một bản sao cửa sổ đã chèn thẻ.
+        # Cửa sổ chỉ tách từ (pyvi) một lần, thẻ được chèn theo map ký tự -> âm tiết.
+        re_jobs = []
+        for art_idx, idx, chunk, pairs in window_jobs:
+            with metrics.stage("segmentation"):
+                segmented = SegmentedWindow(chunk) if pairs else None
+            with metrics.stage("markers"):
+                for p in pairs:
+                    re_input = self._prepare_input_typed(chunk, p['source'], p['target'], segmented=segmented)
+                    if re_input:
+                        re_jobs.append((art_idx, idx, [p], re_input))
+        metrics.count("re_inputs", len(re_jobs))
+        return re_jobs
+
+    def _predict_re(self, re_inputs):
+        """Output: list nhãn của từng cặp cho mỗi re_input (None nếu cặp không phân loại được)"""
+        if self.re_predictor.model_type == 'SPAN':
+            return self.re_predictor.predict_pairs(re_inputs, batch_size=self.re_batch_size)
+        return [[label] for label in self.re_predictor.predict_batch(re_inputs, batch_size=self.re_batch_size)]
+
+    @staticmethod
+    def _match_labels(re_jobs, labels):
+        """Output: list (article_id, window_id, pair, label) cho các cặp được phân loại"""
+        return [(art_idx, idx, p, label)
+                for (art_idx, idx, pairs, _), job_labels in zip(re_jobs, labels)
+                for p, label in zip(pairs, job_labels) if label is not None]
+
+    def _assemble(self, all_entities, classified, metrics=None):
+        """Gom quan hệ đã phân loại về từng bài rồi thống kê (_post_processing)"""
+        metrics = metrics or RunMetrics()
+        with metrics.stage("post_processing"):
+            results = self._group_relations(all_entities, classified)
+        metrics.count("relations", sum(len(result['relations']) for result in results))
+        return results
+
+    def _group_relations(self, all_entities, classified):
+        all_relations = [[] for _ in all_entities]
+        for art_idx, idx, p, label in classified:
+            if label != 'NO_RELATION':
+                all_relations[art_idx].append({
+                    "source": p['source'].get('word'),
+                    "target": p['target'].get('word'),
+                    "relation": label,
+                    "window_id": idx
+                })
+        return [self._post_processing(ents, rels) for ents, rels in zip(all_entities, all_relations)]
 
     def _post_processing(self, entities, relations):
         # Logic thống kê đơn giản
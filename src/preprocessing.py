@@ -3,6 +3,9 @@ import re
 import json
 import os
 import unicodedata
+import itertools
+import multiprocessing as mp
+from collections import deque
 
 # Danh sách từ viết tắt cần bảo vệ dấu chấm
 ABBREVIATIONS = {
@@ -16,29 +19,36 @@ ABBREVIATIONS = {
     "Q.": "Q<PRD>" # Quận
 }
 
+# Regex biên dịch sẵn cho clean_text_basic
+_ABBREVIATION_RE = re.compile('|'.join(re.escape(abbr) for abbr in ABBREVIATIONS))
+# Ký tự dấu câu NẾU theo sau là khoảng trắng (\s) hoặc kết thúc dòng ($)
+_PUNCT_RE = re.compile(r'([.,!?;:])(?=\s|$)')
+_BRACKET_RE = re.compile(r'\[.*?\]')
+
+def _replace_abbreviation(m):
+    return ABBREVIATIONS[m.group()]
+
 def clean_text_basic(text):
     """
     Làm sạch văn bản cơ bản & xử lý từ viết tắt.
     Bổ sung: Chuẩn hóa Unicode NFC để tránh lỗi tách từ của PhoBERT.
     """
-    if pd.isna(text) or text == "":
+    if not isinstance(text, str):
+        if pd.isna(text):
+            return ""
+        text = str(text)
+    if text == "":
         return ""
     
-    text = str(text).strip()
-    
     # Chuyển về dạng dựng sẵn (NFC) để đồng bộ với từ điển của PhoBERT
-    text = unicodedata.normalize('NFC', text) 
+    text = unicodedata.normalize('NFC', text.strip()) 
 
-    # Thay thế từ viết tắt (đã định nghĩa trong ABBREVIATIONS)
-    for abbr, replacement in ABBREVIATIONS.items():
-        text = text.replace(abbr, replacement)
-    
-    # Regex tìm các ký tự này NẾU theo sau là khoảng trắng (\s) hoặc kết thúc dòng ($).
-    text = re.sub(r'([.,!?;:])(?=\s|$)', r' \1', text)
-    # --------------------
-        
-    text = re.sub(r'\s+', ' ', text) # Gộp khoảng trắng thừa
-    text = re.sub(r'\[.*?\]', '', text) # Xóa text trong ngoặc vuông
+    # Thay thế từ viết tắt (đã định nghĩa trong ABBREVIATIONS) trong một lượt
+    text = _ABBREVIATION_RE.sub(_replace_abbreviation, text)
+    text = _PUNCT_RE.sub(r' \1', text)
+    text = " ".join(text.split()) # Gộp khoảng trắng thừa (str.split dùng cùng định nghĩa khoảng trắng với \s)
+    if "[" in text:
+        text = _BRACKET_RE.sub('', text) # Xóa text trong ngoặc vuông
     
     return text.strip()
 
@@ -49,20 +59,58 @@ def restore_abbreviations(text):
     if not text: return ""
     return text.replace("<PRD>", ".")
 
-def split_sentences(text):
+def _uppercase_class():
+    """Mọi chữ in hoa Unicode (BMP) dạng các khoảng cho character class của regex: A-Z, À-Þ, Đ, Ô, Ư..."""
+    ranges, start = [], None
+    for cp in range(0x10001):
+        if cp < 0x10000 and chr(cp).isupper():
+            if start is None:
+                start = cp
+        elif start is not None:
+            ranges.append(re.escape(chr(start)) if start == cp - 1
+                          else f"{re.escape(chr(start))}-{re.escape(chr(cp - 1))}")
+            start = None
+    return "".join(ranges)
+
+# Ranh giới câu: Dấu kết thúc câu (.?!) + Khoảng trắng + Chữ in hoa; xuống dòng luôn là ranh giới
+_SENTENCE_BREAK = r'(?<=[.?!])\s+(?=[' + _uppercase_class() + r'])'
+_SENTENCE_BREAK_RE = re.compile(_SENTENCE_BREAK)
+_SENTENCE_BREAK_NL_RE = re.compile(_SENTENCE_BREAK + r'|\s*\n\s*')
+
+def split_sentence_spans(text):
     """
-    Tách câu dựa trên regex.
-    Logic: Dấu kết thúc câu (.?!) + Khoảng trắng + Chữ in hoa
+    Tách câu, trả về vị trí ký tự [(start, end), ...] của từng câu (đã bỏ khoảng trắng hai đầu)
+    thay vì copy từng câu.
     """
     if not text:
         return []
-    
-    # Regex lookbehind: Tìm dấu chấm/hỏi/than, theo sau là khoảng trắng và chữ hoa
-    # Thay thế bằng xuống dòng để split
-    text = re.sub(r'(?<=[.?!])\s+(?=[A-Z])', '\n', text)
-    
-    sentences = [s.strip() for s in text.split('\n') if s.strip()]
-    return sentences
+
+    # Văn bản đã clean không còn xuống dòng -> regex không phải thử nhánh \n ở mọi vị trí
+    pattern = _SENTENCE_BREAK_NL_RE if "\n" in text else _SENTENCE_BREAK_RE
+    bounds = [len(text) - len(text.lstrip())]
+    for m in pattern.finditer(text):
+        bounds.extend(m.span())
+    bounds.append(len(text.rstrip()))
+    return [(start, end) for start, end in zip(bounds[::2], bounds[1::2]) if start < end]
+
+def split_sentences(text):
+    """
+    Tách câu dựa trên regex (xem split_sentence_spans).
+    Output: List các câu
+    """
+    return [text[start:end] for start, end in split_sentence_spans(text)]
+
+def sliding_window_spans(num_sentences, window_size=3, step_size=2):
+    """
+    Tính các cửa sổ trượt dưới dạng khoảng chỉ số câu [start, end).
+    Dùng chung cho sliding_window_extract và chế độ tái sử dụng câu chồng lấp của pipeline.
+    """
+    spans = []
+    for i in range(0, num_sentences, step_size):
+        spans.append((i, min(i + window_size, num_sentences)))
+        if i + window_size >= num_sentences:
+            break
+    return spans
 
 def sliding_window_extract(text, window_size=3, step_size=2):
     """
@@ -76,10 +124,9 @@ def sliding_window_extract(text, window_size=3, step_size=2):
         return [restore_abbreviations(text)]
 
     windows = []
-    num_sentences = len(sentences)
     
-    for i in range(0, num_sentences, step_size):
-        window_sents = sentences[i : i + window_size]
+    for start, end in sliding_window_spans(len(sentences), window_size, step_size):
+        window_sents = sentences[start:end]
         
         # Ghép lại thành đoạn văn
         chunk = " ".join(window_sents)
@@ -88,45 +135,94 @@ def sliding_window_extract(text, window_size=3, step_size=2):
         chunk = restore_abbreviations(chunk)
         
         windows.append(chunk)
-        
-        if i + window_size >= num_sentences:
-            break
             
     return windows
 
 
+def _content_column(columns):
+    """Tên cột nội dung: 'content', nếu không có thì cột chứa 'content'/'noidung' (VD: CONTENT, NoiDung)"""
+    if 'content' in columns:
+        return 'content'
+    possible_cols = [c for c in columns if 'content' in c.lower() or 'noidung' in c.lower()]
+    if possible_cols:
+        return possible_cols[0]
+    raise ValueError("File CSV không có cột 'content'.")
+
+def _clean_and_window(args):
+    """Worker: làm sạch + cắt cửa sổ cho một chunk bài báo. Output: list (clean_content, chunks)"""
+    contents, window_size, step_size = args
+    results = []
+    for content in contents:
+        clean_content = clean_text_basic(content)
+        results.append((clean_content, sliding_window_extract(clean_content, window_size, step_size)))
+    return results
+
+def _ordered_map(pool, fn, jobs, max_pending):
+    """
+    jobs: iterable (context, args) -> yield (context, fn(args)) theo đúng thứ tự.
+    Như pool.imap nhưng chỉ giữ tối đa max_pending job đang chạy/chờ (pool.imap đọc hết iterator
+    đầu vào ngay, tức là nạp cả file CSV vào RAM). pool=None -> chạy tuần tự trong tiến trình hiện tại.
+    """
+    if pool is None:
+        for context, args in jobs:
+            yield context, fn(args)
+        return
+
+    pending = deque()
+    for context, args in jobs:
+        pending.append((context, pool.apply_async(fn, (args,))))
+        if len(pending) >= max_pending:
+            context, result = pending.popleft()
+            yield context, result.get()
+    while pending:
+        context, result = pending.popleft()
+        yield context, result.get()
+
 class DataPipeline:
-    def __init__(self, input_path: str, output_path: str, save_table: bool = True, window_size: int = 3, step_size: int = 2):
+    def __init__(self, input_path: str, output_path: str, save_table: bool = True, window_size: int = 3, step_size: int = 2,
+                 streaming: bool = False, chunk_size: int = 1000, workers: int = 1, output_format: str = None):
         """
         input_path: File CSV gốc (chứa cột 'content').
         output_path: File JSON đầu ra cho Label Studio.
+        streaming: đọc CSV theo chunk, làm sạch + cắt cửa sổ song song (workers tiến trình)
+                   và ghi dần các file output -> bộ nhớ không phụ thuộc kích thước corpus.
+        output_format: "json" | "jsonl" (mặc định theo đuôi của output_path)
         """
         self.input_path = input_path
         self.output_path = output_path
         self.save_table = save_table
         self.window_size = window_size
         self.step_size = step_size
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.output_format = output_format or ("jsonl" if output_path.endswith(".jsonl") else "json")
         
         # Đường dẫn lưu file trung gian
         self.prep_dir = os.path.dirname(output_path) if os.path.dirname(output_path) else "data/preprocessed"
         os.makedirs(self.prep_dir, exist_ok=True)
 
+    def _output_paths(self):
+        """Đường dẫn Cleaned CSV và Cleaned Split CSV (cùng thư mục với output)"""
+        base = os.path.basename(self.input_path)
+        return (os.path.join(self.prep_dir, base.replace(".csv", "_cleaned.csv")),
+                os.path.join(self.prep_dir, base.replace(".csv", "_cleaned_split.csv")))
+
     def create_import_label_studio(self):
         """
         Đọc CSV -> Clean -> Sliding Window -> Lưu JSON & CSV.
         """
+        if self.streaming:
+            return self._create_import_streaming()
+
         print(f"--- Bắt đầu xử lý dữ liệu từ: {self.input_path} ---")
         
         try:
             df = pd.read_csv(self.input_path)
-            # Kiểm tra xem có cột content không, nếu không thử tìm cột khác
-            if 'content' not in df.columns:
-                # Fallback nếu tên cột khác (ví dụ 'NoiDung')
-                possible_cols = [c for c in df.columns if 'content' in c.lower() or 'noidung' in c.lower()]
-                if possible_cols:
-                    df.rename(columns={possible_cols[0]: 'content'}, inplace=True)
-                else:
-                    raise ValueError("File CSV không có cột 'content'.")
+            # Kiểm tra xem có cột content không, nếu không thử tìm cột khác (ví dụ 'NoiDung')
+            content_col = _content_column(df.columns)
+            if content_col != 'content':
+                df.rename(columns={content_col: 'content'}, inplace=True)
         except Exception as e:
             print(f"Lỗi đọc file CSV: {e}")
             return
@@ -135,10 +231,7 @@ class DataPipeline:
         # Sử dụng hàm clean_text_basic 
         df['clean_content'] = df['content'].apply(clean_text_basic)
         
-        cleaned_csv_path = os.path.join(
-            self.prep_dir, 
-            os.path.basename(self.input_path).replace(".csv", "_cleaned.csv")
-        )
+        cleaned_csv_path, split_csv_path = self._output_paths()
         df.to_csv(cleaned_csv_path, index=False, encoding='utf-8')
         print(f"-> Đã lưu file Cleaned CSV: {cleaned_csv_path}")
 
@@ -177,10 +270,6 @@ class DataPipeline:
         
         
         if self.save_table:
-            split_csv_path = os.path.join(
-                self.prep_dir,
-                os.path.basename(self.input_path).replace(".csv", "_cleaned_split.csv")
-            )
             pd.DataFrame(window_rows).to_csv(split_csv_path, index=False, encoding='utf-8')
             print(f"-> Đã lưu CLEANED_SPLIT CSV tại: {split_csv_path}")
 
@@ -192,6 +281,94 @@ class DataPipeline:
         print(f"- Tổng số Windows (Tasks) tạo ra: {len(tasks)}")
         print(f"- File Output JSON: {self.output_path}")
 
+    def _read_chunks(self):
+        """
+        Đọc CSV theo chunk (chunk_size dòng). Mọi cột đọc dạng str (dtype=str) để kiểu dữ liệu không đổi
+        giữa các chunk (pandas suy kiểu riêng cho từng chunk: cùng cột có thể là int ở chunk này, float ở chunk khác).
+        """
+        content_col = None
+        for chunk in pd.read_csv(self.input_path, chunksize=self.chunk_size, dtype=str, keep_default_na=False):
+            if content_col is None:
+                content_col = _content_column(chunk.columns)
+            if content_col != 'content':
+                chunk = chunk.rename(columns={content_col: 'content'})
+            yield chunk
+
+    def _create_import_streaming(self):
+        """
+        Như create_import_label_studio nhưng chạy theo luồng: đọc CSV theo chunk -> làm sạch + cắt cửa sổ
+        song song (self.workers tiến trình) -> ghi dần Cleaned CSV, Split CSV và JSON/JSONL theo đúng thứ tự bài.
+        Bộ nhớ chỉ phụ thuộc chunk_size x số chunk đang xử lý, không phụ thuộc kích thước file.
+        """
+        print(f"--- Bắt đầu xử lý dữ liệu (streaming, {self.workers} worker, chunk {self.chunk_size} dòng) từ: {self.input_path} ---")
+        cleaned_csv_path, split_csv_path = self._output_paths()
+
+        try:
+            chunks = self._read_chunks()
+            first_chunk = next(chunks, None)
+        except Exception as e:
+            print(f"Lỗi đọc file CSV: {e}")
+            return
+
+        def jobs():
+            if first_chunk is None:
+                return
+            for chunk in itertools.chain([first_chunk], chunks):
+                yield chunk, (chunk['content'].tolist(), self.window_size, self.step_size)
+
+        pool = mp.Pool(self.workers) if self.workers > 1 else None
+        n_articles = 0
+        window_idx = 0      # ID định danh cho từng window (đánh liên tục qua các chunk)
+        try:
+            with open(self.output_path, 'w', encoding='utf-8') as out:
+                if self.output_format == "json":
+                    out.write("[")
+
+                for chunk_no, (chunk, results) in enumerate(_ordered_map(pool, _clean_and_window, jobs(), self.workers * 2)):
+                    chunk = chunk.assign(clean_content=[clean for clean, _ in results])
+                    chunk.to_csv(cleaned_csv_path, mode='w' if chunk_no == 0 else 'a', header=chunk_no == 0,
+                                 index=False, encoding='utf-8')
+
+                    # RangeIndex của read_csv(chunksize) tiếp nối giữa các chunk -> idx giống khi đọc cả file
+                    ids = chunk['id'] if 'id' in chunk.columns else chunk.index
+                    window_rows = []
+                    lines = []
+                    for article_id, (_, windows) in zip(ids, results):
+                        for chunk_text in windows:
+                            chunk_id = f"{article_id}_{window_idx}"
+                            task = {"data": {"text": chunk_text, "ref_id": chunk_id, "article_id": str(article_id)}}
+                            if self.output_format == "jsonl":
+                                lines.append(json.dumps(task, ensure_ascii=False) + "\n")
+                            else:
+                                # Cùng định dạng với json.dump(tasks, indent=2)
+                                prefix = "\n  " if window_idx == 0 else ",\n  "
+                                lines.append(prefix + json.dumps(task, ensure_ascii=False, indent=2).replace("\n", "\n  "))
+                            window_rows.append({"id": chunk_id, "text": chunk_text, "article_id": article_id})
+                            window_idx += 1
+                    out.writelines(lines)
+
+                    if self.save_table:
+                        pd.DataFrame(window_rows, columns=["id", "text", "article_id"]).to_csv(
+                            split_csv_path, mode='w' if chunk_no == 0 else 'a', header=chunk_no == 0,
+                            index=False, encoding='utf-8')
+                    n_articles += len(chunk)
+                    print(f"-> Chunk {chunk_no + 1}: {n_articles} bài, {window_idx} windows")
+
+                if self.output_format == "json":
+                    out.write("\n]" if window_idx else "]")
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        print(f"-> Đã lưu file Cleaned CSV: {cleaned_csv_path}")
+        if self.save_table:
+            print(f"-> Đã lưu CLEANED_SPLIT CSV tại: {split_csv_path}")
+        print(f"\n✅ HOÀN TẤT XỬ LÝ.")
+        print(f"- Tổng số bài báo gốc: {n_articles}")
+        print(f"- Tổng số Windows (Tasks) tạo ra: {window_idx}")
+        print(f"- File Output {self.output_format.upper()}: {self.output_path}")
+
 
 # if __name__ == "__main__":
 #     input_file = "data/raw/data_raw_400news.csv"  
@@ -0,0 +1,91 @@
+from bisect import bisect_left
+
+# Cache cách pyvi hiển thị từng thẻ Typed Marker (VD: "<S:LOC>" -> "< S : LOC >")
+_TAG_RENDER_CACHE = {}
+
+
+def word_segment(text):
+    """ViTokenizer.tokenize, import pyvi (load model CRF tách từ) khi dùng lần đầu"""
+    from pyvi import ViTokenizer
+    return ViTokenizer.tokenize(text)
+
+
+def render_tag(tag):
+    if tag not in _TAG_RENDER_CACHE:
+        _TAG_RENDER_CACHE[tag] = word_segment(tag)
+    return _TAG_RENDER_CACHE[tag]
+
+
+class SegmentedWindow:
+    """
+    Tách từ (pyvi) cho cả cửa sổ MỘT lần và giữ map âm tiết -> vị trí ký tự,
+    để chèn Typed Markers cho từng cặp mà không phải chạy lại ViTokenizer.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.syllables = [] # (start, end) ký tự của từng âm tiết trong text
+        self.joined = []    # True nếu âm tiết nối với âm tiết trước bằng '_' (cùng một từ)
+        self.aligned = self._align(word_segment(text))
+        self._starts = [start for start, _ in self.syllables]
+
+    def _align(self, segmented):
+        """Dò từng âm tiết của output pyvi trên text gốc. False nếu không khớp (VD: text chưa chuẩn NFC)."""
+        text = self.text
+        pos = 0
+        for word in segmented.split():
+            for i, piece in enumerate(word.split('_')):
+                if i > 0 and text.startswith('_' + piece, pos):
+                    # Dấu '_' có sẵn trong text (VD: PER_DRIVER), thuộc về âm tiết trước
+                    start, _ = self.syllables[-1]
+                    pos += len(piece) + 1
+                    self.syllables[-1] = (start, pos)
+                    continue
+
+                while pos < len(text) and text[pos].isspace():
+                    pos += 1
+                if not piece or not text.startswith(piece, pos):
+                    return False
+                self.syllables.append((pos, pos + len(piece)))
+                self.joined.append(i > 0)
+                pos += len(piece)
+
+        return text[pos:].strip() == ""
+
+    def _boundary(self, char_pos):
+        """Vị trí ký tự -> chỉ số âm tiết đứng ngay sau nó. None nếu vị trí rơi giữa một âm tiết."""
+        k = bisect_left(self._starts, char_pos)
+        if k > 0 and char_pos < self.syllables[k - 1][1]:
+            return None
+        return k
+
+    def insert_markers(self, inserts):
+        """
+        inserts: list (char_pos, tag) theo thứ tự [S mở, S đóng, O mở, O đóng] như _prepare_input_typed.
+        Output: chuỗi đã tách từ có chèn thẻ (tương đương ViTokenizer.tokenize trên text đã chèn thẻ),
+        None nếu không chèn được ở ranh giới âm tiết (caller tự fallback).
+        """
+        if not self.aligned:
+            return None
+
+        # Các thẻ cùng vị trí ký tự xuất hiện theo thứ tự ngược với thứ tự chèn (giống cách chèn chuỗi cũ)
+        at_boundary = {}
+        for order, (char_pos, tag) in sorted(enumerate(inserts), key=lambda x: (x[1][0], -x[0])):
+            k = self._boundary(char_pos)
+            if k is None:
+                return None
+            at_boundary.setdefault(k, []).append(render_tag(tag))
+
+        pieces = [] # (chuỗi, nối với phần trước bằng '_')
+        for k, (start, end) in enumerate(self.syllables):
+            markers = at_boundary.get(k, [])
+            pieces.extend((marker, False) for marker in markers)
+            pieces.append((self.text[start:end], self.joined[k] and not markers))
+        pieces.extend((marker, False) for marker in at_boundary.get(len(self.syllables), []))
+
+        if not pieces:
+            return ""
+        output = pieces[0][0]
+        for piece, glued in pieces[1:]:
+            output += ("_" if glued else " ") + piece
+        return output
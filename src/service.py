@@ -0,0 +1,372 @@
+"""
+HTTP service (asyncio, thư viện chuẩn) cho TNGTPipeline, có micro-batching giữa các request.
+
+    python -m src.service --port 8000
+    python -m src.service --standin          # model ngẫu nhiên nhỏ, chạy thử không cần model thật
+    python -m src.service --cache-dir outputs/result_cache   # bài đã trích xuất trả về từ cache
+
+    POST /extract  {"text": "...", "ner_model": "PHOBERT", "re_model": "PHOBERT"}
+                   (hoặc "texts": [...] để gửi nhiều bài) -> kết quả giống TNGTPipeline.run
+    GET  /health
+    GET  /metrics  số liệu dạng Prometheus (thời gian từng bước, số cửa sổ/thực thể/cặp...)
+
+Segment NER và input RE của các request đồng thời được gom vào chung một batch
+(MicroBatcher theo từng model). Batch được chạy khi đủ max_batch hoặc sau max_wait_ms.
+Hàng đợi đầy -> 503 để client lùi lại; request có nhiều item hơn max_queue được đưa vào hàng đợi từng phần.
+"""
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .config import MODEL_PATHS
+from .pipeline import TNGTPipeline
+from .metrics import PrometheusExporter
+from .cache import ResultCache, make_key
+from .preprocessing import clean_text_basic
+
+NER_MODELS = [name for name in MODEL_PATHS["NER"] if name != "LABEL_MAP"]
+RE_MODELS = [name for name in MODEL_PATHS["RE"] if name != "METADATA"]
+
+HTTP_STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class MicroBatcher:
+    """
+    Gom các item lẻ từ nhiều request thành batch cho một hàm xử lý theo list (VD: predict_many).
+    Hàm xử lý chạy trên một thread riêng của batcher -> mỗi model chỉ chạy một batch tại một thời điểm.
+    """
+
+    def __init__(self, name, fn, max_batch=32, max_wait_ms=10, max_queue=1024):
+        self.name = name
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue = max_queue
+        self.queue = deque() # (item, future)
+        self.pending = 0     # item trong hàng đợi + đang chạy
+        self.stats = {"batches": 0, "items": 0, "rejected": 0}
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event() # set khi hàng đợi có thêm chỗ
+        self._waiting = False        # đang có request chờ chỗ trong hàng đợi
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._task = None
+
+    async def submit(self, items):
+        """
+        Đưa cả list item vào hàng đợi. Output: kết quả theo đúng thứ tự.
+        List dài hơn chỗ trống (kể cả dài hơn max_queue, VD: các cặp RE của một bài dài) được chia thành
+        các phần tối đa max_queue item, mỗi phần vào hàng đợi khi đủ chỗ. Chỉ một request được chờ chỗ
+        tại một thời điểm; hàng đợi đầy hoặc đang có request chờ -> QueueFullError (503).
+        """
+        if not items:
+            return []
+        if self.pending >= self.max_queue or self._waiting:
+            self.stats["rejected"] += 1
+            raise QueueFullError(f"Hàng đợi {self.name} đã đầy ({self.pending}/{self.max_queue})")
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for start in range(0, len(items), self.max_queue):
+            part = items[start:start + self.max_queue]
+            if self.pending + len(part) > self.max_queue:
+                self._waiting = True
+                try:
+                    while self.pending + len(part) > self.max_queue:
+                        self._room.clear()
+                        await self._room.wait()
+                finally:
+                    self._waiting = False
+
+            part_futures = [loop.create_future() for _ in part]
+            self.queue.extend(zip(part, part_futures))
+            self.pending += len(part)
+            futures.extend(part_futures)
+            if self._task is None:
+                self._task = loop.create_task(self._run())
+            self._wakeup.set()
+        return await asyncio.gather(*futures)
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        while not self.queue:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+        # Chờ thêm item cho tới khi đủ batch hoặc hết max_wait kể từ item đầu tiên
+        deadline = loop.time() + self.max_wait
+        while len(self.queue) < self.max_batch:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+        return [self.queue.popleft() for _ in range(min(self.max_batch, len(self.queue)))]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            try:
+                results = await loop.run_in_executor(self._executor, self.fn, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    # Request có thể đã bị hủy (client ngắt kết nối)
+                    if not future.done():
+                        future.set_result(result)
+            finally:
+                self.pending -= len(batch)
+                self._room.set()
+                self.stats["batches"] += 1
+                self.stats["items"] += len(batch)
+
+    def info(self):
+        avg = self.stats["items"] / self.stats["batches"] if self.stats["batches"] else 0.0
+        return {"pending": self.pending, "max_queue": self.max_queue, "waiting": self._waiting, "avg_batch": round(avg, 2), **self.stats}
+
+
+class ExtractionService:
+    def __init__(self, loader, max_batch=32, max_wait_ms=10, max_queue=1024, window_size=3, step_size=2,
+                 cache=None):
+        """cache: ResultCache (cache.py) theo bài, dùng chung cho mọi tổ hợp model (khóa gồm định danh model)"""
+        self.loader = loader
+        self.cache = cache
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.max_queue = max_queue
+        self.window_size = window_size
+        self.step_size = step_size
+        self.started = time.time()
+        self.ner_batchers = {}
+        self.re_batchers = {}
+        self.pipelines = {}
+        self.exporter = PrometheusExporter()
+        self._load_lock = asyncio.Lock()
+        # Load model và tiền xử lý (tách câu, pyvi) chạy ngoài event loop
+        self._cpu_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prep")
+
+    async def _get_pipeline(self, ner_name, re_name):
+        if ner_name not in NER_MODELS:
+            raise RequestError(400, f"ner_model không hợp lệ: {ner_name} (hỗ trợ: {', '.join(NER_MODELS)})")
+        if re_name not in RE_MODELS:
+            raise RequestError(400, f"re_model không hợp lệ: {re_name} (hỗ trợ: {', '.join(RE_MODELS)})")
+
+        key = (ner_name, re_name)
+        if key in self.pipelines:
+            return self.pipelines[key]
+
+        loop = asyncio.get_running_loop()
+        async with self._load_lock:
+            if key not in self.pipelines:
+                ner_model = await loop.run_in_executor(self._cpu_executor, self.loader.load_ner_model, ner_name)
+                re_model = await loop.run_in_executor(self._cpu_executor, self.loader.load_re_model, re_name)
+                pipeline = TNGTPipeline(ner_model, re_model, ner_batch_size=self.max_batch,
+                                        re_batch_size=self.max_batch,
+                                        window_size=self.window_size, step_size=self.step_size,
+                                        hooks=[self.exporter], cache=self.cache)
+
+                # Mỗi model một batcher, dùng chung cho mọi tổ hợp NER/RE có model đó
+                if ner_name not in self.ner_batchers:
+                    self.ner_batchers[ner_name] = self._batcher(
+                        f"NER_{ner_name}", lambda texts, m=ner_model: m.predict_many(texts, batch_size=self.max_batch))
+                if re_name not in self.re_batchers:
+                    self.re_batchers[re_name] = self._batcher(f"RE_{re_name}", pipeline._predict_re)
+                self.pipelines[key] = pipeline
+        return self.pipelines[key]
+
+    def _batcher(self, name, fn):
+        return MicroBatcher(name, fn, max_batch=self.max_batch, max_wait_ms=self.max_wait_ms,
+                            max_queue=self.max_queue)
+
+    async def extract(self, texts, ner_name, re_name):
+        pipeline = await self._get_pipeline(ner_name, re_name)
+        loop = asyncio.get_running_loop()
+        # Pipeline dùng chung giữa các request nên mỗi request có RunMetrics riêng.
+        # Thời gian ner/re tính cả lúc chờ gom batch (độ trễ mà request thấy).
+        metrics = pipeline.new_metrics()
+
+        if self.cache is None:
+            results = await self._extract(pipeline, texts, ner_name, re_name, metrics)
+        else:
+            # Chỉ cache theo bài: NER/RE của các bài chưa có vẫn đi qua batcher dùng chung
+            with metrics.stage("cleaning"):
+                cleaned_texts = await loop.run_in_executor(self._cpu_executor, lambda: [clean_text_basic(t) for t in texts])
+            keys = [make_key(pipeline._cache_scopes["article"], text) for text in cleaned_texts]
+            results = [pipeline._cache_get("article", key, metrics) for key in keys]
+            todo = [i for i, result in enumerate(results) if result is None]
+            if todo:
+                computed = await self._extract(pipeline, [cleaned_texts[i] for i in todo], ner_name, re_name,
+                                               metrics, cleaned=True)
+                for i, result in zip(todo, computed):
+                    self.cache.put("article", keys[i], result)
+                    results[i] = result
+        metrics.finish()
+        return results
+
+    async def _extract(self, pipeline, texts, ner_name, re_name, metrics, cleaned=False):
+        loop = asyncio.get_running_loop()
+        articles = await loop.run_in_executor(self._cpu_executor, pipeline._segment_articles, texts, metrics, cleaned)
+        flat_segments = [seg for segments, _ in articles for seg in segments]
+        with metrics.stage("ner"):
+            flat_entities = await self.ner_batchers[ner_name].submit(flat_segments)
+        all_entities, window_jobs = pipeline._collect_windows(articles, flat_entities, metrics)
+
+        re_jobs = await loop.run_in_executor(self._cpu_executor, pipeline._build_re_jobs, window_jobs, metrics)
+        with metrics.stage("re"):
+            labels = await self.re_batchers[re_name].submit([job[3] for job in re_jobs])
+        return pipeline._assemble(all_entities, pipeline._match_labels(re_jobs, labels), metrics)
+
+    def health(self):
+        return {
+            "status": "ok",
+            "uptime_s": round(time.time() - self.started, 1),
+            "pipelines": [f"{ner}+{re}" for ner, re in self.pipelines],
+            "batchers": {b.name: b.info() for b in [*self.ner_batchers.values(), *self.re_batchers.values()]},
+        }
+
+    # --- HTTP ---
+
+    async def handle(self, reader, writer):
+        try:
+            status, payload = await self._dispatch(reader)
+        except RequestError as e:
+            status, payload = e.status, {"error": str(e)}
+        except QueueFullError as e:
+            status, payload = 503, {"error": str(e)}
+        except Exception as e:
+            status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode('utf-8'), "application/json; charset=utf-8"
+        headers = [f"HTTP/1.1 {status} {HTTP_STATUS.get(status, '')}",
+                   f"Content-Type: {content_type}",
+                   f"Content-Length: {len(body)}",
+                   "Connection: close"]
+        if status == 503:
+            headers.append("Retry-After: 1")
+        try:
+            writer.write(("\r\n".join(headers) + "\r\n\r\n").encode('latin-1') + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, reader, max_body=10 * 1024 * 1024):
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        if not request_line:
+            raise RequestError(400, "Request rỗng")
+        parts = request_line.split()
+        if len(parts) < 2:
+            raise RequestError(400, f"Request line không hợp lệ: {request_line}")
+        method, path = parts[0].upper(), parts[1].split('?')[0]
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise RequestError(400, f"Content-Length không hợp lệ: {headers['content-length']}")
+        if length < 0:
+            raise RequestError(400, f"Content-Length không hợp lệ: {length}")
+        if length > max_body:
+            raise RequestError(413, f"Body quá lớn ({length} bytes)")
+        body = await reader.readexactly(length) if length else b""
+
+        if path == "/health":
+            return 200, self.health()
+        if path == "/metrics":
+            return 200, self.exporter.render()
+        if path != "/extract":
+            raise RequestError(404, f"Không có endpoint {path}")
+        if method != "POST":
+            raise RequestError(405, "Dùng POST cho /extract")
+
+        try:
+            request = json.loads(body.decode('utf-8') or "{}")
+        except ValueError as e:
+            raise RequestError(400, f"JSON không hợp lệ: {e}")
+        if not isinstance(request, dict):
+            raise RequestError(400, "Body phải là JSON object")
+
+        single = "texts" not in request
+        texts = [request.get("text")] if single else request["texts"]
+        if not isinstance(texts, list) or not texts or not all(isinstance(t, str) and t.strip() for t in texts):
+            raise RequestError(400, "Cần 'text' (chuỗi) hoặc 'texts' (list chuỗi) không rỗng")
+
+        results = await self.extract(texts, request.get("ner_model", "PHOBERT"), request.get("re_model", "PHOBERT"))
+        return 200, results[0] if single else results
+
+
+async def serve(service, host, port):
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"=== SERVICE SẴN SÀNG: http://{host}:{port} (POST /extract, GET /health, GET /metrics) ===")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP service trích xuất NER + RE có micro-batching")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=32, help="Số item tối đa mỗi batch (segment NER / input RE)")
+    parser.add_argument("--max-wait-ms", type=float, default=10, help="Thời gian chờ gom batch tối đa")
+    parser.add_argument("--max-queue", type=int, default=1024, help="Số item tối đa trong hàng đợi mỗi model, vượt quá -> 503")
+    parser.add_argument("--preload", nargs="*", default=[], metavar="NER+RE", help="VD: PHOBERT+PHOBERT CRF+LOGREG")
+    parser.add_argument("--standin", action="store_true", help="Dùng model ngẫu nhiên nhỏ (standins.py) để chạy thử")
+    parser.add_argument("--cache", action="store_true", help="Cache kết quả theo bài (ResultCache, theo config RESULT_CACHE_*)")
+    parser.add_argument("--cache-dir", default=None, help="Thư mục cache trên đĩa (bật --cache)")
+    args = parser.parse_args()
+
+    if args.standin:
+        from .standins import StandInLoader
+        loader = StandInLoader()
+    else:
+        from .loader import SystemLoader
+        loader = SystemLoader()
+
+    async def run():
+        cache = ResultCache(disk_dir=args.cache_dir) if args.cache or args.cache_dir else None
+        service = ExtractionService(loader, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms,
+                                    max_queue=args.max_queue, cache=cache)
+        for combo in args.preload:
+            ner_name, _, re_name = combo.partition("+")
+            await service._get_pipeline(ner_name, re_name or "PHOBERT")
+        await serve(service, args.host, args.port)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
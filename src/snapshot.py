@@ -0,0 +1,201 @@
+"""
+Snapshot cục bộ cho toàn bộ model trong MODEL_PATHS: worker mới load thẳng từ đĩa (offline),
+không đi qua HF hub.
+
+    python -m src.snapshot                      # ghi vào config.SNAPSHOT_DIR
+    python -m src.snapshot --out /data/tngt_snapshot
+    python -m src.snapshot --verify             # kiểm tra lại sha256 theo manifest
+
+- Model HF (PhoBERT): save_pretrained dạng safetensors (load bằng mmap).
+- Model sklearn/CRF: joblib.dump không nén để joblib.load(mmap_mode='r') map thẳng mảng numpy.
+- manifest.json: nguồn, đường dẫn tương đối và sha256 của từng file; chỉ được ghi khi snapshot xong.
+"""
+import os
+import json
+import shutil
+import hashlib
+import argparse
+from datetime import datetime, timezone
+from .config import MODEL_PATHS, SNAPSHOT_DIR
+
+MANIFEST_FILE = "manifest.json"
+
+# key manifest -> (loại artifact, thư mục/file trong snapshot)
+SNAPSHOT_LAYOUT = {
+    "VECTORIZER_BASE": ("hf_base", "vectorizer_base"),
+    "NER/PHOBERT":     ("hf_token_cls", "ner/phobert"),
+    "NER/LABEL_MAP":   ("file", "ner/label_map.json"),
+    "NER/LOGREG":      ("joblib", "ner/logistic_regression.pkl"),
+    "NER/SVM":         ("joblib", "ner/svm_model.pkl"),
+    "NER/CRF":         ("joblib", "ner/crf_model.pkl"),
+    "RE/PHOBERT":      ("hf_seq_cls", "re/phobert"),
+    "RE/METADATA":     ("joblib", "re/metadata.pkl"),
+    "RE/LOGREG":       ("joblib", "re/lr_model.joblib"),
+    "RE/SVM":          ("joblib", "re/svm_model.joblib"),
+    "RE/RF":           ("joblib", "re/rf_model.joblib"),
+    "RE/SPAN":         ("dir", "re/span_re"),
+}
+
+_MANIFEST_CACHE = {}
+
+
+def _source_path(key):
+    node = MODEL_PATHS
+    for part in key.split("/"):
+        node = node[part]
+    return node
+
+
+def load_manifest(snapshot_dir=None):
+    """Manifest của snapshot (None nếu chưa có), đọc một lần cho mỗi thư mục"""
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    if snapshot_dir not in _MANIFEST_CACHE:
+        manifest = None
+        path = os.path.join(snapshot_dir, MANIFEST_FILE)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        _MANIFEST_CACHE[snapshot_dir] = manifest
+    return _MANIFEST_CACHE[snapshot_dir]
+
+
+def resolve_model_path(*keys, snapshot_dir=None):
+    """
+    VD: resolve_model_path("NER", "PHOBERT"), resolve_model_path("VECTORIZER_BASE").
+    Ưu tiên bản trong snapshot (nếu manifest có và file còn tồn tại), ngược lại trả về MODEL_PATHS.
+    """
+    key = "/".join(keys)
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    manifest = load_manifest(snapshot_dir)
+    entry = (manifest or {}).get("entries", {}).get(key)
+    if entry:
+        path = os.path.join(snapshot_dir, entry["path"])
+        if os.path.exists(path):
+            return path
+    return _source_path(key)
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_tree(root, target):
+    """sha256 + kích thước của mọi file trong target (file hoặc thư mục), key là đường dẫn tương đối so với root"""
+    paths = [target] if os.path.isfile(target) else [
+        os.path.join(dirpath, name) for dirpath, _, names in os.walk(target) for name in sorted(names)]
+    return {os.path.relpath(path, root).replace(os.sep, "/"): {"sha256": sha256_file(path), "bytes": os.path.getsize(path)}
+            for path in sorted(paths)}
+
+
+def _materialize(kind, source, target):
+    if kind.startswith("hf_"):
+        from transformers import (AutoModel, AutoModelForTokenClassification,
+                                  AutoModelForSequenceClassification, AutoTokenizer)
+        model_cls = {"hf_base": AutoModel,
+                     "hf_token_cls": AutoModelForTokenClassification,
+                     "hf_seq_cls": AutoModelForSequenceClassification}[kind]
+        # use_fast=False giống cách các predictor load PhoBERT
+        AutoTokenizer.from_pretrained(source, use_fast=False).save_pretrained(target)
+        model_cls.from_pretrained(source).save_pretrained(target, safe_serialization=True)
+    elif kind == "joblib":
+        import joblib
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        joblib.dump(joblib.load(source), target) # Không nén -> mmap được
+    elif kind == "dir":
+        shutil.copytree(source, target, dirs_exist_ok=True)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(source, target)
+
+
+def _is_available(kind, source):
+    # Model HF dạng repo id (chưa có ở local) -> để from_pretrained tự tải
+    return os.path.exists(source) or (kind.startswith("hf_") and not os.path.isabs(source))
+
+
+def build_snapshot(out_dir=None, only=None):
+    """Materialize các model vào out_dir rồi ghi manifest. Output: manifest"""
+    import sklearn
+    import torch
+    import transformers
+
+    out_dir = out_dir or SNAPSHOT_DIR
+    os.makedirs(out_dir, exist_ok=True)
+    entries = {}
+
+    for key, (kind, rel_path) in SNAPSHOT_LAYOUT.items():
+        if only and key not in only:
+            continue
+        source = _source_path(key)
+        if not _is_available(kind, source):
+            print(f"--- [SKIP] {key}: không tìm thấy {source}")
+            continue
+
+        print(f"--- [SNAPSHOT] {key} <- {source}")
+        target = os.path.join(out_dir, rel_path)
+        try:
+            _materialize(kind, source, target)
+        except Exception as e:
+            print(f"--- [ERROR] {key}: {e}")
+            continue
+        entries[key] = {"source": source, "kind": kind, "path": rel_path, "files": _hash_tree(out_dir, target)}
+
+    # Giữ lại các entry cũ không được snapshot lại lần này (khi dùng --only)
+    previous = load_manifest(out_dir) or {}
+    for key, entry in previous.get("entries", {}).items():
+        entries.setdefault(key, entry)
+
+    manifest = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "versions": {"torch": torch.__version__, "transformers": transformers.__version__,
+                     "scikit-learn": sklearn.__version__},
+        "entries": entries,
+    }
+    tmp_path = os.path.join(out_dir, MANIFEST_FILE + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST_FILE))
+    _MANIFEST_CACHE.pop(out_dir, None)
+    return manifest
+
+
+def verify_snapshot(snapshot_dir=None):
+    """Kiểm tra sha256 của mọi file trong manifest. Output: list các file lỗi/thiếu"""
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    manifest = load_manifest(snapshot_dir)
+    if manifest is None:
+        return [MANIFEST_FILE]
+
+    broken = []
+    for entry in manifest["entries"].values():
+        for rel_path, info in entry["files"].items():
+            path = os.path.join(snapshot_dir, rel_path)
+            if not os.path.exists(path) or sha256_file(path) != info["sha256"]:
+                broken.append(rel_path)
+    return broken
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot toàn bộ model trong MODEL_PATHS ra thư mục cục bộ")
+    parser.add_argument("--out", default=SNAPSHOT_DIR)
+    parser.add_argument("--only", nargs="*", choices=list(SNAPSHOT_LAYOUT), help="Chỉ snapshot các key này")
+    parser.add_argument("--verify", action="store_true", help="Chỉ kiểm tra sha256 của snapshot có sẵn")
+    args = parser.parse_args()
+
+    if args.verify:
+        broken = verify_snapshot(args.out)
+        print(f"-> Snapshot {'hợp lệ' if not broken else 'LỖI'}: {args.out}")
+        for rel_path in broken:
+            print(f"   sai/thiếu: {rel_path}")
+        raise SystemExit(1 if broken else 0)
+
+    manifest = build_snapshot(args.out, only=args.only)
+    print(f"-> Đã ghi {len(manifest['entries'])} model vào {args.out}")
+
+
+if __name__ == "__main__":
+    main()
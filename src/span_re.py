@@ -0,0 +1,267 @@
+import os
+import json
+import torch
+import torch.nn as nn
+import numpy as np
+from functools import lru_cache
+from transformers import AutoTokenizer, AutoModel
+from .config import ENTITY_TYPES, RE_ID2LABEL, VALID_RE_PAIRS, LONG_INPUT_STRIDE
+from .merge_json import iter_tasks
+from .chunking import run_chunked, stitch
+
+SPAN_HEAD_FILE = "span_head.pt"
+SPAN_CONFIG_FILE = "span_config.json"
+
+
+class SpanPairClassifier(nn.Module):
+    """
+    RE dạng span-pooling: encode cửa sổ MỘT lần bằng PhoBERT, lấy mean các subword
+    của chủ thể/đối tượng + embedding loại thực thể rồi phân loại cặp.
+    Không cần chèn Typed Markers nên không phải encode lại cửa sổ cho từng cặp.
+    """
+
+    def __init__(self, encoder, num_labels, num_types=len(ENTITY_TYPES), type_dim=32, dropout=0.1):
+        super().__init__()
+        self.encoder = encoder
+        hidden = encoder.config.hidden_size
+        self.type_embeddings = nn.Embedding(num_types, type_dim)
+        self.classifier = nn.Sequential(
+            nn.Dropout(dropout),
+            nn.Linear(2 * hidden + 2 * type_dim, hidden),
+            nn.Tanh(),
+            nn.Dropout(dropout),
+            nn.Linear(hidden, num_labels),
+        )
+
+    def forward(self, input_ids, attention_mask, pairs):
+        """
+        input_ids, attention_mask: [n_windows, seq_len]
+        pairs: LongTensor [n_pairs, 7] = (window, s_start, s_end, o_start, o_end, s_type, o_type)
+               với s_start/s_end... là vị trí subword [start, end).
+        Output: logits [n_pairs, num_labels]
+        """
+        hidden = self.encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+        return self.classify(hidden, pairs)
+
+    def classify(self, hidden, pairs):
+        """Phân loại cặp từ hidden state đã có: hidden [n_windows, seq_len, hidden], pairs như forward"""
+        # Tổng tích lũy theo chiều token -> mean của span bất kỳ chỉ tốn O(1)
+        cumsum = torch.cat([hidden.new_zeros(hidden.size(0), 1, hidden.size(2)), hidden.cumsum(dim=1)], dim=1)
+        window = pairs[:, 0]
+
+        def span_mean(start, end):
+            total = cumsum[window, end] - cumsum[window, start]
+            return total / (end - start).clamp(min=1).unsqueeze(-1).to(hidden.dtype)
+
+        features = torch.cat([
+            span_mean(pairs[:, 1], pairs[:, 2]),
+            span_mean(pairs[:, 3], pairs[:, 4]),
+            self.type_embeddings(pairs[:, 5]),
+            self.type_embeddings(pairs[:, 6]),
+        ], dim=-1)
+        return self.classifier(features)
+
+
+class SpanREModel:
+    """Gói tokenizer + SpanPairClassifier, lo phần căn chỉnh ký tự -> từ -> subword."""
+
+    def __init__(self, tokenizer, module, id2label=None, max_length=256, word_cache_size=100000):
+        self.tokenizer = tokenizer
+        self.module = module
+        self.id2label = id2label or dict(RE_ID2LABEL)
+        self.max_length = max_length
+        self.type2id = {t: i for i, t in enumerate(ENTITY_TYPES)}
+        self._word_subwords = lru_cache(maxsize=word_cache_size)(self._encode_word)
+
+    @classmethod
+    def from_base(cls, base_path, id2label=None, type_dim=32):
+        """Khởi tạo model mới từ PhoBERT gốc (để train)"""
+        tokenizer = AutoTokenizer.from_pretrained(base_path, use_fast=False)
+        encoder = AutoModel.from_pretrained(base_path)
+        id2label = id2label or dict(RE_ID2LABEL)
+        module = SpanPairClassifier(encoder, num_labels=len(id2label), type_dim=type_dim)
+        return cls(tokenizer, module, id2label=id2label)
+
+    @classmethod
+    def from_pretrained(cls, path):
+        with open(os.path.join(path, SPAN_CONFIG_FILE), 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        tokenizer = AutoTokenizer.from_pretrained(path, use_fast=False)
+        encoder = AutoModel.from_pretrained(path)
+        id2label = {int(k): v for k, v in config["id2label"].items()}
+        module = SpanPairClassifier(encoder, num_labels=len(id2label), type_dim=config["type_dim"])
+        head_state = torch.load(os.path.join(path, SPAN_HEAD_FILE), map_location="cpu")
+        # Encoder đã load từ path; mọi trọng số của head phải khớp, không thì classifier là ngẫu nhiên
+        result = module.load_state_dict(head_state, strict=False)
+        missing = [k for k in result.missing_keys if not k.startswith("encoder.")]
+        if missing or result.unexpected_keys:
+            raise ValueError(f"{SPAN_HEAD_FILE} trong {path} không khớp SpanPairClassifier: "
+                             f"thiếu {missing}, thừa {result.unexpected_keys}")
+        return cls(tokenizer, module, id2label=id2label, max_length=config.get("max_length", 256))
+
+    def save_pretrained(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.module.encoder.save_pretrained(path)
+        self.tokenizer.save_pretrained(path)
+        head_state = {k: v for k, v in self.module.state_dict().items() if not k.startswith("encoder.")}
+        torch.save(head_state, os.path.join(path, SPAN_HEAD_FILE))
+        with open(os.path.join(path, SPAN_CONFIG_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                "id2label": self.id2label,
+                "type_dim": self.module.type_embeddings.embedding_dim,
+                "max_length": self.max_length,
+                "entity_types": ENTITY_TYPES,
+            }, f, ensure_ascii=False, indent=2)
+
+    def _encode_word(self, word):
+        return tuple(self.tokenizer.encode(word, add_special_tokens=False))
+
+    def encode_window(self, text, truncate=True):
+        """
+        Output: (input_ids, word_spans, char_spans)
+          word_spans[i]: khoảng subword [start, end) của từ thứ i (None nếu bị cắt do quá dài)
+          char_spans[i]: khoảng ký tự [start, end) của từ thứ i trong text
+        truncate=False: không cắt ở max_length (inference chia chunk, xem predict_windows)
+        """
+        input_ids = [self.tokenizer.cls_token_id]
+        word_spans, char_spans = [], []
+        budget = self.max_length - 1 if truncate else float('inf') # Chừa chỗ cho [SEP]
+
+        cursor = 0
+        truncated = False
+        for word in text.split():
+            start = text.find(word, cursor)
+            cursor = start + len(word)
+            char_spans.append((start, cursor))
+
+            subwords = self._word_subwords(word)
+            truncated = truncated or len(input_ids) + len(subwords) > budget
+            if truncated:
+                word_spans.append(None)
+                continue
+            word_spans.append((len(input_ids), len(input_ids) + len(subwords)))
+            input_ids.extend(subwords)
+
+        input_ids.append(self.tokenizer.sep_token_id)
+        return input_ids, word_spans, char_spans
+
+    @staticmethod
+    def _entity_char_span(text, entity):
+        start = entity.get('start')
+        if start is None:
+            start = text.find(entity['word'])
+        if start == -1:
+            return None
+        end = entity.get('end')
+        if end is None:
+            end = start + len(entity['word'])
+        return start, end
+
+    def entity_subword_span(self, text, entity, word_spans, char_spans):
+        """Đổi thực thể (offset ký tự) sang khoảng subword [start, end), None nếu không định vị được"""
+        span = self._entity_char_span(text, entity)
+        if span is None:
+            return None
+        start, end = span
+        covered = [word_spans[i] for i, (ws, we) in enumerate(char_spans)
+                   if ws < end and we > start and word_spans[i] is not None]
+        if not covered:
+            return None
+        return covered[0][0], covered[-1][1]
+
+    def build_batch(self, windows, device):
+        """
+        Batch cho train (cửa sổ dài bị cắt ở max_length).
+        windows: list (text, [(source_entity, target_entity), ...])
+        Output: (inputs, pair_tensor, pair_refs) với pair_refs[k] = (vị trí cửa sổ, vị trí cặp)
+        cho từng hàng của pair_tensor; cặp không định vị được sẽ không có mặt.
+        """
+        encoded, rows, refs = self._build_rows(windows, truncate=True)
+        inputs = self.tokenizer.pad({'input_ids': encoded}, padding=True, return_tensors="pt").to(device)
+        pair_tensor = torch.tensor(rows, dtype=torch.long, device=device).reshape(-1, 7)
+        return inputs, pair_tensor, refs
+
+    def predict_windows(self, windows, device, batch_size=8, stride=LONG_INPUT_STRIDE):
+        """
+        Inference: cửa sổ dài hơn max_length được encode theo chunk chồng lấn (chunking.py) rồi ghép
+        hidden state lại, không cặp nào bị bỏ vì cửa sổ bị cắt.
+        Output: (logits [n_pairs, num_labels] hoặc None nếu không có cặp nào, pair_refs như build_batch)
+        """
+        encoded, rows, refs = self._build_rows(windows, truncate=False)
+        if not refs:
+            return None, refs
+
+        def forward(batch):
+            inputs = self.tokenizer.pad({'input_ids': batch}, padding=True, return_tensors="pt").to(device)
+            hidden = self.module.encoder(**inputs).last_hidden_state.float().cpu().numpy()
+            return [hidden[row, :len(ids)] for row, ids in enumerate(batch)]
+
+        with torch.no_grad():
+            hidden = [stitch(chunks) for chunks in run_chunked(encoded, forward, batch_size, self.max_length, stride)]
+            # Chỉ vị trí trong span được dùng (tổng tích lũy tới cuối span) nên phần pad để 0
+            padded = np.zeros((len(hidden), max(len(h) for h in hidden), hidden[0].shape[-1]), dtype=np.float32)
+            for i, h in enumerate(hidden):
+                padded[i, :len(h)] = h
+            pair_tensor = torch.tensor(rows, dtype=torch.long, device=device).reshape(-1, 7)
+            logits = self.module.classify(torch.from_numpy(padded).to(device), pair_tensor)
+        return logits, refs
+
+    def _build_rows(self, windows, truncate):
+        """Output: (input_ids từng cửa sổ, hàng pair_tensor, pair_refs)"""
+        encoded, rows, refs = [], [], []
+        for w_idx, (text, pairs) in enumerate(windows):
+            input_ids, word_spans, char_spans = self.encode_window(text, truncate=truncate)
+            for p_idx, (source, target) in enumerate(pairs):
+                s_span = self.entity_subword_span(text, source, word_spans, char_spans)
+                o_span = self.entity_subword_span(text, target, word_spans, char_spans)
+                s_type = self.type2id.get(source['entity_group'])
+                o_type = self.type2id.get(target['entity_group'])
+                if s_span is None or o_span is None or s_type is None or o_type is None:
+                    continue
+                rows.append([len(encoded), s_span[0], s_span[1], o_span[0], o_span[1], s_type, o_type])
+                refs.append((w_idx, p_idx))
+            encoded.append(input_ids)
+        return encoded, rows, refs
+
+
+def load_span_samples(json_paths):
+    """
+    Đọc export Label Studio (JSON hoặc JSONL đã gộp bởi merge_json) -> list {text, entities, pairs}.
+    entities: {id: {'word', 'start', 'end', 'entity_group'}}, pairs: [(source_id, target_id, label)]
+    Giống notebook RE: mọi cặp đúng schema VALID_RE_PAIRS, cặp không gán nhãn là NO_RELATION.
+    """
+    label2id = {v: k for k, v in RE_ID2LABEL.items()}
+    samples = []
+    for path in json_paths:
+        for task in iter_tasks(path):
+            text = task.get('data', {}).get('text')
+            annotations = task.get('annotations') or []
+            if not text or not annotations:
+                continue
+
+            entities, relations = {}, {}
+            for item in annotations[0].get('result', []):
+                if item.get('type') == 'labels' and 'id' in item:
+                    value = item['value']
+                    labels = value.get('labels') or []
+                    if labels and labels[0] in ENTITY_TYPES:
+                        entities[item['id']] = {
+                            'word': value.get('text', text[value['start']:value['end']]),
+                            'start': value['start'],
+                            'end': value['end'],
+                            'entity_group': labels[0],
+                        }
+                elif item.get('type') == 'relation' and item.get('labels'):
+                    relations[(item['from_id'], item['to_id'])] = item['labels'][0]
+
+            pairs = []
+            for s_id, source in entities.items():
+                for o_id, target in entities.items():
+                    if s_id == o_id or (source['entity_group'], target['entity_group']) not in VALID_RE_PAIRS:
+                        continue
+                    label = relations.get((s_id, o_id), "NO_RELATION")
+                    if label in label2id:
+                        pairs.append((s_id, o_id, label2id[label]))
+            if pairs:
+                samples.append({'text': text, 'entities': entities, 'pairs': pairs})
+    return samples
@@ -0,0 +1,108 @@
+"""
+Model thay thế (trọng số ngẫu nhiên, rất nhỏ) cho NER/RE để chạy thử service, benchmark...
+trên máy không có model thật. Cùng interface với NERPredictor/REPredictor:
+  - NER: predict_many(texts, batch_size) -> list các list entity {'word', 'entity_group', 'start', 'end'}
+  - RE : predict_batch(texts, batch_size) -> list nhãn (input là text đã chèn Typed Markers)
+Từ được băm vào một bảng embedding cố định nên không cần tokenizer/vocab.
+"""
+import zlib
+import torch
+import torch.nn as nn
+from .config import ENTITY_TYPES, RE_ID2LABEL
+from .wrappers import BasePredictor, aggregate_entities, token_char_spans
+
+NER_STANDIN_LABELS = ['O'] + [f"{prefix}-{t}" for t in ENTITY_TYPES for prefix in ("B", "I")]
+
+
+class HashedTokenModel(nn.Module):
+    """Embedding theo hash của từ -> Linear. Đủ để mô phỏng chi phí một lượt forward có padding."""
+
+    def __init__(self, num_labels, vocab_size=4096, dim=64, seed=0):
+        super().__init__()
+        generator = torch.Generator().manual_seed(seed)
+        self.vocab_size = vocab_size
+        self.embeddings = nn.Embedding(vocab_size, dim, padding_idx=0)
+        self.mixer = nn.Linear(dim, dim)
+        self.classifier = nn.Linear(dim, num_labels)
+        with torch.no_grad():
+            for param in self.parameters():
+                param.copy_(torch.randn(param.shape, generator=generator) * 0.5)
+
+    def token_ids(self, words):
+        # id 0 dành cho padding
+        return [1 + zlib.crc32(w.encode('utf-8')) % (self.vocab_size - 1) for w in words]
+
+    def encode_batch(self, word_lists):
+        """Output: (hidden [batch, max_len, dim], mask [batch, max_len])"""
+        max_len = max(1, max(len(words) for words in word_lists))
+        ids = torch.zeros((len(word_lists), max_len), dtype=torch.long)
+        for row, words in enumerate(word_lists):
+            if words:
+                ids[row, :len(words)] = torch.tensor(self.token_ids(words))
+        hidden = torch.tanh(self.mixer(self.embeddings(ids)))
+        return hidden, ids != 0
+
+
+class StandInNERPredictor(BasePredictor):
+    def __init__(self, seed=0):
+        super().__init__('ML')
+        self.labels = NER_STANDIN_LABELS
+        self.model = HashedTokenModel(len(self.labels), seed=seed).eval()
+
+    def predict(self, text):
+        return self.predict_many([text], batch_size=1)[0]
+
+    def predict_many(self, texts, batch_size=16):
+        texts = list(texts)
+        results = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            all_tokens = [text.split() for text in batch]
+            with torch.no_grad():
+                hidden, _ = self.model.encode_batch(all_tokens)
+                pred_ids = self.model.classifier(hidden).argmax(dim=-1).tolist()
+            for text, tokens, ids in zip(batch, all_tokens, pred_ids):
+                tags = [self.labels[i] for i in ids[:len(tokens)]]
+                results.append(aggregate_entities(tokens, tags, spans=token_char_spans(text, tokens)))
+        return results
+
+
+class StandInREPredictor(BasePredictor):
+    def __init__(self, seed=1):
+        super().__init__('DL')
+        self.id2label = dict(RE_ID2LABEL)
+        self.model = HashedTokenModel(len(self.id2label), seed=seed).eval()
+
+    def predict(self, text):
+        return self.predict_batch([text], batch_size=1)[0]
+
+    def predict_batch(self, texts, batch_size=16):
+        texts = list(texts)
+        labels = []
+        for start in range(0, len(texts), batch_size):
+            word_lists = [text.split() for text in texts[start:start + batch_size]]
+            with torch.no_grad():
+                hidden, mask = self.model.encode_batch(word_lists)
+                pooled = (hidden * mask.unsqueeze(-1)).sum(1) / mask.sum(1, keepdim=True).clamp(min=1)
+                pred_ids = self.model.classifier(pooled).argmax(dim=-1).tolist()
+            labels.extend(self.id2label[i] for i in pred_ids)
+        return labels
+
+
+class StandInLoader:
+    """Thay SystemLoader: mọi tên model đều trả về stand-in (seed theo tên model để mỗi tên cho kết quả khác nhau)"""
+
+    def __init__(self):
+        self.cached_models = {}
+
+    def load_ner_model(self, model_name, **kwargs):
+        key = f"NER_{model_name}"
+        if key not in self.cached_models:
+            self.cached_models[key] = StandInNERPredictor(seed=zlib.crc32(key.encode()))
+        return self.cached_models[key]
+
+    def load_re_model(self, model_name):
+        key = f"RE_{model_name}"
+        if key not in self.cached_models:
+            self.cached_models[key] = StandInREPredictor(seed=zlib.crc32(key.encode()))
+        return self.cached_models[key]
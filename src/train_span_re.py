@@ -0,0 +1,143 @@
+"""
+Train / đánh giá model RE span-pooling (SpanPairClassifier) trên export Label Studio.
+
+    python -m src.train_span_re --epochs 3
+    python -m src.train_span_re --eval-only --model-dir models/re/span_re
+    python -m src.train_span_re --dataset data/compiled   # dataset đã biên dịch (python -m src.dataset_builder)
+"""
+import os
+import glob
+import random
+import argparse
+import numpy as np
+import torch
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import accuracy_score, f1_score, classification_report
+from .config import BASE_DIR, MODEL_PATHS, DEVICE
+from .span_re import SpanREModel, load_span_samples
+
+
+def set_seed(seed=42):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    torch.cuda.manual_seed_all(seed)
+
+
+def iter_batches(samples, batch_size, shuffle=False):
+    order = list(range(len(samples)))
+    if shuffle:
+        random.shuffle(order)
+    for start in range(0, len(order), batch_size):
+        yield [samples[i] for i in order[start:start + batch_size]]
+
+
+def to_windows(batch):
+    """Sample -> (text, [(source, target)]) + nhãn theo đúng thứ tự cặp"""
+    windows, labels = [], []
+    for sample in batch:
+        ents = sample['entities']
+        windows.append((sample['text'], [(ents[s], ents[o]) for s, o, _ in sample['pairs']]))
+        labels.append([label for _, _, label in sample['pairs']])
+    return windows, labels
+
+
+def run_epoch(model, samples, batch_size, optimizer=None):
+    """Train (nếu có optimizer) hoặc đánh giá một lượt. Output: (loss trung bình, y_true, y_pred)"""
+    training = optimizer is not None
+    model.module.train(training)
+    loss_fn = torch.nn.CrossEntropyLoss()
+    total_loss, n_batches = 0.0, 0
+    y_true, y_pred = [], []
+
+    for batch in iter_batches(samples, batch_size, shuffle=training):
+        windows, labels = to_windows(batch)
+        inputs, pair_tensor, refs = model.build_batch(windows, DEVICE)
+        if not refs:
+            continue
+        target = torch.tensor([labels[w][p] for w, p in refs], dtype=torch.long, device=DEVICE)
+
+        with torch.set_grad_enabled(training):
+            logits = model.module(inputs['input_ids'], inputs['attention_mask'], pair_tensor)
+            loss = loss_fn(logits, target)
+
+        if training:
+            optimizer.zero_grad()
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(model.module.parameters(), 1.0)
+            optimizer.step()
+
+        total_loss += loss.item()
+        n_batches += 1
+        y_true.extend(target.tolist())
+        y_pred.extend(logits.argmax(dim=-1).tolist())
+
+    return total_loss / max(n_batches, 1), y_true, y_pred
+
+
+def report(model, y_true, y_pred):
+    label_ids = sorted(model.id2label)
+    print(f"Accuracy: {accuracy_score(y_true, y_pred):.4f} | F1-Macro: {f1_score(y_true, y_pred, average='macro'):.4f}")
+    print(classification_report(y_true, y_pred, labels=label_ids,
+                                target_names=[model.id2label[i] for i in label_ids], zero_division=0))
+
+
+def main():
+    default_data = sorted(glob.glob(os.path.join(BASE_DIR, "data", "label_studio", "ouput", "*.json")))
+
+    parser = argparse.ArgumentParser(description="Train/đánh giá RE span-pooling trên export Label Studio")
+    parser.add_argument("--data", nargs="+", default=default_data, help="Các file export Label Studio (.json/.jsonl)")
+    parser.add_argument("--dataset", help="Dataset đã biên dịch bởi dataset_builder (thay cho --data)")
+    parser.add_argument("--base-model", default=MODEL_PATHS["VECTORIZER_BASE"])
+    parser.add_argument("--model-dir", default=MODEL_PATHS["RE"]["SPAN"])
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=8, help="Số cửa sổ mỗi batch")
+    parser.add_argument("--lr", type=float, default=2e-5)
+    parser.add_argument("--head-lr", type=float, default=1e-3)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--eval-only", action="store_true", help="Chỉ đánh giá model đã lưu ở --model-dir")
+    args = parser.parse_args()
+
+    set_seed(args.seed)
+    if args.dataset:
+        from .dataset_builder import load_dataset
+        samples = load_dataset(args.dataset).span_samples()
+    else:
+        samples = load_span_samples(args.data)
+    n_pairs = sum(len(s['pairs']) for s in samples)
+    print(f"-> Đã đọc {len(samples)} cửa sổ, {n_pairs} cặp ứng viên.")
+
+    # Chia theo cửa sổ để các cặp của cùng một cửa sổ không lọt sang cả hai tập
+    train_set, test_set = train_test_split(samples, test_size=args.test_size, random_state=args.seed)
+    print(f"-> Train: {len(train_set)} | Test: {len(test_set)}")
+
+    if args.eval_only:
+        model = SpanREModel.from_pretrained(args.model_dir)
+        model.module.to(DEVICE)
+    else:
+        model = SpanREModel.from_base(args.base_model)
+        model.module.to(DEVICE)
+        encoder_params = list(model.module.encoder.parameters())
+        encoder_ids = {id(p) for p in encoder_params}
+        head_params = [p for p in model.module.parameters() if id(p) not in encoder_ids]
+        optimizer = torch.optim.AdamW([
+            {"params": encoder_params, "lr": args.lr},
+            {"params": head_params, "lr": args.head_lr},
+        ], weight_decay=0.01)
+
+        for epoch in range(1, args.epochs + 1):
+            train_loss, _, _ = run_epoch(model, train_set, args.batch_size, optimizer=optimizer)
+            test_loss, y_true, y_pred = run_epoch(model, test_set, args.batch_size)
+            print(f"Epoch {epoch}: train_loss={train_loss:.4f} test_loss={test_loss:.4f} "
+                  f"F1-Macro={f1_score(y_true, y_pred, average='macro'):.4f}")
+
+        model.save_pretrained(args.model_dir)
+        print(f"-> Đã lưu model tại: {args.model_dir}")
+
+    _, y_true, y_pred = run_epoch(model, test_set, args.batch_size)
+    report(model, y_true, y_pred)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,22 @@
-import torch
 import numpy as np
-from transformers import pipeline
-from .config import RE_ID2LABEL, SPECIAL_TOKENS, DEVICE
+from functools import lru_cache
+from .config import RE_ID2LABEL, SPECIAL_TOKENS, MAX_SEQ_LENGTH, WORD_CACHE_SIZE
+from .chunking import run_chunked, stitch
 
-def aggregate_entities(tokens, tags):
+def aggregate_entities(tokens, tags, spans=None):
     """
     Input: 
       tokens = ['Tai', 'nạn', 'tại', 'Hà', 'Nội']
       tags   = ['O',   'O',   'O',   'B-LOC', 'I-LOC']
+      spans  = vị trí ký tự (start, end) của từng token (tùy chọn)
     Output:
       [{'word': 'Hà Nội', 'entity_group': 'LOC'}]
+      (có thêm 'start', 'end' nếu truyền spans)
     """
     entities = []
     current_entity = None
     
-    for token, tag in zip(tokens, tags):
+    for k, (token, tag) in enumerate(zip(tokens, tags)):
         if tag == 'O':
             if current_entity:
                 entities.append(current_entity)
@@ -43,90 +45,255 @@ def aggregate_entities(tokens, tags):
             if current_entity:
                 entities.append(current_entity)
             current_entity = {"word": token, "entity_group": tag}
+
+        if spans is not None:
+            if 'start' not in current_entity:
+                current_entity['start'] = spans[k][0]
+            current_entity['end'] = spans[k][1]
              
     if current_entity:
         entities.append(current_entity)
     return entities
 
+# Tên đặc trưng CRF theo format notebook: d0..d767
+CRF_FEATURE_KEYS = tuple(f'd{i}' for i in range(768))
+
+def token_char_spans(text, tokens):
+    """Vị trí ký tự (start, end) của từng token (text.split()) trong text, dò tuần tự từ trái sang phải"""
+    spans = []
+    cursor = 0
+    for token in tokens:
+        start = text.find(token, cursor)
+        cursor = start + len(token)
+        spans.append((start, cursor))
+    return spans
+
+def crf_items(vectors):
+    """
+    Chuyển mảng [n_tokens, 768] sang List of Dicts mà sklearn-crfsuite yêu cầu.
+    Chỉ dựng ở biên gọi model.predict, dùng key dựng sẵn và giá trị float thuần.
+    """
+    return [dict(zip(CRF_FEATURE_KEYS, row)) for row in vectors.tolist()]
+
+def group_token_entities(tokenizer, tokens, labels, scores):
+    """
+    Gộp nhãn theo từng subword thành thực thể, giống aggregation_strategy="simple" của
+    pipeline token-classification HF (dùng khi tự decode logits, VD: backend ONNX).
+      tokens: subword (đã bỏ token đặc biệt), labels: nhãn argmax, scores: xác suất của nhãn đó
+    Output: [{'entity_group', 'score', 'word', 'start', 'end'}], bỏ nhóm 'O'
+    """
+    groups = []
+    for token, label, score in zip(tokens, labels, scores):
+        bi, tag = (label[:1], label[2:]) if label[:2] in ("B-", "I-") else ("I", label)
+        # Token cùng loại và không phải B- thì nối vào nhóm trước
+        if groups and groups[-1]['tag'] == tag and bi != "B":
+            groups[-1]['tokens'].append(token)
+            groups[-1]['scores'].append(score)
+        else:
+            groups.append({'tag': tag, 'tokens': [token], 'scores': [score]})
+
+    # Slow tokenizer (PhoBERT) không có offset mapping nên start/end là None như pipeline HF
+    return [{'entity_group': g['tag'],
+             'score': float(np.mean(g['scores'])),
+             'word': tokenizer.convert_tokens_to_string(g['tokens']),
+             'start': None,
+             'end': None}
+            for g in groups if g['tag'] != 'O']
+
 class BasePredictor:
+    cache_id = None # Định danh model cho ResultCache, do SystemLoader gán
+
     def __init__(self, model_type):
         self.model_type = model_type
 
+    def freeze(self):
+        """
+        Khóa predictor sau khi load: model ở chế độ eval, không tính gradient, không gán lại thuộc tính.
+        Predictor được chia sẻ giữa nhiều session/thread nên mọi thay đổi (VD: thêm special tokens,
+        resize embedding) phải làm trong loader trước khi freeze.
+        """
+        for module in (getattr(self, 'model', None), getattr(getattr(self, 'model', None), 'module', None)):
+            if hasattr(module, 'requires_grad_'):
+                module.eval()
+                module.requires_grad_(False)
+        object.__setattr__(self, '_frozen', True)
+        return self
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f"{type(self).__name__} đã freeze, không gán được '{name}'")
+        object.__setattr__(self, name, value)
+
 class NERPredictor(BasePredictor):
-    def __init__(self, model_type, model, tokenizer=None, feature_extractor=None, label_map=None):
+    def __init__(self, model_type, model, tokenizer=None, feature_extractor=None, label_map=None, crf_decoder=None):
         super().__init__(model_type)
         self.model = model
         
         if model_type == 'DL':
-            self.pipe = pipeline("token-classification", model=model, tokenizer=tokenizer, 
-                                 aggregation_strategy="simple", device=0 if torch.cuda.is_available() else -1)
+            self.tokenizer = tokenizer
+            self.pipe = None
+            # Số subword của từng từ (LRU): đo độ dài đoạn mà không tokenize lại cả đoạn
+            self._word_length = lru_cache(maxsize=WORD_CACHE_SIZE)(lambda word: len(tokenizer.tokenize(word)))
+            # Model ONNX (onnx_backend.py) không chạy được qua pipeline HF -> tự decode logits
+            if not getattr(model, 'is_onnx', False):
+                import torch
+                from transformers import pipeline # import nặng, chỉ cần cho NER DL
+                self.pipe = pipeline("token-classification", model=model, tokenizer=tokenizer, 
+                                     aggregation_strategy="simple", device=0 if torch.cuda.is_available() else -1)
         else:
             self.feature_extractor = feature_extractor
             self.label_map = label_map 
+            # Decoder NumPy thay cho crfsuite (nếu có), xem crf_decoder.py
+            self.crf_decoder = crf_decoder
 
     def predict(self, text):
+        return self.predict_many([text], batch_size=1)[0]
+
+    def predict_many(self, texts, batch_size=16):
+        """
+        Dự đoán thực thể cho nhiều đoạn văn (VD: tất cả cửa sổ của một/nhiều bài báo).
+        Các đoạn được encode trong mini-batch có padding thay vì từng đoạn một.
+        Output: List các list entity, đúng thứ tự input.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+
         if self.model_type == 'DL':
-            return self.pipe(text)
+            if self.pipe is None:
+                return self._predict_logits_many(texts, batch_size=batch_size)
+            # Pipeline HF cắt input ở MAX_SEQ_LENGTH (stride cần fast tokenizer, PhoBERT dùng slow tokenizer)
+            # -> đoạn dài tự decode theo chunk chồng lấn
+            lengths = [self._n_subwords(text) for text in texts]
+            long_idx = [i for i, n in enumerate(lengths) if n > MAX_SEQ_LENGTH]
+            if not long_idx:
+                return self.pipe(texts, batch_size=batch_size)
+
+            results = [None] * len(texts)
+            short_idx = [i for i, n in enumerate(lengths) if n <= MAX_SEQ_LENGTH]
+            if short_idx:
+                for i, entities in zip(short_idx, self.pipe([texts[i] for i in short_idx], batch_size=batch_size)):
+                    results[i] = entities
+            for i, entities in zip(long_idx, self._predict_logits_many([texts[i] for i in long_idx], batch_size)):
+                results[i] = entities
+            return results
         
         else:
             # --- LOGIC CHO ML ---
-            tokens = text.split()
-            if not tokens: return []
+            all_tokens = [text.split() for text in texts]
+            results = [[] for _ in texts]
+            active = [i for i, tokens in enumerate(all_tokens) if tokens]
+            if not active:
+                return results
 
             # Kiểm tra nếu là model CRF 
             if "CRF" in str(type(self.model)) or hasattr(self.model, "tagger_"):
-                # Lấy features chuẩn format notebook (List of Dicts)
-                features = self.feature_extractor.extract_crf_features(text)
-                
-                # CRF predict nhận vào list các câu: [[feat1, feat2], [feat1, feat2]]
-                if not features:
-                    return []
+                # Features dạng mảng float32 [n_tokens, 768] cho mỗi đoạn
+                features = self.feature_extractor.extract_crf_features_many(
+                    [texts[i] for i in active], batch_size=batch_size)
                     
                 try:
-                    # Trả về list of lists of labels: [['B-LOC', 'O', ...]]
-                    preds_list = self.model.predict([features])
-                    
-                    if len(preds_list) > 0:
-                        preds = preds_list[0]
+                    if self.crf_decoder is not None:
+                        # Matmul + Viterbi trên cả batch, nhận thẳng mảng float32
+                        preds_list = self.crf_decoder.decode_batch(features)
                     else:
-                        preds = ["O"] * len(tokens)
+                        # CRF predict nhận vào list các câu: [[feat1, feat2], [feat1, feat2]]
+                        # Trả về list of lists of labels: [['B-LOC', 'O', ...]]
+                        preds_list = self.model.predict([crf_items(vectors) for vectors in features])
                 except Exception as e:
                     print(f"[ERROR CRF Predict]: {e}")
-                    return []
+                    return results
 
             # === TRƯỜNG HỢP CHO LOGREG / SVM ===
             else:
-                vectors = self.feature_extractor.vectorize_token_level(text)
-                if len(vectors) == 0:
-                    preds = []
-                else:
-                    pred_ids = self.model.predict(vectors)
+                vectors_list = self.feature_extractor.vectorize_token_level_many(
+                    [texts[i] for i in active], batch_size=batch_size)
+
+                # Predict một lần trên toàn bộ token của tất cả các đoạn
+                pred_ids = self.model.predict(np.vstack(vectors_list))
+                preds_list = []
+                offset = 0
+                for vectors in vectors_list:
                     preds = []
-                    for pid in pred_ids:
+                    for pid in pred_ids[offset:offset + len(vectors)]:
                         label = self.label_map.get(pid) or self.label_map.get(str(pid)) or 'O'
                         preds.append(label)
+                    preds_list.append(preds)
+                    offset += len(vectors)
 
             # Gộp kết quả
-            min_len = min(len(tokens), len(preds))
-            entities = aggregate_entities(tokens[:min_len], preds[:min_len])
+            for i, preds in zip(active, preds_list):
+                tokens = all_tokens[i]
+                min_len = min(len(tokens), len(preds))
+                spans = token_char_spans(texts[i], tokens[:min_len])
+                results[i] = aggregate_entities(tokens[:min_len], preds[:min_len], spans=spans)
             
-            return entities
+            return results
+
+    def _n_subwords(self, text):
+        """Số subword (kể cả [CLS]/[SEP]) của text: slow tokenizer PhoBERT tách theo khoảng trắng rồi BPE từng từ"""
+        return sum(map(self._word_length, text.split())) + self.tokenizer.num_special_tokens_to_add()
+
+    def _predict_logits_many(self, texts, batch_size=16):
+        """
+        NER DL không qua pipeline HF: encode theo batch có padding, argmax rồi gộp như "simple".
+        Input dài hơn MAX_SEQ_LENGTH được encode theo chunk chồng lấn, xác suất ghép lại theo subword.
+        """
+        import torch
+        id2label = self.model.config.id2label
+        encodings = self.tokenizer(texts, return_special_tokens_mask=True)
+
+        # Model ONNX không có .device (chạy trên CPU)
+        device = getattr(self.model, 'device', 'cpu')
+
+        def forward(batch):
+            inputs = self.tokenizer.pad({'input_ids': batch}, padding=True, return_tensors="pt").to(device)
+            with torch.no_grad():
+                logits = self.model(**inputs).logits
+            probs = torch.softmax(logits.float(), dim=-1).cpu().numpy()
+            return [probs[row, :len(ids)] for row, ids in enumerate(batch)]
+
+        results = []
+        for i, chunks in enumerate(run_chunked(encodings['input_ids'], forward, batch_size)):
+            probs = stitch(chunks)
+            input_ids = encodings['input_ids'][i]
+            keep = [k for k, special in enumerate(encodings['special_tokens_mask'][i]) if not special]
+            pred_ids = probs[keep].argmax(axis=-1)
+            results.append(group_token_entities(
+                self.tokenizer,
+                self.tokenizer.convert_ids_to_tokens([input_ids[k] for k in keep]),
+                [id2label[int(pid)] for pid in pred_ids],
+                probs[keep, pred_ids] if keep else []))
+        return results
+
+def add_marker_tokens(tokenizer, model):
+    """Thêm Special Tokens (Typed Markers) vào tokenizer và resize embedding của model RE DL nếu cần"""
+    num_added = tokenizer.add_special_tokens({'additional_special_tokens': SPECIAL_TOKENS})
+    if num_added > 0:
+        model.resize_token_embeddings(len(tokenizer))
+    return tokenizer, model
 
 class REPredictor(BasePredictor):
     def __init__(self, model_type, model, tokenizer=None, feature_extractor=None, label_encoder=None):
+        from .config import DEVICE # torch chỉ được import khi tạo predictor
         super().__init__(model_type)
         self.device = DEVICE
         self.model = model
         
         if model_type == 'DL':
+            # Tokenizer phải có sẵn Special Tokens (Typed Markers), nếu không marker bị tách thành subword thường
+            vocab = tokenizer.get_vocab()
+            missing = [token for token in SPECIAL_TOKENS if token not in vocab]
+            if missing:
+                raise ValueError(f"Tokenizer RE thiếu {len(missing)} Typed Marker ({', '.join(missing[:4])}...): "
+                                 f"hãy gọi add_marker_tokens(tokenizer, model) trước khi tạo REPredictor")
             self.tokenizer = tokenizer
-            # Thêm Special Tokens cho model DL (nếu chưa có)
-            if self.tokenizer:
-                num_added = self.tokenizer.add_special_tokens({'additional_special_tokens': SPECIAL_TOKENS})
-                if num_added > 0:
-                    self.model.resize_token_embeddings(len(self.tokenizer))
             self.model.to(self.device)
             self.model.eval()
+        elif model_type == 'SPAN':
+            # model là SpanREModel (span_re.py): phân loại cặp trực tiếp trên cửa sổ gốc
+            self.model.module.to(self.device)
+            self.model.module.eval()
         else:
             # ML Model cần feature extractor để vector hóa text (có chứa tags)
             self.feature_extractor = feature_extractor
@@ -136,27 +303,77 @@ class REPredictor(BasePredictor):
         """
         Input: Text đã chèn thẻ Typed Markers. VD: "Tại <S:LOC> Hà Nội </S:LOC>..."
         """
+        return self.predict_batch([text], batch_size=1)[0]
+
+    def predict_batch(self, texts, batch_size=16):
+        """
+        Dự đoán nhãn quan hệ cho nhiều input cùng lúc.
+        Input: List text đã chèn Typed Markers.
+        Output: List nhãn, giữ đúng thứ tự của input.
+        """
+        if self.model_type == 'SPAN':
+            raise ValueError("Model RE dạng SPAN không nhận input Typed Markers, hãy dùng predict_pairs.")
+
+        texts = list(texts)
+        if not texts:
+            return []
+
         if self.model_type == 'DL':
-            inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=256, padding=True).to(self.device)
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                logits = outputs.logits
-            pred_id = logits.argmax().item()
-            # Map ID -> Label từ Config
-            return RE_ID2LABEL.get(pred_id, "NO_RELATION")
-        
+            import torch
+            # Tokenize một lần, chưa pad, không cắt: input dài được chia chunk chồng lấn (chunking.py)
+            encodings = self.tokenizer(texts)['input_ids']
+            marker_ids = set(self.tokenizer.convert_tokens_to_ids(SPECIAL_TOKENS))
+
+            def forward(batch):
+                # Length-bucketing trong run_chunked: mỗi batch chỉ pad tới chunk dài nhất của nó
+                inputs = self.tokenizer.pad({'input_ids': batch}, padding=True, return_tensors="pt").to(self.device)
+                with torch.no_grad():
+                    logits = self.model(**inputs).logits.float().cpu().numpy()
+                # Chunk không chứa thẻ thực thể nào không nói gì về cặp -> đánh dấu để bỏ khi lấy trung bình
+                return [(row_logits, not marker_ids.isdisjoint(ids)) for row_logits, ids in zip(logits, batch)]
+
+            labels = []
+            for chunks in run_chunked(encodings, forward, batch_size):
+                # Input dài: trung bình logits của các chunk có chứa thẻ (không có thì của mọi chunk)
+                outputs = [logits for _, (logits, has_marker) in chunks if has_marker] or [o[0] for _, o in chunks]
+                pred_id = int(np.mean(outputs, axis=0).argmax())
+                # Map ID -> Label từ Config
+                labels.append(RE_ID2LABEL.get(pred_id, "NO_RELATION"))
+            return labels
+
         else:
-            # ML: Vector hóa text (đã có tags) -> Predict
+            # ML: Vector hóa text (đã có tags) -> Predict một lần trên cả ma trận
             if not self.feature_extractor:
-                return "ERROR: Missing Feature Extractor"
-                
-            vec = self.feature_extractor.vectorize_sentence_level(text)
-            pred_id = self.model.predict([vec])[0]
-            
-            # Map ID -> Label
-            # Trường hợp dùng LabelEncoder của Sklearn
-            if self.label_encoder and hasattr(self.label_encoder, 'inverse_transform'):
-                return self.label_encoder.inverse_transform([pred_id])[0]
-            
-            # Trường hợp model trả về thẳng ID khớp với RE_ID2LABEL
-            return RE_ID2LABEL.get(int(pred_id), "NO_RELATION")
\ No newline at end of file
+                return ["ERROR: Missing Feature Extractor"] * len(texts)
+
+            vectors = self.feature_extractor.vectorize_sentence_level_many(texts, batch_size=batch_size)
+            pred_ids = self.model.predict(vectors)
+            return self._decode_labels(pred_ids)
+
+    def _decode_labels(self, pred_ids):
+        # Trường hợp dùng LabelEncoder của Sklearn
+        if self.label_encoder and hasattr(self.label_encoder, 'inverse_transform'):
+            return list(self.label_encoder.inverse_transform(pred_ids))
+
+        # Trường hợp model trả về thẳng ID khớp với RE_ID2LABEL
+        return [RE_ID2LABEL.get(int(pid), "NO_RELATION") for pid in pred_ids]
+
+    def predict_pairs(self, windows, batch_size=8):
+        """
+        Chế độ SPAN: mỗi cửa sổ chỉ encode một lần cho mọi cặp của nó.
+        Input: List (text, [(source_entity, target_entity), ...])
+        Output: List các list nhãn theo từng cặp (None nếu không định vị được thực thể).
+        """
+        results = [[None] * len(pairs) for _, pairs in windows]
+        # Sắp theo độ dài để mỗi batch pad ít nhất
+        active = sorted((i for i, (_, pairs) in enumerate(windows) if pairs), key=lambda i: len(windows[i][0]))
+
+        for start in range(0, len(active), batch_size):
+            batch_idx = active[start:start + batch_size]
+            # Cửa sổ dài được encode theo chunk chồng lấn, không bị cắt
+            logits, refs = self.model.predict_windows([windows[i] for i in batch_idx], self.device, batch_size)
+            if not refs:
+                continue
+            for (w, p), pred_id in zip(refs, logits.argmax(dim=-1).tolist()):
+                results[batch_idx[w]][p] = self.model.id2label.get(pred_id, "NO_RELATION")
+        return results
@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip("torch")
+
+from src.benchmark import run_combo, percentiles, compare
+
+ARTICLES = [
+    "Khoảng 8 giờ sáng nay, tại quốc lộ 1A thuộc huyện Phú Xuyên, Hà Nội, xe tải va chạm với xe máy. "
+    "Người điều khiển xe máy tử vong tại chỗ.",
+    "Chiều 12/3, trên đường Nguyễn Văn Linh, quận 7, TP.HCM, xe khách tông vào dải phân cách, 3 người bị thương.",
+]
+WINDOWS = ["Xe tải va chạm với xe máy trên quốc lộ 1A."]
+
+
+def test_run_combo_standin():
+    result = run_combo("CRF", "LOGREG", ARTICLES, WINDOWS, standin=True)
+    assert "error" not in result
+    assert {"article_latency_ms", "window_latency_ms", "stage_ms_per_article", "articles_per_sec",
+            "peak_rss_mb", "load_time_s", "entities", "relations"} <= set(result)
+    assert result["article_latency_ms"]["n"] == len(ARTICLES)
+    assert result["window_latency_ms"]["n"] == len(WINDOWS)
+    assert result["entities"] > 0
+    assert result["articles_per_sec"] > 0
+
+    # Cùng seed -> cùng số thực thể/quan hệ
+    again = run_combo("CRF", "LOGREG", ARTICLES, WINDOWS, standin=True)
+    assert (again["entities"], again["relations"]) == (result["entities"], result["relations"])
+
+
+def test_compare_flags_only_real_regressions():
+    base = {"results": {"CRF+LOGREG": {"article_latency_ms": percentiles([0.1, 0.1, 0.1]),
+                                       "articles_per_sec": 10.0}}}
+    slower = {"results": {"CRF+LOGREG": {"article_latency_ms": percentiles([0.2, 0.2, 0.2]),
+                                         "articles_per_sec": 5.0}}}
+    assert compare(base, base) == []
+    flagged = {name for _, name, *_ in compare(slower, base)}
+    assert {"article_latency_ms.p50", "articles_per_sec"} <= flagged
+    assert compare(base, slower) == []
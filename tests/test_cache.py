@@ -0,0 +1,114 @@
+import os
+import pytest
+
+from src import cache as cache_module
+from src.cache import ResultCache, make_key
+
+
+@pytest.fixture(autouse=True)
+def no_default_disk_dir(monkeypatch):
+    # TNGT_RESULT_CACHE_DIR của máy chạy test không được ảnh hưởng tới test chỉ dùng bộ nhớ
+    monkeypatch.setattr(cache_module, "RESULT_CACHE_DIR", None)
+
+
+def _files(directory):
+    return [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names]
+
+
+def test_hit_miss_and_stats():
+    cache = ResultCache(max_items=8)
+    key = make_key("scope", "Xe tải va chạm xe máy")
+    assert cache.get("ner", key) is None
+    cache.put("ner", key, [{"text": "xe tải", "label": "VEH"}])
+    assert cache.get("ner", key) == [{"text": "xe tải", "label": "VEH"}]
+    assert cache.get("re", key) is None # namespace khác
+
+    stats = cache.stats()
+    assert stats["namespaces"]["ner"] == {"hits": 1, "disk_hits": 0, "misses": 1, "hit_rate": 0.5}
+    assert stats["namespaces"]["re"]["misses"] == 1
+    assert stats["memory_items"] == 1 and stats["disk_items"] == 0
+
+
+def test_scope_changes_key():
+    assert make_key("model-a", "text") != make_key("model-b", "text")
+    assert make_key("model-a", "text") == make_key("model-a", "text")
+
+
+def test_returned_values_are_copies():
+    cache = ResultCache()
+    value = {"entities": [1, 2]}
+    cache.put("article", "k", value)
+    value["entities"].append(3)
+    first = cache.get("article", "k")
+    first["entities"].clear()
+    assert cache.get("article", "k") == {"entities": [1, 2]}
+
+
+def test_memory_lru_eviction():
+    cache = ResultCache(max_items=3)
+    for i in range(3):
+        cache.put("ner", f"k{i}", i)
+    assert cache.get("ner", "k0") == 0 # k0 thành mục dùng gần nhất -> k1 bị xóa trước
+    cache.put("ner", "k3", 3)
+    assert cache.get("ner", "k1") is None
+    assert [cache.get("ner", f"k{i}") for i in (0, 2, 3)] == [0, 2, 3]
+    assert cache.stats()["memory_items"] == 3
+
+
+def test_disk_tier_persists_across_instances(tmp_path):
+    ResultCache(disk_dir=str(tmp_path)).put("article", "abcd", {"entities": ["x"]})
+    fresh = ResultCache(disk_dir=str(tmp_path))
+    assert fresh.stats()["disk_items"] == 1
+    assert fresh.get("article", "abcd") == {"entities": ["x"]}
+    assert fresh.stats()["namespaces"]["article"]["disk_hits"] == 1
+    assert fresh.get("article", "abcd") == {"entities": ["x"]}
+    assert fresh.stats()["namespaces"]["article"]["hits"] == 1
+
+
+def test_disk_eviction_keeps_budget(tmp_path):
+    blob = "x" * 4000
+    cache = ResultCache(disk_dir=str(tmp_path), max_disk_mb=10000 / 2**20)
+    for i in range(10):
+        cache.put("re", f"{i:02d}key", blob)
+    files = _files(tmp_path)
+    assert sum(os.path.getsize(path) for path in files) <= 10000
+    assert len(files) == 2
+    # Các mục còn lại là mục ghi sau cùng
+    assert sorted(os.path.basename(path) for path in files) == ["08key.pkl", "09key.pkl"]
+
+
+def test_clear_empties_both_tiers(tmp_path):
+    cache = ResultCache(disk_dir=str(tmp_path))
+    for i in range(3):
+        cache.put("ner", f"{i:02d}key", i)
+    ResultCache(disk_dir=str(tmp_path)).put("re", "99key", "khác tiến trình")
+    cache.clear()
+    assert [cache.get("ner", f"{i:02d}key") for i in range(3)] == [None] * 3
+    assert _files(tmp_path) == []
+    stats = cache.stats()
+    assert stats["memory_items"] == stats["disk_items"] == 0 and stats["disk_mb"] == 0
+    assert ResultCache(disk_dir=str(tmp_path)).get("re", "99key") is None
+
+
+def test_pipeline_results_unchanged_with_cache():
+    pytest.importorskip("torch")
+    from src.pipeline import TNGTPipeline
+    from src.standins import StandInLoader
+
+    texts = [
+        "Khoảng 8 giờ sáng nay, tại quốc lộ 1A thuộc huyện Phú Xuyên, Hà Nội, xe tải va chạm với xe máy. "
+        "Người điều khiển xe máy tử vong tại chỗ.",
+        "Chiều 12/3, trên đường Nguyễn Văn Linh, quận 7, TP.HCM, xe khách tông vào dải phân cách, 3 người bị thương.",
+    ]
+    loader = StandInLoader()
+    ner_model, re_model = loader.load_ner_model("PHOBERT"), loader.load_re_model("PHOBERT")
+
+    def extract(pipeline):
+        return [(r["entities"], r["relations"]) for r in pipeline.run_many(texts)]
+
+    reference = extract(TNGTPipeline(ner_model, re_model))
+    cache = ResultCache()
+    cached = TNGTPipeline(ner_model, re_model, cache=cache)
+    assert extract(cached) == reference
+    assert extract(cached) == reference # lượt 2: lấy từ cache
+    assert cache.stats()["namespaces"]["article"]["hits"] == len(texts)
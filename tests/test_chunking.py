@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from src.chunking import split_chunks, stitch, run_chunked
+
+CLS, SEP = 0, 2
+MAX_LENGTH, STRIDE = 256, 64
+
+
+def _input(rng, n_body):
+    return [CLS, *rng.integers(5, 1000, size=n_body).tolist(), SEP]
+
+
+def _local_forward(radius, dim=8, seed=0):
+    """Forward giả có vùng nhìn cục bộ: output tại i chỉ phụ thuộc ids trong [i - radius, i + radius]"""
+    rng = np.random.default_rng(seed)
+    embed = rng.normal(size=(1000, dim))
+    weights = rng.normal(size=(2 * radius + 1, dim))
+
+    def encode(ids):
+        x = np.pad(embed[ids], ((radius, radius), (0, 0)))
+        return sum(weights[j] * x[j:j + len(ids)] for j in range(2 * radius + 1))
+
+    calls = []
+
+    def forward(batch):
+        calls.append([len(ids) for ids in batch])
+        return [encode(ids) for ids in batch]
+
+    return encode, forward, calls
+
+
+@pytest.mark.parametrize("n_body", [1, 100, 254, 255, 300, 500, 1000, 1777])
+def test_split_and_stitch_reconstruct_ids(n_body):
+    ids = _input(np.random.default_rng(n_body), n_body)
+    chunks = split_chunks(ids, MAX_LENGTH, STRIDE)
+    assert all(len(chunk) <= MAX_LENGTH for _, chunk in chunks)
+    assert all(chunk[0] == CLS and chunk[-1] == SEP for _, chunk in chunks)
+    assert len(chunks) == 1 if len(ids) <= MAX_LENGTH else len(chunks) > 1
+
+    stitched = stitch([(start, np.array(chunk)) for start, chunk in chunks])
+    assert stitched.tolist() == ids
+
+
+def test_run_chunked_matches_unchunked_reference():
+    rng = np.random.default_rng(0)
+    sequences = [_input(rng, n) for n in [10, 600, 254, 3, 1200, 255, 90]]
+    # Phần giữ lại của mỗi chunk cách biên chunk >= STRIDE / 2 -> bằng đúng khi radius nhỏ hơn
+    encode, forward, calls = _local_forward(radius=16)
+
+    outputs = run_chunked(sequences, forward, batch_size=4, max_length=MAX_LENGTH, stride=STRIDE)
+    assert len(outputs) == len(sequences)
+    for seq, chunks in zip(sequences, outputs):
+        assert [start for start, _ in chunks] == sorted(start for start, _ in chunks)
+        np.testing.assert_allclose(stitch(chunks), encode(seq), atol=1e-9)
+
+    assert all(len(batch) <= 4 for batch in calls)
+    assert all(length <= MAX_LENGTH for batch in calls for length in batch)
+    n_chunks = sum(len(split_chunks(seq, MAX_LENGTH, STRIDE)) for seq in sequences)
+    assert sum(len(batch) for batch in calls) == n_chunks
+
+
+def test_short_inputs_are_not_chunked():
+    rng = np.random.default_rng(1)
+    sequences = [_input(rng, n) for n in [5, 40, 254]]
+    encode, forward, calls = _local_forward(radius=3)
+    outputs = run_chunked(sequences, forward, batch_size=16, max_length=MAX_LENGTH, stride=STRIDE)
+    assert calls == [sorted(len(seq) for seq in sequences)]
+    for seq, chunks in zip(sequences, outputs):
+        assert len(chunks) == 1 and chunks[0][0] == 0
+        np.testing.assert_array_equal(chunks[0][1], encode(seq))
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+sklearn_crfsuite = pytest.importorskip("sklearn_crfsuite")
+
+from src.crf_decoder import ViterbiCRFDecoder
+
+N_FEATURES = 16
+LABELS = ["O", "B-LOC", "I-LOC", "B-VEH", "I-VEH"]
+
+
+def _items(vectors):
+    return [{f"d{i}": float(v) for i, v in enumerate(row)} for row in vectors]
+
+
+def _random_corpus(rng, n_sentences, max_len=20):
+    """Câu ngẫu nhiên, nhãn phụ thuộc đặc trưng (để CRF học được trọng số trạng thái + chuyển khác 0)"""
+    proj = rng.normal(size=(N_FEATURES, len(LABELS)))
+    corpus = []
+    for _ in range(n_sentences):
+        vectors = rng.normal(size=(rng.integers(1, max_len), N_FEATURES)).astype(np.float32)
+        labels = [LABELS[i] for i in (vectors @ proj).argmax(axis=1)]
+        corpus.append((vectors, labels))
+    return corpus
+
+
+@pytest.fixture(scope="module")
+def crf():
+    rng = np.random.default_rng(0)
+    corpus = _random_corpus(rng, 200)
+    model = sklearn_crfsuite.CRF(algorithm="lbfgs", c1=0.05, c2=0.05, max_iterations=50)
+    model.fit([_items(v) for v, _ in corpus], [labels for _, labels in corpus])
+    return model
+
+
+def test_viterbi_matches_crfsuite_label_for_label(crf):
+    decoder = ViterbiCRFDecoder(crf, n_features=N_FEATURES)
+    test = [v for v, _ in _random_corpus(np.random.default_rng(1), 100)]
+
+    expected = crf.predict([_items(v) for v in test])
+    assert decoder.decode_batch(test) == [list(labels) for labels in expected]
+
+
+def test_decode_batch_keeps_order_and_empty_inputs(crf):
+    decoder = ViterbiCRFDecoder(crf, n_features=N_FEATURES)
+    rng = np.random.default_rng(2)
+    long, short = rng.normal(size=(30, N_FEATURES)), rng.normal(size=(2, N_FEATURES))
+    empty = np.zeros((0, N_FEATURES))
+
+    batch = decoder.decode_batch([long, empty, short])
+    assert batch == [decoder.decode(long), [], decoder.decode(short)]
+    assert len(batch[0]) == 30 and len(batch[2]) == 2
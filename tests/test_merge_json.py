@@ -0,0 +1,54 @@
+import json
+
+from src.merge_json import iter_tasks, merge_exports
+
+
+def _task(article_id, ref_id, updated_at, label, text="..."):
+    data = {"article_id": article_id, "text": text}
+    if ref_id is not None:
+        data["ref_id"] = ref_id
+    return {"data": data,
+            "annotations": [{"updated_at": updated_at, "result": [{"value": {"labels": [label]}}]}]}
+
+
+def _write_array(path, tasks):
+    path.write_text(json.dumps(tasks, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def _write_jsonl(path, tasks):
+    path.write_text("".join(json.dumps(t, ensure_ascii=False) + "\n" for t in tasks), encoding="utf-8")
+
+
+def test_merge_keeps_newest_copy(tmp_path):
+    first, second, output = tmp_path / "a.json", tmp_path / "b.jsonl", tmp_path / "merged.jsonl"
+    _write_array(first, [
+        _task(1, 10, "2024-01-02T00:00:00Z", "LOC"),   # mới hơn bản trong b -> thắng
+        _task(1, 11, "2024-01-01T00:00:00Z", "VEH"),   # trùng nhãn với bản trong b
+        _task(2, 20, "2024-01-01T00:00:00Z", "LOC"),
+        _task(3, None, "2024-01-01T00:00:00Z", "LOC"), # không có ref_id -> luôn giữ
+    ])
+    _write_jsonl(second, [
+        _task(1, 10, "2024-01-01T00:00:00Z", "VEH"),   # cũ hơn, khác nhãn -> conflict
+        _task(1, 11, "2024-01-01T00:00:00Z", "VEH"),   # bằng thời gian -> bản của file sau thắng
+        _task(3, None, "2024-01-01T00:00:00Z", "LOC"),
+    ])
+
+    stats = merge_exports([str(first), str(second)], str(output))
+    assert stats == {"files": 2, "tasks": 7, "unique": 5, "duplicates": 2, "conflicts": 1, "no_ref_id": 2}
+
+    merged = list(iter_tasks(str(output)))
+    by_key = {(t["data"]["article_id"], t["data"].get("ref_id")): t for t in merged}
+    assert by_key[(1, 10)]["annotations"][0]["updated_at"] == "2024-01-02T00:00:00Z"
+    assert by_key[(1, 10)]["annotations"][0]["result"][0]["value"]["labels"] == ["LOC"]
+    assert sum(t["data"].get("ref_id") is None for t in merged) == 2
+    # Thứ tự xuất hiện của bản thắng: (1,10) và (2,20) từ file a, (1,11) từ file b
+    assert [t["data"].get("ref_id") for t in merged] == [10, 20, None, 11, None]
+
+
+def test_iter_tasks_reads_across_buffer_boundaries(tmp_path):
+    tasks = [_task(i, i, "2024-01-01T00:00:00Z", "LOC", text="xe máy " * (i * 7)) for i in range(50)]
+    array_path, jsonl_path = tmp_path / "a.json", tmp_path / "a.jsonl"
+    _write_array(array_path, tasks)
+    _write_jsonl(jsonl_path, tasks)
+    assert list(iter_tasks(str(array_path), block_size=64)) == tasks
+    assert list(iter_tasks(str(jsonl_path), block_size=64)) == tasks
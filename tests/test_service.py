@@ -0,0 +1,134 @@
+import json
+import time
+import asyncio
+import pytest
+
+pytest.importorskip("torch")
+
+from src.service import ExtractionService, MicroBatcher, QueueFullError
+from src.standins import StandInLoader
+
+TEXTS = [
+    "Khoảng 8 giờ sáng nay, tại quốc lộ 1A thuộc huyện Phú Xuyên, Hà Nội, xe tải va chạm với xe máy. "
+    "Người điều khiển xe máy tử vong tại chỗ.",
+    "Chiều 12/3, trên đường Nguyễn Văn Linh, quận 7, TP.HCM, xe khách tông vào dải phân cách, 3 người bị thương.",
+]
+
+
+async def _request(port, method, path, body=b"", headers=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    lines = [f"{method} {path} HTTP/1.1", "Host: test"]
+    if headers is None:
+        headers = {"Content-Length": str(len(body))} if body else {}
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, _, payload = response.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    if b"application/json" in head:
+        return status, json.loads(payload)
+    return status, payload.decode("utf-8")
+
+
+def _post(port, payload, **kwargs):
+    return _request(port, "POST", "/extract", json.dumps(payload).encode("utf-8"), **kwargs)
+
+
+def _run(scenario, **options):
+    """Chạy scenario(port, service) với một server thật trên cổng ngẫu nhiên"""
+    async def main():
+        service = ExtractionService(StandInLoader(), max_wait_ms=1, **options)
+        server = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await scenario(port, service)
+    return asyncio.run(main())
+
+
+def test_extract_health_metrics():
+    async def scenario(port, service):
+        single = await _post(port, {"text": TEXTS[0], "ner_model": "CRF", "re_model": "LOGREG"})
+        many = await _post(port, {"texts": TEXTS, "ner_model": "CRF", "re_model": "LOGREG"})
+        health = await _request(port, "GET", "/health")
+        metrics = await _request(port, "GET", "/metrics")
+        return single, many, health, metrics
+
+    single, many, health, metrics = _run(scenario)
+
+    status, result = single
+    assert status == 200
+    assert {"entities", "relations"} <= set(result)
+
+    status, results = many
+    assert status == 200 and len(results) == len(TEXTS)
+    # Cùng bài, cùng model -> cùng kết quả dù đi chung batch với bài khác
+    assert results[0]["entities"] == result["entities"]
+    assert results[0]["relations"] == result["relations"]
+
+    status, health = health
+    assert status == 200 and health["status"] == "ok"
+    assert health["pipelines"] == ["CRF+LOGREG"]
+    assert set(health["batchers"]) == {"NER_CRF", "RE_LOGREG"}
+
+    status, text = metrics
+    assert status == 200
+    assert "tngt_run_seconds" in text
+    assert "tngt_stage_seconds" in text
+
+
+def test_request_errors():
+    async def scenario(port, service):
+        return [
+            await _post(port, {"text": TEXTS[0]}, headers={"Content-Length": "abc"}),
+            await _post(port, {"text": TEXTS[0]}, headers={"Content-Length": "-5"}),
+            await _post(port, {"text": TEXTS[0], "ner_model": "NOPE"}),
+            await _post(port, {"text": ""}),
+            await _request(port, "GET", "/extract"),
+            await _request(port, "GET", "/nope"),
+        ]
+
+    responses = _run(scenario)
+    assert [status for status, _ in responses] == [400, 400, 400, 400, 405, 404]
+
+
+def test_request_larger_than_max_queue():
+    async def scenario(port, service):
+        return await _post(port, {"texts": TEXTS * 3, "ner_model": "CRF", "re_model": "LOGREG"}), service
+
+    # Segment NER và input RE của 6 bài vượt xa max_queue -> vẫn chạy hết, theo từng phần
+    (status, results), service = _run(scenario, max_queue=4)
+    assert status == 200 and len(results) == 6
+    (_, reference), _ = _run(scenario)
+    assert [(r["entities"], r["relations"]) for r in results] == \
+           [(r["entities"], r["relations"]) for r in reference]
+    batchers = service.health()["batchers"]
+    assert all(info["pending"] == 0 and info["rejected"] == 0 for info in batchers.values())
+    assert batchers["RE_LOGREG"]["items"] > 4
+
+
+def test_micro_batcher_splits_and_rejects_while_waiting():
+    sizes = []
+
+    def fn(items):
+        sizes.append(len(items))
+        time.sleep(0.01)
+        return [item * 10 for item in items]
+
+    async def main():
+        batcher = MicroBatcher("T", fn, max_batch=3, max_wait_ms=1, max_queue=5)
+        big = asyncio.ensure_future(batcher.submit(list(range(12))))
+        await asyncio.sleep(0)
+        # Request lớn đang chờ chỗ -> request khác nhận 503 thay vì chen vào
+        with pytest.raises(QueueFullError):
+            await batcher.submit([100])
+        results = await big
+        return results, await batcher.submit(list(range(5))), batcher.info()
+
+    results, small, info = asyncio.run(main())
+    assert results == [i * 10 for i in range(12)]
+    assert small == [i * 10 for i in range(5)]
+    assert max(sizes) <= 3 and sum(sizes) == 17
+    assert info["pending"] == 0 and info["rejected"] == 1 and not info["waiting"]
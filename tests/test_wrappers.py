@@ -0,0 +1,23 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from src.config import SPECIAL_TOKENS
+from src.wrappers import REPredictor
+
+
+class _Tokenizer:
+    def __init__(self, tokens):
+        self.vocab = {token: i for i, token in enumerate(["<s>", "</s>", "xe", "máy", *tokens])}
+
+    def get_vocab(self):
+        return dict(self.vocab)
+
+
+def test_re_predictor_requires_marker_tokens():
+    with pytest.raises(ValueError, match="add_marker_tokens"):
+        REPredictor('DL', torch.nn.Linear(2, 2), tokenizer=_Tokenizer([]))
+    with pytest.raises(ValueError, match="Typed Marker"):
+        REPredictor('DL', torch.nn.Linear(2, 2), tokenizer=_Tokenizer(SPECIAL_TOKENS[:-1]))
+    predictor = REPredictor('DL', torch.nn.Linear(2, 2), tokenizer=_Tokenizer(SPECIAL_TOKENS))
+    assert predictor.tokenizer.get_vocab().keys() >= set(SPECIAL_TOKENS)